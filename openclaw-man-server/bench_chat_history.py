@@ -0,0 +1,73 @@
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from openclaw_man_server import config
+from openclaw_man_server.chat_history import ChatHistoryService
+from openclaw_man_server.io_executor import IOExecutor
+from openclaw_man_server.loop_monitor import LoopLagMonitor
+
+MESSAGES_PER_USER = 200
+USER_COUNTS = [1, 2, 4, 8, 16, 32]
+
+
+async def run_round(service: ChatHistoryService, users: int) -> float:
+    """users 个用户并发保存消息，返回每秒写入条数"""
+    async def writer(user_id: str):
+        for i in range(MESSAGES_PER_USER):
+            await service.save_message(
+                user_id=user_id,
+                sender="user",
+                text=f"压测消息 {i}",
+                robot_id="bench_robot",
+                conversation_id="bench_conv"
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(f"bench_{users}_{u}") for u in range(users)))
+    elapsed = time.perf_counter() - start
+    return users * MESSAGES_PER_USER / elapsed
+
+
+async def bench(service: ChatHistoryService, label: str):
+    monitor = LoopLagMonitor().start()
+    print("=" * 60)
+    print(f"📈 聊天记录写入吞吐 - {label} (每用户 {MESSAGES_PER_USER} 条)")
+    print("=" * 60)
+    baseline = None
+    for users in USER_COUNTS:
+        monitor.reset()
+        rate = await run_round(service, users)
+        baseline = baseline or rate
+        lag = monitor.stats()
+        print(
+            f"并发用户 {users:>3}: {rate:>10.0f} 条/秒  (x{rate / baseline:.2f})"
+            f"  事件循环延迟 avg {lag['avg_lag_ms']:.2f}ms / max {lag['max_lag_ms']:.2f}ms"
+        )
+    await monitor.stop()
+    print(f"存活的用户锁数量: {len(service.user_locks)}")
+    print()
+
+
+async def main():
+    """压测聊天记录写入吞吐随并发用户数的变化，并对比文件 I/O 是否阻塞事件循环"""
+    # 使用临时目录，避免污染项目下的 chat_history/
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config.get_config().setdefault("chat_history", {})["directory"] = tmp_dir
+
+        service = ChatHistoryService()
+        service.io = IOExecutor(max_workers=0)
+        await bench(service, "在事件循环中执行 I/O")
+
+        service = ChatHistoryService()
+        service.io = IOExecutor(max_workers=8)
+        await bench(service, "I/O 线程池 (8 线程)")
+        service.io.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
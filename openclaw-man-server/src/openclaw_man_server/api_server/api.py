@@ -1,19 +1,29 @@
-from fastapi import FastAPI, Depends, HTTPException, status, APIRouter, UploadFile, File, Query, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Depends, HTTPException, status, APIRouter, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import inspect, text
 from typing import List, Optional
 from contextlib import asynccontextmanager
 from jose import jwt, JWTError
 from datetime import datetime
+import json
 import os
+import stat as stat_module
 import uuid
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 
 from . import crud, models, schemas, auth
-from .database import SessionLocal, engine, create_database_if_not_exists
+from .database import SessionLocal, engine, create_database_if_not_exists, dispose_async_engine
 from ..config import get_upload_config, ensure_upload_directory
-from ..chat_history import get_chat_history_service
+from ..chat_history import get_chat_history_service, decode_export_cursor
+from ..chat_persistence import get_chat_persistence_queue
+from ..io_executor import shutdown_io_executor
+from ..upload_service import get_upload_service, unique_filename
+from ..upload_store.batch import BatchFormatError, BatchTooLarge
+from ..upload_store.sessions import ChecksumMismatch, OffsetMismatch, SessionIncomplete, SessionNotFound
+from ..upload_store.blob_store import is_sha256
+from ..upload_store.streaming import UploadTooLarge
 from ..ws_server.bridge import ManServerServer
 
 def check_and_update_schema(engine):
@@ -47,7 +57,12 @@ async def lifespan(app: FastAPI):
     
     print("数据库初始化完成。")
     yield
-    # 关闭时 (如果需要)
+    # 关闭时: 将写回队列中尚未落盘的聊天记录写完
+    await get_chat_persistence_queue().close()
+    get_chat_history_service().close()
+    await get_upload_service().close()
+    await dispose_async_engine()
+    shutdown_io_executor()
 
 app = FastAPI(
     title="OpenClaw ManServer API",
@@ -64,10 +79,13 @@ router = APIRouter()
 
 # --- Upload Endpoints (Protected) ---
 
+# multipart 请求体中除文件内容外的边界与头部开销上限
+MULTIPART_OVERHEAD = 64 * 1024
+
 @router.post("/upload/file", response_model=schemas.UploadResponse, summary="上传文件")
 async def upload_file(
-    user_id: str = Query(..., description="用户ID"),
-    file: UploadFile = File(...)
+    request: Request,
+    user_id: str = Query(..., description="用户ID")
 ):
     """
     上传单个文件到服务器
@@ -76,6 +94,10 @@ async def upload_file(
     - 返回文件的完整路径（相对于服务器）
     - 支持图片、文档、视频等常见格式
     - 文件将保存在以 user_id 命名的子目录中
+    - 请求体为 multipart/form-data，保存其中第一个文件（字段名通常为 file）
+    - 边接收边解析并写入临时文件、计算 SHA-256，请求体不经过额外的缓存；
+      声明的长度或已接收的内容超过大小限制时立即中止
+    - 按内容去重：相同内容只保存一份，用户目录中的文件指向共享的 blob
     """
     upload_config = get_upload_config()
     
@@ -84,56 +106,367 @@ async def upload_file(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="文件上传功能已禁用"
         )
-    
-    original_filename = file.filename
-    file_ext = Path(original_filename).suffix.lower()
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    unique_filename = f"{Path(original_filename).stem}_{timestamp}{file_ext}"
-    
-    upload_dir = ensure_upload_directory(user_id)
-    file_path = upload_dir / unique_filename
-    
+
+    max_size = upload_config.get("max_file_size", 10 * 1024 * 1024)
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"文件大小超过限制，最大允许 {max_size // (1024*1024)} MB"
+    )
+    # 声明的请求体长度已超限时不读取请求体
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise too_large
+
     try:
-        content = await file.read()
-        
-        max_size = upload_config.get("max_file_size", 10 * 1024 * 1024)
-        if len(content) > max_size:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=f"文件大小超过限制，最大允许 {max_size // (1024*1024)} MB"
-            )
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
-            
-    except HTTPException:
-        raise
-    except Exception as e:
+        part = await get_upload_service().save_form_file(
+            user_id, request.headers.get("content-type", ""), request.stream()
+        )
+    except UploadTooLarge:
+        raise too_large
+    except BatchFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if part is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请求中没有文件"
+        )
+    if not part.success:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"文件保存失败: {str(e)}"
+            detail=part.error
         )
     
-    full_path = str(file_path).replace("\\", "/")
-    
     return schemas.UploadResponse(
         success=True,
-        file_name=unique_filename,
-        file_size=len(content),
+        file_name=part.file_name,
+        file_size=part.stored.size,
+        sha256=part.stored.sha256,
+        message="文件上传成功"
+    )
+
+@router.post("/upload/batch", response_model=schemas.BatchUploadResponse, summary="批量上传文件")
+async def upload_batch(
+    request: Request,
+    user_id: str = Query(..., description="用户ID")
+):
+    """
+    一个 multipart/form-data 请求上传多个文件（字段名任意，每个文件一个部分）
+
+    - 边接收边写盘：每个文件的内容一到就开始写入并计算 SHA-256，多个文件的写盘并行
+    - 单个文件超过 max_file_size 或保存失败只影响该文件，结果逐个返回
+    - 单次最多 upload.batch.max_files 个文件，内容总大小不超过 upload.batch.max_total_size；
+      接收过程中超过总大小时停止读取，已完成的文件保留（truncated 为 true）
+    - 按内容去重，与 /upload/file 相同
+    """
+    upload_config = get_upload_config()
+    if not upload_config.get("enabled", True):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="文件上传功能已禁用"
+        )
+
+    upload_service = get_upload_service()
+    max_total_size = upload_service.batch_max_total_size
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_total_size + MULTIPART_OVERHEAD:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(BatchTooLarge(max_total_size))
+        )
+
+    try:
+        parts, truncated = await upload_service.save_batch(
+            user_id, request.headers.get("content-type", ""), request.stream()
+        )
+    except BatchFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if not parts:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请求中没有文件"
+        )
+
+    files = []
+    for part in parts:
+        item = schemas.BatchUploadItem(index=part.index, original_name=part.original_name, success=part.success)
+        if part.success:
+            item.file_name = part.file_name
+            item.file_size = part.stored.size
+            item.sha256 = part.stored.sha256
+            item.message = "文件上传成功"
+        else:
+            item.message = part.error
+        files.append(item)
+    succeeded = sum(1 for part in parts if part.success)
+
+    message = "文件上传成功" if succeeded == len(parts) else f"{len(parts) - succeeded} 个文件上传失败"
+    if truncated:
+        message = f"{BatchTooLarge(max_total_size)}，之后的文件未接收"
+    return schemas.BatchUploadResponse(
+        success=succeeded == len(parts) and not truncated,
+        total=len(parts),
+        succeeded=succeeded,
+        failed=len(parts) - succeeded,
+        total_size=sum(part.stored.size for part in parts if part.success),
+        truncated=truncated,
+        message=message,
+        files=files
+    )
+
+@router.post("/upload/link", response_model=schemas.UploadResponse, summary="按内容哈希秒传文件")
+async def link_uploaded_file(
+    user_id: str = Query(..., description="用户ID"),
+    file_name: str = Query(..., description="原始文件名"),
+    sha256: str = Query(..., description="文件内容的 SHA-256（小写十六进制）")
+):
+    """
+    服务器上已有相同内容时直接为用户建立文件，无需再上传内容
+
+    - 内容不存在时返回 404，客户端再调用 /upload/file 上传
+    - 响应与 /upload/file 一致
+    """
+    upload_config = get_upload_config()
+    if not upload_config.get("enabled", True):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="文件上传功能已禁用"
+        )
+    sha256 = sha256.lower()
+    if not is_sha256(sha256):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="sha256 格式错误"
+        )
+
+    file_name = unique_filename(file_name)
+    stored = await get_upload_service().link_existing(user_id, file_name, sha256)
+    if stored is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="服务器上没有该内容，请上传文件"
+        )
+
+    return schemas.UploadResponse(
+        success=True,
+        file_name=file_name,
+        file_size=stored.size,
+        sha256=stored.sha256,
+        message="文件上传成功"
+    )
+
+def _session_response(session) -> dict:
+    return {
+        "session_id": session.session_id,
+        "user_id": session.user_id,
+        "file_name": session.file_name,
+        "size": session.size,
+        "offset": session.offset,
+        "expires_at": get_upload_service().sessions.expires_at(session)
+    }
+
+def _session_not_found(session_id: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"上传会话不存在或已过期: {session_id}"
+    )
+
+@router.post("/upload/sessions", summary="创建可续传上传会话")
+async def create_upload_session(
+    user_id: str = Query(..., description="用户ID"),
+    file_name: str = Query(..., description="原始文件名"),
+    size: int = Query(..., ge=1, description="文件总字节数")
+):
+    """
+    创建可续传的上传会话，之后用 PUT 按 offset 分段上传内容
+
+    - 会话持久化在磁盘上，服务重启后仍可继续上传
+    - 超过 upload.resumable.session_ttl 秒没有写入的会话自动过期
+    """
+    upload_config = get_upload_config()
+    if not upload_config.get("enabled", True):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="文件上传功能已禁用"
+        )
+    try:
+        session = await get_upload_service().create_session(user_id, file_name, size)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    return _session_response(session)
+
+@router.get("/upload/sessions/{session_id}", summary="查询上传进度")
+async def get_upload_session(session_id: str):
+    """
+    返回服务器已收到的字节数 offset，客户端断线后从该位置继续上传
+    """
+    try:
+        session = await get_upload_service().get_session(session_id)
+    except SessionNotFound:
+        raise _session_not_found(session_id)
+    return _session_response(session)
+
+@router.put("/upload/sessions/{session_id}", summary="上传一段内容")
+async def put_upload_chunk(
+    session_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="本段内容在文件中的起始位置")
+):
+    """
+    请求体为原始二进制内容（application/octet-stream），从 offset 开始追加
+
+    - offset 必须等于服务器已收到的字节数，否则返回 409 与当前 offset
+    - 超出创建会话时声明的大小返回 413
+    - 连接中途断开时已收到的部分会保留
+    """
+    try:
+        session = await get_upload_service().write_chunk(session_id, offset, request.stream())
+    except SessionNotFound:
+        raise _session_not_found(session_id)
+    except OffsetMismatch as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": str(e), "offset": e.offset}
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    return _session_response(session)
+
+@router.post("/upload/sessions/{session_id}/complete", response_model=schemas.UploadResponse, summary="完成上传")
+async def complete_upload_session(
+    session_id: str,
+    sha256: Optional[str] = Query(default=None, description="可选: 文件内容的 SHA-256，用于校验")
+):
+    """
+    内容上传完整后保存为用户文件，响应与 /upload/file 一致
+    """
+    try:
+        stored = await get_upload_service().complete_session(session_id, sha256)
+    except SessionNotFound:
+        raise _session_not_found(session_id)
+    except SessionIncomplete as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": str(e), "offset": e.offset}
+        )
+    except ChecksumMismatch as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+    return schemas.UploadResponse(
+        success=True,
+        file_name=stored.path.name,
+        file_size=stored.size,
+        sha256=stored.sha256,
         message="文件上传成功"
     )
 
+@router.delete("/upload/sessions/{session_id}", summary="放弃上传会话")
+async def abort_upload_session(session_id: str):
+    """
+    删除会话与已上传的内容
+    """
+    try:
+        await get_upload_service().abort_session(session_id)
+    except SessionNotFound:
+        raise _session_not_found(session_id)
+    return {"success": True, "message": f"上传会话 {session_id} 已取消"}
+
+@router.delete("/upload/file", summary="删除文件")
+async def delete_uploaded_file(
+    user_id: str = Query(..., description="用户ID"),
+    file_name: str = Query(..., description="文件名")
+):
+    """
+    删除用户目录下的文件，内容不再被任何文件引用时回收存储空间
+    """
+    deleted = await get_upload_service().delete(user_id, file_name)
+    if not deleted:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"文件不存在: {file_name}"
+        )
+
+    return {
+        "success": True,
+        "message": f"文件 {file_name} 已删除"
+    }
+
+@router.get("/upload/files", summary="列出用户文件")
+async def list_uploaded_files(
+    user_id: str = Query(..., description="用户ID"),
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: Optional[str] = Query(default=None, description="游标: 上一页返回的 next_cursor")
+):
+    """
+    从文件元数据索引分页列出用户文件，按修改时间从新到旧
+
+    - 不遍历上传目录，也不逐个 stat 文件
+    - total 为用户文件总数
+    """
+    before = None
+    if cursor:
+        mtime, sep, name = cursor.partition(":")
+        if not sep or not mtime.isdigit():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"无效的游标: {cursor}"
+            )
+        before = (int(mtime), name)
+
+    entries, total = await get_upload_service().list_files(user_id, limit, before)
+    next_cursor = None
+    if len(entries) == limit:
+        next_cursor = f"{entries[-1].mtime}:{entries[-1].name}"
+    return {
+        "user_id": user_id,
+        "total": total,
+        "files": [entry.to_dict() for entry in entries],
+        "next_cursor": next_cursor
+    }
+
+@router.get("/upload/stats", summary="获取上传去重统计")
+async def get_upload_stats():
+    """
+    返回新写入的 blob 数、去重命中次数与节省的写入字节数
+    """
+    return get_upload_service().stats()
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 使用弱比较：忽略 W/ 前缀"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """按 If-None-Match（优先）或 If-Modified-Since 判断客户端缓存是否仍然有效"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
 @router.get("/download/file", summary="下载文件")
 async def download_file(
+    request: Request,
     user_id: str = Query(..., description="用户ID"),
-    file_name: str = Query(..., description="文件名")
+    file_name: str = Query(..., description="文件名"),
+    variant: Optional[str] = Query(default=None, description="图片变体: thumb（缩略图）/ preview（预览图）")
 ):
     """
     根据文件名下载用户目录下的文件
     
     - 文件必须位于以 user_id 命名的子目录中
     - 返回文件内容
+    - 支持 Range 分段下载（206），If-Range 按 ETag / Last-Modified 校验
+    - ETag 为内容的 SHA-256（去重之前上传的文件使用 inode + 修改时间 + 大小），
+      If-None-Match / If-Modified-Since 命中时返回 304
+    - 上传文件内容不会原地修改，响应带长期缓存头
+    - 图片可通过 variant 下载缩略图 / 预览图（JPEG）；变体无法生成（失败、超时或队列已满）时返回原图，
+      此时使用单独的 ETag 且不允许缓存，客户端下次请求会重新尝试变体
     """
     if not file_name:
         raise HTTPException(
@@ -141,27 +474,58 @@ async def download_file(
             detail="必须提供文件名"
         )
     
-    upload_dir = ensure_upload_directory(user_id)
-    target_path = upload_dir / file_name
-    
-    if not target_path.exists():
+    upload_service = get_upload_service()
+    found = None
+    media_type = "application/octet-stream"
+    download_name = file_name
+    fallback = False
+    if variant:
+        if upload_service.media and variant not in upload_service.media.variants:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"未知的图片变体: {variant}"
+            )
+        found = await upload_service.stat_variant(user_id, file_name, variant)
+        if found is not None:
+            media_type = "image/jpeg"
+            download_name = f"{Path(file_name).stem}_{variant}.jpg"
+    if found is None:
+        fallback = variant is not None
+        found = await upload_service.stat_download(user_id, file_name)
+    if found is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"文件不存在: {file_name}"
         )
+    target_path, stat_result, etag = found
     
-    if not target_path.is_file():
+    if not stat_module.S_ISREG(stat_result.st_mode):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"路径不是文件: {file_name}"
         )
-    
-    filename = target_path.name
+
+    if fallback:
+        # 以原图代替变体：ETag 与原图区分，且不缓存，避免原图长期占用变体的缓存
+        etag = f'{etag[:-1]}-original"'
+        cache_control = "no-store"
+    else:
+        max_age = int(get_upload_config().get("cache_max_age", 31536000))
+        cache_control = f"private, max-age={max_age}, immutable"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+    }
+    if _not_modified(request, etag, stat_result.st_mtime):
+        headers["Last-Modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
     
     return FileResponse(
         path=str(target_path),
-        filename=filename,
-        media_type="application/octet-stream"
+        filename=download_name,
+        media_type=media_type,
+        stat_result=stat_result,
+        headers=headers
     )
 
 # --- Chat History Endpoints ---
@@ -171,31 +535,149 @@ async def get_chat_history(
     user_id: str,
     limit: int = Query(default=100, ge=1, le=500),
     offset: int = Query(default=0, ge=0),
-    conversation_id: Optional[str] = Query(default=None)
+    conversation_id: Optional[str] = Query(default=None),
+    before_id: Optional[str] = Query(default=None, description="游标: 返回该消息之前的记录"),
+    after_id: Optional[str] = Query(default=None, description="游标: 返回该消息之后的记录")
 ):
     """
     获取指定用户的聊天记录
     
     - 支持分页（limit, offset）
+    - 支持游标分页（before_id / after_id，与 offset 互斥）
     - 支持按对话 ID 过滤
     - 最多返回 100 条（可通过 limit 参数调整，最大 500）
+    - total 为符合条件的记录总数（不是当前页条数）
     """
+    if before_id and after_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="before_id 与 after_id 不能同时使用"
+        )
+
     chat_service = get_chat_history_service()
-    history = await chat_service.get_history(
+    try:
+        page = await chat_service.query_history(
+            user_id=user_id,
+            limit=limit,
+            offset=offset,
+            conversation_id=conversation_id,
+            before_id=before_id,
+            after_id=after_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    messages = page["messages"]
+    
+    return {
+        "user_id": user_id,
+        "total": page["total"],
+        "limit": limit,
+        "offset": offset,
+        "messages": messages,
+        "has_more_before": page["has_more_before"],
+        "has_more_after": page["has_more_after"],
+        "before_id": messages[0]["id"] if messages and page["has_more_before"] else None,
+        "after_id": messages[-1]["id"] if messages and page["has_more_after"] else None
+    }
+
+@router.get("/chat/history/{user_id}/search", summary="搜索用户聊天记录")
+async def search_chat_history(
+    user_id: str,
+    q: str = Query(..., min_length=1, max_length=200, description="搜索关键词"),
+    limit: int = Query(default=20, ge=1, le=100),
+    conversation_id: Optional[str] = Query(default=None),
+    robot_id: Optional[str] = Query(default=None),
+    before_id: Optional[str] = Query(default=None, description="游标: 返回该条结果之后（更早）的匹配记录")
+):
+    """
+    全文搜索指定用户的聊天记录（包括归档记录）
+
+    - 中日韩文字按字 / 二元组切分，其余按单词匹配（不区分大小写）
+    - 支持按对话 ID、机器人 ID 过滤
+    - 结果按时间从新到旧排列，使用响应中的 before_id 翻页
+    """
+    chat_service = get_chat_history_service()
+    if not chat_service.search:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="聊天记录搜索未启用"
+        )
+    page = await chat_service.search_history(
         user_id=user_id,
+        query=q,
         limit=limit,
-        offset=offset,
-        conversation_id=conversation_id
+        conversation_id=conversation_id,
+        robot_id=robot_id,
+        before_id=before_id
     )
-    
+
     return {
         "user_id": user_id,
-        "total": len(history),
+        "query": q,
         "limit": limit,
-        "offset": offset,
-        "messages": history
+        "messages": page["messages"],
+        "has_more": page["has_more"],
+        "before_id": page["before_id"]
     }
 
+@router.get("/chat/export", summary="流式导出聊天记录 (NDJSON)")
+async def export_chat_history(
+    user_id: Optional[List[str]] = Query(default=None, description="要导出的用户 ID，可重复；为空时导出全部用户"),
+    conversation_id: Optional[str] = Query(default=None),
+    since: Optional[int] = Query(default=None, description="起始时间戳（秒，包含）"),
+    until: Optional[int] = Query(default=None, description="结束时间戳（秒，包含）"),
+    cursor: Optional[str] = Query(default=None, description="续传游标: 上次最后收到的一行中的 cursor")
+):
+    """
+    以 NDJSON 流式导出聊天记录（包括归档记录），每行一条:
+    {"user_id": ..., "cursor": ..., "message": {...}}
+
+    - 用户按 ID 升序，每个用户内按时间顺序
+    - 服务端逐段读取存储，内存占用与导出总量无关
+    - 连接中断后带上最后收到的 cursor 重新请求即可从断点继续
+    """
+    if since is not None and until is not None and since > until:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="since 不能大于 until"
+        )
+    start = None
+    if cursor:
+        try:
+            start = decode_export_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    chat_service = get_chat_history_service()
+
+    async def generate():
+        async for batch in chat_service.export_history(
+            user_ids=user_id,
+            conversation_id=conversation_id,
+            since=since,
+            until=until,
+            start=start
+        ):
+            yield "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@router.get("/chat/search/stats", summary="获取聊天记录搜索索引统计")
+async def get_chat_search_stats():
+    """
+    返回常驻内存的用户索引数、词项数与索引建立次数
+    """
+    chat_service = get_chat_history_service()
+    return chat_service.search_stats()
+
+@router.get("/chat/cache/stats", summary="获取聊天记录缓存统计")
+async def get_chat_cache_stats():
+    """
+    返回聊天记录缓存的条目数、内存占用估算与命中/未命中计数
+    """
+    chat_service = get_chat_history_service()
+    return chat_service.cache_stats()
+
 @router.delete("/chat/history/{user_id}", summary="清空用户聊天记录")
 async def clear_chat_history(user_id: str):
     """
@@ -212,6 +694,13 @@ async def clear_chat_history(user_id: str):
 # --- WebSocket Endpoint ---
 ws_server = ManServerServer()
 
+@router.get("/ws/connections", summary="获取 WebSocket 连接状态")
+async def get_ws_connections():
+    """
+    返回当前在线的机器人与用户连接，以及每个连接的发送队列深度、丢弃计数
+    """
+    return ws_server.get_connection_stats()
+
 @router.websocket("/v1/stream")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket 端点，与 API 共用同一端口"""
@@ -6,8 +6,8 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from .database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import get_async_db
 from . import crud, models, schemas
 
 # 配置
@@ -58,14 +58,7 @@ async def jscode2session(appid: str, secret: str, js_code: str):
         return data
 
 # 依赖项
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -80,7 +73,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
         
-    user = crud.get_user(db, user_id=int(user_id))
+    user = await crud.get_user(db, user_id=int(user_id))
     if user is None:
         raise credentials_exception
     return user
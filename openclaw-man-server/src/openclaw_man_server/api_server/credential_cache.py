@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from ..config import get_config
+
+# loader 的返回值: (验证结果, 缓存秒数)；结果为 None 表示凭证无效，缓存秒数为 None 时使用默认值
+LoadResult = Tuple[Optional[Any], Optional[float]]
+
+
+def robot_key(api_key_hash: str) -> Tuple[str, str]:
+    """机器人凭证的缓存键，使用数据库中保存的 API Key MD5"""
+    return ("robot", api_key_hash)
+
+
+def token_key(token: str) -> Tuple[str, str]:
+    """用户 Token 的缓存键"""
+    return ("user", hashlib.sha256(token.encode()).hexdigest())
+
+
+class CredentialCache:
+    """
+    已验证凭证的有界 TTL 缓存（WebSocket 连接路径上的 API Key / JWT 验证）
+
+    - 键由调用方给出，例如 ("robot", API Key 的 MD5)、("user", Token 的摘要)，内存中不保存原始凭证
+    - 有效凭证缓存 ttl 秒；无效凭证缓存 negative_ttl 秒，用错误 Key 反复重连时不会每次都查数据库
+    - 同一凭证的并发验证只执行一次 loader，其余等待同一结果
+    - loader 抛出异常（例如数据库不可用）时不缓存，下次重新验证
+    - 超过 max_entries 时淘汰最久未使用的条目
+
+    只在当前进程内失效：机器人被删除时 crud 会调用 invalidate，其他进程最多在 ttl 秒后失效
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300, negative_ttl: float = 30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # 键 -> (结果, 过期时刻 monotonic)
+        self._entries: "OrderedDict[Hashable, Tuple[Optional[Any], float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # 统计信息
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Optional[Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _store(self, key: Hashable, value: Optional[Any], ttl: Optional[float]):
+        default_ttl = self.ttl if value is not None else self.negative_ttl
+        ttl = default_ttl if ttl is None else min(ttl, default_ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def resolve(self, key: Hashable, loader: Callable[[], Awaitable[LoadResult]]) -> Optional[Any]:
+        """返回缓存的验证结果，未命中时调用 loader 验证并缓存"""
+        hit, value = self._lookup(key)
+        if hit:
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value, ttl = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有并发等待方时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            # 验证期间被 invalidate 的键不写入缓存，避免写回已失效的结果
+            if self._inflight.get(key) is future:
+                self._store(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def invalidate(self, key: Hashable):
+        """凭证变更（机器人创建 / 删除）时删除缓存结果"""
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# 单例实例
+_credential_cache = None
+
+def get_credential_cache() -> CredentialCache:
+    global _credential_cache
+    if _credential_cache is None:
+        cache_config = get_config().get("auth_cache", {})
+        # 关闭时缓存时间为 0：不保存结果，只合并并发验证
+        enabled = cache_config.get("enabled", True)
+        _credential_cache = CredentialCache(
+            max_entries=int(cache_config.get("max_entries", 10000)),
+            ttl=float(cache_config.get("ttl", 300)) if enabled else 0,
+            negative_ttl=float(cache_config.get("negative_ttl", 30)) if enabled else 0
+        )
+    return _credential_cache
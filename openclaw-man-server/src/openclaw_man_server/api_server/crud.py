@@ -1,5 +1,8 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 from . import models, schemas
+from .credential_cache import get_credential_cache, robot_key
 import hashlib
 import time
 import uuid
@@ -27,33 +30,44 @@ def hash_api_key(api_key: str) -> str:
     """计算 API Key 的 MD5 哈希"""
     return hashlib.md5(api_key.encode()).hexdigest()
 
+async def _first(db: AsyncSession, statement):
+    result = await db.execute(statement.limit(1))
+    return result.scalars().first()
+
 # --- User CRUD ---
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int):
+    return await _first(db, select(models.User).where(models.User.id == user_id))
 
-def get_user_by_openid(db: Session, openid: str):
-    return db.query(models.User).filter(models.User.openid == openid).first()
+async def get_user_by_openid(db: AsyncSession, openid: str):
+    return await _first(db, select(models.User).where(models.User.openid == openid))
 
-def create_user(db: Session, user: schemas.UserCreate):
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
     db_user = models.User(
         openid=user.openid,
         unionid=user.unionid,
         nickname=user.nickname
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 # --- Robot CRUD ---
-def get_robot_by_robot_id(db: Session, robot_id: str):
-    return db.query(models.Robot).filter(models.Robot.robot_id == robot_id).first()
+async def get_robot_by_robot_id(db: AsyncSession, robot_id: str):
+    return await _first(db, select(models.Robot).where(models.Robot.robot_id == robot_id))
+
+async def get_robot_by_api_key(db: AsyncSession, api_key: str):
+    """按原始 API Key 查找机器人（数据库中只保存哈希）"""
+    return await _first(db, select(models.Robot).where(models.Robot.api_key == hash_api_key(api_key)))
 
-def get_robots(db: Session, user_id: int, skip: int = 0, limit: int = 100):
+async def get_robots(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100):
     """只返回属于该用户的机器人"""
-    return db.query(models.Robot).filter(models.Robot.creator_id == user_id).offset(skip).limit(limit).all()
+    result = await db.execute(
+        select(models.Robot).where(models.Robot.creator_id == user_id).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
 
-def create_robot(db: Session, robot: schemas.RobotCreate, user_id: int, user_name: str = "Unknown"):
+async def create_robot(db: AsyncSession, robot: schemas.RobotCreate, user_id: int, user_name: str = "Unknown"):
     # 自动生成 robot_id
     robot_id = generate_robot_id()
     
@@ -73,18 +87,20 @@ def create_robot(db: Session, robot: schemas.RobotCreate, user_id: int, user_nam
         creator_name=user_name
     )
     db.add(db_robot)
-    db.commit()
-    db.refresh(db_robot)
+    await db.commit()
+    await db.refresh(db_robot)
+    # 清除这个 Key 可能存在的"无效"缓存
+    get_credential_cache().invalidate(robot_key(hashed_api_key))
     
     # 关键：将原始 API Key 赋值给对象（临时），以便 Pydantic schema 可以序列化返回给用户
-    # 注意：这不会影响数据库中的值，因为我们已经 commit 了，且没有再次 add/commit
-    db_robot.api_key = raw_api_key
+    # 注意：按"已提交的值"设置，不标记为脏数据，同一会话之后再 commit 也不会把原始 Key 写回数据库
+    set_committed_value(db_robot, "api_key", raw_api_key)
     
     return db_robot
 
-def update_robot(db: Session, robot_id: str, robot_update: schemas.RobotUpdate, user_id: int):
+async def update_robot(db: AsyncSession, robot_id: str, robot_update: schemas.RobotUpdate, user_id: int):
     """更新机器人，增加权限校验"""
-    db_robot = get_robot_by_robot_id(db, robot_id)
+    db_robot = await get_robot_by_robot_id(db, robot_id)
     if not db_robot:
         return None
     
@@ -97,13 +113,13 @@ def update_robot(db: Session, robot_id: str, robot_update: schemas.RobotUpdate,
         setattr(db_robot, key, value)
     
     db.add(db_robot)
-    db.commit()
-    db.refresh(db_robot)
+    await db.commit()
+    await db.refresh(db_robot)
     return db_robot
 
-def delete_robot(db: Session, robot_id: str, user_id: int):
+async def delete_robot(db: AsyncSession, robot_id: str, user_id: int):
     """删除机器人，增加权限校验"""
-    db_robot = get_robot_by_robot_id(db, robot_id)
+    db_robot = await get_robot_by_robot_id(db, robot_id)
     if not db_robot:
         return False
     
@@ -111,22 +127,25 @@ def delete_robot(db: Session, robot_id: str, user_id: int):
     if db_robot.creator_id != user_id:
         return False
         
-    db.delete(db_robot)
-    db.commit()
+    await db.delete(db_robot)
+    await db.commit()
+    # 已删除机器人的 Key 不能再通过缓存连接
+    get_credential_cache().invalidate(robot_key(db_robot.api_key))
     return True
 
 # --- Conversation CRUD ---
-def get_conversation(db: Session, conversation_id: str):
-    return db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+async def get_conversation(db: AsyncSession, conversation_id: str):
+    return await _first(db, select(models.Conversation).where(models.Conversation.id == conversation_id))
 
-def get_conversations(db: Session, user_id: int, robot_id: str = None, skip: int = 0, limit: int = 100):
+async def get_conversations(db: AsyncSession, user_id: int, robot_id: str = None, skip: int = 0, limit: int = 100):
     """返回属于该用户的对话，可选根据 robot_id 过滤"""
-    query = db.query(models.Conversation).filter(models.Conversation.creator_id == user_id)
+    query = select(models.Conversation).where(models.Conversation.creator_id == user_id)
     if robot_id:
-        query = query.filter(models.Conversation.robot_id == robot_id)
-    return query.offset(skip).limit(limit).all()
+        query = query.where(models.Conversation.robot_id == robot_id)
+    result = await db.execute(query.offset(skip).limit(limit))
+    return result.scalars().all()
 
-def create_conversation(db: Session, conversation: schemas.ConversationCreate, user_id: int):
+async def create_conversation(db: AsyncSession, conversation: schemas.ConversationCreate, user_id: int):
     # 验证 robot 是否存在且属于该用户？ 或者只要是公开的机器人都可以？
     # 暂时假设用户只能创建关联到自己机器人的对话？或者可以关联到任意机器人？
     # 通常用户是和机器人对话，所以机器人可能是别人的。
@@ -139,12 +158,12 @@ def create_conversation(db: Session, conversation: schemas.ConversationCreate, u
         creator_id=user_id
     )
     db.add(db_conversation)
-    db.commit()
-    db.refresh(db_conversation)
+    await db.commit()
+    await db.refresh(db_conversation)
     return db_conversation
 
-def update_conversation(db: Session, conversation_id: str, conversation_update: schemas.ConversationUpdate, user_id: int):
-    db_conversation = get_conversation(db, conversation_id)
+async def update_conversation(db: AsyncSession, conversation_id: str, conversation_update: schemas.ConversationUpdate, user_id: int):
+    db_conversation = await get_conversation(db, conversation_id)
     if not db_conversation:
         return None
     
@@ -156,18 +175,18 @@ def update_conversation(db: Session, conversation_id: str, conversation_update:
         setattr(db_conversation, key, value)
         
     db.add(db_conversation)
-    db.commit()
-    db.refresh(db_conversation)
+    await db.commit()
+    await db.refresh(db_conversation)
     return db_conversation
 
-def delete_conversation(db: Session, conversation_id: str, user_id: int):
-    db_conversation = get_conversation(db, conversation_id)
+async def delete_conversation(db: AsyncSession, conversation_id: str, user_id: int):
+    db_conversation = await get_conversation(db, conversation_id)
     if not db_conversation:
         return False
         
     if db_conversation.creator_id != user_id:
         return False
         
-    db.delete(db_conversation)
-    db.commit()
+    await db.delete(db_conversation)
+    await db.commit()
     return True
@@ -1,10 +1,14 @@
 import os
 from urllib.parse import quote_plus
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import pymysql
 
+from ..config import get_config
+
 # 数据库连接配置 (优先从环境变量读取)
 DB_HOST = os.getenv("DB_HOST", "10.16.24.100")
 DB_PORT = int(os.getenv("DB_PORT", "3399"))
@@ -16,13 +20,46 @@ DB_NAME = os.getenv("DB_NAME", "openclaw_man")
 # 对用户名和密码进行 URL 编码，防止特殊字符（如 @）导致解析错误
 encoded_user = quote_plus(DB_USER)
 encoded_password = quote_plus(DB_PASSWORD)
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{encoded_user}:{encoded_password}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    pool_pre_ping=True,
-    pool_recycle=3600
+# DATABASE_URL 可整体覆盖（例如测试时使用 "sqlite:///./test.db"）
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or (
+    f"mysql+pymysql://{encoded_user}:{encoded_password}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
+
+# 同步方言 -> 异步驱动
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite"}
+
+def get_database_config() -> dict:
+    return get_config().get("database", {})
+
+def to_async_url(url: str) -> str:
+    """把同步连接串换成同一数据库的异步驱动，例如 mysql+pymysql -> mysql+aiomysql"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        return url
+    parsed = parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}")
+    return parsed.render_as_string(hide_password=False)
+
+def engine_options(url: str) -> dict:
+    """
+    连接池参数（database.pool_size / max_overflow / pool_timeout / pool_recycle / connect_timeout）
+
+    SQLite 使用 SQLAlchemy 默认的连接池，不传这些参数
+    """
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    db_config = get_database_config()
+    return {
+        "pool_pre_ping": True,
+        "pool_size": int(db_config.get("pool_size", 10)),
+        "max_overflow": int(db_config.get("max_overflow", 20)),
+        "pool_timeout": float(db_config.get("pool_timeout", 30)),
+        "pool_recycle": int(db_config.get("pool_recycle", 3600)),
+        "connect_args": {"connect_timeout": int(db_config.get("connect_timeout", 10))},
+    }
+
+# 同步引擎：Schema 检查、聊天记录 SQL 后端等仍在线程中使用
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -34,6 +71,41 @@ def get_db():
     finally:
         db.close()
 
+# 异步引擎：API 路由与 WebSocket 认证使用，数据库往返不阻塞事件循环
+# 第一次使用时创建（需要安装异步驱动 aiomysql / aiosqlite）
+_async_engine = None
+_async_session_factory = None
+
+def get_async_engine() -> AsyncEngine:
+    global _async_engine
+    if _async_engine is None:
+        url = to_async_url(SQLALCHEMY_DATABASE_URL)
+        _async_engine = create_async_engine(url, **engine_options(url))
+    return _async_engine
+
+def get_async_sessionmaker() -> async_sessionmaker:
+    """
+    异步会话工厂
+
+    expire_on_commit=False: 提交后对象属性仍可直接读取，不会在事件循环中触发隐式查询
+    """
+    global _async_session_factory
+    if _async_session_factory is None:
+        _async_session_factory = async_sessionmaker(get_async_engine(), expire_on_commit=False, autoflush=False)
+    return _async_session_factory
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+async def dispose_async_engine():
+    """关闭异步连接池（应用关闭时调用）"""
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _async_session_factory = None
+
 def create_database_if_not_exists():
     """如果数据库不存在，则创建它"""
     try:
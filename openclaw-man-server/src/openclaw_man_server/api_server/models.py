@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -49,3 +49,22 @@ class Conversation(Base):
 
     robot = relationship("Robot", back_populates="conversations")
     creator = relationship("User", back_populates="conversations")
+
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_user_conv_ts", "user_id", "conversation_id", "timestamp"),
+        Index("ix_chat_messages_user_seq", "user_id", "seq"),
+        Index("ix_chat_messages_user_msg", "user_id", "message_id"),
+    )
+
+    # 自增序号决定消息顺序（timestamp 只有秒级精度）
+    seq = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True, comment="消息序号")
+    message_id = Column(String(64), nullable=True, comment="消息ID")
+    user_id = Column(String(64), nullable=False, comment="用户ID")
+    conversation_id = Column(String(64), nullable=True, comment="对话ID")
+    robot_id = Column(String(50), nullable=True, comment="机器人ID")
+    sender = Column(String(16), nullable=False, comment="发送方(user/robot)")
+    text = Column(Text, nullable=True, comment="消息内容")
+    timestamp = Column(BigInteger, nullable=False, comment="消息时间戳(秒)")
+    extra = Column(Text, nullable=True, comment="其他字段(JSON)")
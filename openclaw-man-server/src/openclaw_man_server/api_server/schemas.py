@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 # Token Schemas
@@ -98,4 +98,24 @@ class UploadResponse(BaseModel):
     file_size: int
     file_path: Optional[str] = None
     content_type: Optional[str] = None
+    sha256: Optional[str] = None
     message: Optional[str] = None
+
+class BatchUploadItem(BaseModel):
+    index: int
+    original_name: str
+    success: bool
+    file_name: Optional[str] = None
+    file_size: Optional[int] = None
+    sha256: Optional[str] = None
+    message: Optional[str] = None
+
+class BatchUploadResponse(BaseModel):
+    success: bool
+    total: int
+    succeeded: int
+    failed: int
+    total_size: int
+    truncated: bool = False
+    message: Optional[str] = None
+    files: List[BatchUploadItem]
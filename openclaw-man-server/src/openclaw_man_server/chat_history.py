@@ -1,40 +1,169 @@
-from ast import main
-import json
 import asyncio
+import base64
+import binascii
+import json
 import os
 import sys
+import time
+import uuid
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
 try:
     from .config import get_config
+    from .chat_store.base import ChatStore
+    from .chat_store.segment_log import SegmentLogStore
+    from .chat_store.cache import HistoryCache
+    from .chat_store.search_index import SearchIndex, matches
+    from .keyed_lock import KeyedLock
+    from .io_executor import get_io_executor
+    from .logger import get_logger
 except ImportError:
     from openclaw_man_server.config import get_config
+    from openclaw_man_server.chat_store.base import ChatStore
+    from openclaw_man_server.chat_store.segment_log import SegmentLogStore
+    from openclaw_man_server.chat_store.cache import HistoryCache
+    from openclaw_man_server.chat_store.search_index import SearchIndex, matches
+    from openclaw_man_server.keyed_lock import KeyedLock
+    from openclaw_man_server.io_executor import get_io_executor
+    from openclaw_man_server.logger import get_logger
+
+logger = get_logger("chat_history")
+
+def encode_export_cursor(user_id: str, seq: int) -> str:
+    """导出游标：下一条待导出消息的位置 (用户, seq)"""
+    raw = json.dumps({"u": user_id, "s": seq}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_export_cursor(cursor: str) -> Tuple[str, int]:
+    """解析导出游标，格式错误时抛出 ValueError"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(data["u"]), int(data["s"])
+    except (binascii.Error, UnicodeError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+        raise ValueError(f"无效的导出游标: {cursor}")
+
+def new_message_id() -> str:
+    """消息 id：毫秒时间戳 + 随机后缀，同一秒内的多条消息不会重复"""
+    return f"msg_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
 
 class ChatHistoryService:
     def __init__(self):
         self.config = get_config()
         self.chat_dir = self._get_chat_directory()
-        self.lock = asyncio.Lock()
-        self.max_records = 100
+        # 按用户加锁：不同用户的读写互不阻塞
+        self.user_locks = KeyedLock()
+        # 阻塞的文件读写在专用线程池中执行，不占用事件循环
+        self.io = get_io_executor()
+        chat_config = self.config.get("chat_history", {})
+        # 热数据窗口：最近 max_records 条，更早的记录进入归档
+        self.max_records = int(chat_config.get("max_records", 100))
+        self.store = self._create_store(chat_config)
+        # 最近聊天记录缓存（写穿），热点用户读取历史无需访问磁盘
+        cache_config = chat_config.get("cache", {})
+        self.cache = None
+        if cache_config.get("enabled", True):
+            self.cache = HistoryCache(
+                max_entries=int(cache_config.get("max_entries", 10000)),
+                max_bytes=int(cache_config.get("max_bytes", 64 * 1024 * 1024))
+            )
+        # 全文搜索倒排索引（首次搜索时建立，保存时增量更新）
+        search_config = chat_config.get("search", {})
+        self.search = None
+        if search_config.get("enabled", True):
+            self.search = SearchIndex(max_users=int(search_config.get("max_users", 1000)))
+        # 导出时每次从存储读取的消息条数（每批在用户锁内读取一次）
+        self.export_batch = int(chat_config.get("export", {}).get("batch_size", 500))
+    
+    def _create_store(self, chat_config: dict) -> ChatStore:
+        """根据 chat_history.backend 创建存储后端"""
+        backend = chat_config.get("backend", "file")
+        retention = self._retention_limits(chat_config)
+        if backend == "sql":
+            try:
+                from .chat_store.sql_store import SqlChatStore
+            except ImportError:
+                from openclaw_man_server.chat_store.sql_store import SqlChatStore
+            sql_config = chat_config.get("sql", {})
+            return SqlChatStore(
+                url=sql_config.get("url"),
+                max_records=self.max_records,
+                retention_max_count=retention["max_count"],
+                retention_max_age=retention["max_age"]
+            )
+        if backend != "file":
+            raise ValueError(f"未知的聊天记录存储后端: {backend}")
+        archive_config = chat_config.get("archive", {})
+        return SegmentLogStore(
+            self.chat_dir,
+            max_records=self.max_records,
+            segment_max_bytes=int(chat_config.get("segment_max_bytes", 1024 * 1024)),
+            fsync=bool(chat_config.get("fsync", False)),
+            archive_enabled=bool(archive_config.get("enabled", True)),
+            archive_batch=int(archive_config.get("segment_records", 500)),
+            archive_compresslevel=int(archive_config.get("compresslevel", 6)),
+            retention_max_count=retention["max_count"],
+            retention_max_age=retention["max_age"],
+            retention_max_bytes=retention["max_bytes"],
+            max_users=int(chat_config.get("index_max_users", 10000))
+        )
+
+    @staticmethod
+    def _retention_limits(chat_config: dict) -> dict:
+        """读取保留策略，null 表示不限"""
+        retention = chat_config.get("retention", {})
+        max_count = retention.get("max_count")
+        max_age_days = retention.get("max_age_days")
+        max_bytes = retention.get("max_bytes")
+        return {
+            "max_count": int(max_count) if max_count else None,
+            "max_age": int(float(max_age_days) * 86400) if max_age_days else None,
+            "max_bytes": int(max_bytes) if max_bytes else None,
+        }
     
     def _get_chat_directory(self) -> Path:
         """获取聊天记录存储目录"""
         chat_config = self.config.get("chat_history", {})
-        chat_dir = chat_config.get("directory", "./chat_history")
+        chat_dir = Path(chat_config.get("directory", "./chat_history"))
         
-        if not Path(chat_dir).is_absolute():
+        if not chat_dir.is_absolute():
             current_dir = Path(__file__).parent.parent.parent
             chat_dir = current_dir / chat_dir
         
         chat_dir.mkdir(parents=True, exist_ok=True)
         return chat_dir
     
-    def _get_user_chat_file(self, user_id: str) -> Path:
-        """获取用户的聊天记录文件路径"""
-        return self.chat_dir / f"user_{user_id}.json"
-    
+    def build_message(
+        self,
+        sender: str,
+        text: str,
+        media_url: Optional[str] = None,
+        robot_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        message_id: Optional[str] = None,
+        seq: Optional[int] = None
+    ) -> dict:
+        """
+        构建一条聊天记录（时间戳在构建时确定，而不是落盘时）
+
+        seq 为 Bridge 分配的对话内序号，断线重连时据此补发遗漏的消息
+        """
+        message = {
+            "id": message_id or new_message_id(),
+            "timestamp": int(datetime.now().timestamp()),
+            "sender": sender,  # "user" 或 "robot"
+            "text": text,
+            "robot_id": robot_id,
+            "conversation_id": conversation_id or "default"
+        }
+        if media_url:
+            message["media_url"] = media_url
+        if seq is not None:
+            message["seq"] = seq
+        return message
+
     async def save_message(
         self, 
         user_id: str, 
@@ -46,52 +175,115 @@ class ChatHistoryService:
         message_id: Optional[str] = None
     ):
         """保存单条聊天记录"""
-        async with self.lock:
+        new_message = self.build_message(
+            sender=sender,
+            text=text,
+            media_url=media_url,
+            robot_id=robot_id,
+            conversation_id=conversation_id,
+            message_id=message_id
+        )
+        await self.save_messages(user_id, [new_message])
+
+    async def save_messages(self, user_id: str, new_messages: List[dict]):
+        """
+        批量保存同一用户的多条聊天记录（整批一次写入存储）
+
+        写入存储失败时抛出异常，由调用方（写回队列）记录并计数
+        """
+        if not new_messages:
+            return
+        user_id = str(user_id)
+        async with self.user_locks(user_id):
+            await self.io.run(self.store.append, user_id, new_messages)
             try:
-                file_path = self._get_user_chat_file(user_id)
-                
-                # 读取现有记录
-                messages = await self._read_messages(file_path)
-                
-                # 创建新消息
-                new_message = {
-                    "id": message_id or f"msg_{int(datetime.now().timestamp())}",
-                    "timestamp": int(datetime.now().timestamp()),
-                    "sender": sender,  # "user" 或 "robot"
-                    "text": text,
-                    "robot_id": robot_id,
-                    "conversation_id": conversation_id or "default"
-                }
-                
-                # 添加新消息
-                messages.append(new_message)
-                
-                # 只保留最近的100条记录
-                if len(messages) > self.max_records:
-                    messages = messages[-self.max_records:]
-                
-                # 写回文件
-                with open(file_path, "w", encoding="utf-8") as f:
-                    json.dump(messages, f, ensure_ascii=False, indent=2)
-                    
+                if self.cache:
+                    self.cache.write_through(user_id, new_messages, self.max_records)
+                if self.search:
+                    self.search.add(user_id, new_messages)
             except Exception as e:
-                # 记录错误但不中断主流程
-                print(f"保存聊天记录失败: {e}")
+                # 已写入存储：丢弃该用户的缓存与索引，下次读取时重建
+                logger.error(f"更新用户 {user_id} 的聊天记录缓存 / 索引失败: {e}")
+                if self.cache:
+                    self.cache.invalidate(user_id)
+                if self.search:
+                    self.search.discard(user_id)
     
-    async def _read_messages(self, file_path: Path) -> List[dict]:
-        """读取聊天记录"""
-        if not file_path.exists():
-            return []
-        
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
+    async def _read_messages(self, user_id: str, conversation_id: Optional[str] = None) -> List[dict]:
+        """读取聊天记录（优先从缓存读取）"""
+        user_id = str(user_id)
+        async with self.user_locks(user_id):
+            if self.cache:
+                cached = self.cache.lookup(user_id, conversation_id)
+                if cached is not None:
+                    return cached
+
+            messages = await self.io.run(self.store.read_all, user_id)
+            if self.cache:
+                # 在用户锁内填充，保证不会覆盖并发保存的写穿结果
+                self.cache.fill(user_id, messages)
+
+        # 如果指定了 conversation_id，过滤出该对话的记录
+        if conversation_id:
+            messages = [m for m in messages if m.get("conversation_id") == conversation_id]
+        return messages
     
+    async def last_seq(self, user_id: str, conversation_id: str) -> int:
+        """对话中最新一条带 seq 的消息的序号，没有时返回 0"""
+        user_id = str(user_id)
+        async with self.user_locks(user_id):
+            return await self.io.run(self._last_seq, user_id, conversation_id)
+
+    def _last_seq(self, user_id: str, conversation_id: str) -> int:
+        scan = self.store.scan_reverse(user_id, conversation_id)
+        try:
+            for message in scan:
+                if message.get("seq") is not None:
+                    return int(message["seq"])
+        finally:
+            scan.close()
+        return 0
+
+    async def messages_after(
+        self, user_id: str, conversation_id: str, after_seq: int, limit: int
+    ) -> Tuple[List[dict], bool]:
+        """
+        对话中 seq > after_seq 的消息（按 seq 升序），返回 (消息列表, 是否超出 limit 被截断)
+
+        缓存中的热数据窗口能覆盖时直接返回；否则从最新一条向前读取，
+        读到 seq <= after_seq 即停止，代价与遗漏的条数成正比，而不是与历史总量成正比。
+        超出 limit 时只返回最新的 limit 条
+        """
+        user_id = str(user_id)
+        async with self.user_locks(user_id):
+            if self.cache:
+                cached = self.cache.lookup(user_id, conversation_id)
+                if cached and cached[0].get("seq") is not None and cached[0]["seq"] <= after_seq + 1:
+                    missed = [m for m in cached if (m.get("seq") or 0) > after_seq]
+                    return missed[-limit:], len(missed) > limit
+            return await self.io.run(self._messages_after, user_id, conversation_id, after_seq, limit)
+
+    def _messages_after(
+        self, user_id: str, conversation_id: str, after_seq: int, limit: int
+    ) -> Tuple[List[dict], bool]:
+        missed = []
+        truncated = False
+        scan = self.store.scan_reverse(user_id, conversation_id)
+        try:
+            for message in scan:
+                seq = message.get("seq")
+                # 没有 seq 的旧消息之前不会再有带 seq 的消息
+                if seq is None or seq <= after_seq:
+                    break
+                if len(missed) >= limit:
+                    truncated = True
+                    break
+                missed.append(message)
+        finally:
+            scan.close()
+        missed.reverse()
+        return missed, truncated
+
     async def get_history(
         self, 
         user_id: str, 
@@ -100,22 +292,193 @@ class ChatHistoryService:
         conversation_id: Optional[str] = None
     ) -> List[dict]:
         """获取用户聊天记录"""
-        file_path = self._get_user_chat_file(user_id)
-        messages = await self._read_messages(file_path)
-        
-        # 如果指定了 conversation_id，过滤出该对话的记录
-        if conversation_id:
-            messages = [m for m in messages if m.get("conversation_id") == conversation_id]
+        messages = await self._read_messages(user_id, conversation_id)
         
         # 应用分页
         limit = limit or self.max_records
         return messages[offset:offset + limit]
     
+    async def query_history(
+        self,
+        user_id: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        conversation_id: Optional[str] = None,
+        before_id: Optional[str] = None,
+        after_id: Optional[str] = None
+    ) -> dict:
+        """
+        分页查询聊天记录，返回当前页与真实总数
+
+        未使用游标时在最近 max_records 条（热数据窗口）内按 offset 分页，走缓存；
+        使用 before_id / after_id 游标时通过存储索引只读取当前页，可一直翻到归档记录。
+        total 始终为保留范围内（包括归档）的真实总数
+        """
+        user_id = str(user_id)
+        limit = limit or self.max_records
+        if before_id is None and after_id is None:
+            messages = await self._read_messages(user_id, conversation_id)
+            begin = min(offset, len(messages))
+            async with self.user_locks(user_id):
+                total = await self.io.run(self.store.count, user_id, conversation_id)
+            return {
+                "messages": messages[begin:begin + limit],
+                "total": total,
+                # 窗口之前还有归档记录时同样可以继续向前翻页
+                "has_more_before": begin > 0 or total > len(messages),
+                "has_more_after": begin + limit < len(messages)
+            }
+
+        async with self.user_locks(user_id):
+            return await self.io.run(
+                self.store.query,
+                user_id,
+                conversation_id=conversation_id,
+                limit=limit,
+                before_id=before_id,
+                after_id=after_id
+            )
+    
+    async def search_history(
+        self,
+        user_id: str,
+        query: str,
+        limit: int = 20,
+        conversation_id: Optional[str] = None,
+        robot_id: Optional[str] = None,
+        before_id: Optional[str] = None
+    ) -> dict:
+        """
+        全文搜索聊天记录（包括归档），按时间从新到旧返回
+
+        使用 before_id（上一页最后一条的 id）继续向更早的记录翻页
+        """
+        if not self.search:
+            raise RuntimeError("聊天记录搜索未启用")
+        user_id = str(user_id)
+        async with self.user_locks(user_id):
+            if not self.search.is_loaded(user_id):
+                await self.io.run(self.search.load, user_id, self.store.iter_messages(user_id))
+            return await self.io.run(
+                self._search, user_id, query, limit, conversation_id, robot_id, before_id
+            )
+
+    def _search(
+        self,
+        user_id: str,
+        query: str,
+        limit: int,
+        conversation_id: Optional[str],
+        robot_id: Optional[str],
+        before_id: Optional[str]
+    ) -> dict:
+        """按批从存储读取候选消息并校验，凑够 limit + 1 条即停止"""
+        candidates = self.search.candidates(user_id, query, conversation_id, robot_id, before_id)
+        hits, seen = [], set()
+        while len(hits) <= limit:
+            batch = [i for _, i in zip(range(max(limit, 20)), candidates)]
+            if not batch:
+                break
+            by_id = {m.get("id"): m for m in self.store.get_messages(user_id, batch)}
+            for message_id in batch:
+                message = by_id.get(message_id)
+                if message is None or message_id in seen:
+                    continue
+                if matches(message, query, conversation_id, robot_id):
+                    seen.add(message_id)
+                    hits.append(message)
+        has_more = len(hits) > limit
+        hits = hits[:limit]
+        return {
+            "messages": hits,
+            "has_more": has_more,
+            "before_id": hits[-1]["id"] if hits and has_more else None
+        }
+
+    async def export_history(
+        self,
+        user_ids: Optional[List[str]] = None,
+        conversation_id: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        start: Optional[Tuple[str, int]] = None
+    ) -> AsyncIterator[List[dict]]:
+        """
+        流式导出聊天记录（包括归档），按批返回 {"user_id", "cursor", "message"}
+
+        用户按 id 升序导出，每个用户内按时间顺序；每条记录的 cursor 指向它之后的位置，
+        断线后把最后收到的 cursor 解析为 start 即可续传。
+        每批在用户锁内从存储读取一次，批与批之间释放锁，不阻塞正常的保存
+        """
+        if user_ids:
+            users = sorted(set(str(u) for u in user_ids))
+        else:
+            users = await self.io.run(self.store.list_users)
+
+        for user_id in users:
+            seq = 0
+            if start is not None:
+                if user_id < start[0]:
+                    continue
+                if user_id == start[0]:
+                    seq = start[1]
+            while True:
+                async with self.user_locks(user_id):
+                    batch = await self.io.run(
+                        self._scan_batch, user_id, seq, conversation_id, since, until
+                    )
+                if not batch:
+                    break
+                yield [
+                    {
+                        "user_id": user_id,
+                        "cursor": encode_export_cursor(user_id, message_seq + 1),
+                        "message": message
+                    }
+                    for message_seq, message in batch
+                ]
+                if len(batch) < self.export_batch:
+                    break
+                seq = batch[-1][0] + 1
+
+    def _scan_batch(
+        self,
+        user_id: str,
+        start_seq: int,
+        conversation_id: Optional[str],
+        since: Optional[int],
+        until: Optional[int]
+    ) -> List[Tuple[int, dict]]:
+        scan = self.store.scan(user_id, start_seq, conversation_id=conversation_id, since=since, until=until)
+        try:
+            return list(islice(scan, self.export_batch))
+        finally:
+            scan.close()
+
     async def clear_history(self, user_id: str):
         """清空用户聊天记录"""
-        file_path = self._get_user_chat_file(user_id)
-        if file_path.exists():
-            file_path.unlink()
+        async with self.user_locks(str(user_id)):
+            await self.io.run(self.store.clear, str(user_id))
+            if self.cache:
+                self.cache.invalidate(str(user_id))
+            if self.search:
+                self.search.discard(str(user_id))
+
+    def close(self):
+        """关闭存储后端"""
+        self.store.close()
+
+    def cache_stats(self) -> dict:
+        """返回缓存命中统计"""
+        if not self.cache:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+
+    def search_stats(self) -> dict:
+        """返回搜索索引统计"""
+        if not self.search:
+            return {"enabled": False}
+        return {"enabled": True, **self.search.stats()}
 
 # 单例实例
 _chat_history_service = None
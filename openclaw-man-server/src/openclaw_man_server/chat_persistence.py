@@ -0,0 +1,164 @@
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+try:
+    from .config import get_config
+    from .logger import get_logger
+    from .chat_history import ChatHistoryService, get_chat_history_service
+except ImportError:
+    from openclaw_man_server.config import get_config
+    from openclaw_man_server.logger import get_logger
+    from openclaw_man_server.chat_history import ChatHistoryService, get_chat_history_service
+
+logger = get_logger("chat_persistence")
+
+# 队列满时的处理策略
+PERSIST_OVERFLOW_BLOCK = "block"  # 背压：等待队列空位（超时后丢弃）
+PERSIST_OVERFLOW_DROP = "drop"    # 削峰：直接丢弃并计数
+
+_STOP = object()
+
+
+class ChatPersistenceQueue:
+    """
+    聊天记录的异步写回（write-behind）队列
+
+    转发循环只负责把消息放入有界队列；单个消费协程按刷新间隔收集一批消息，
+    按用户分组后每个用户只写一次，转发延迟不再依赖磁盘速度
+    """
+
+    def __init__(self, chat_service: Optional[ChatHistoryService] = None):
+        self.chat_service = chat_service or get_chat_history_service()
+        persist_config = get_config().get("chat_history", {}).get("persistence", {})
+        self.maxsize = int(persist_config.get("queue_size", 10000))
+        self.flush_interval = float(persist_config.get("flush_interval", 0.2))
+        self.max_batch = int(persist_config.get("max_batch", 500))
+        self.overflow = persist_config.get("overflow", PERSIST_OVERFLOW_DROP)
+        self.put_timeout = float(persist_config.get("put_timeout", 1.0))
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer_task: Optional[asyncio.Task] = None
+        self._closing = False
+        # 统计信息
+        self.enqueued_count = 0
+        self.dropped_count = 0
+        self.flushed_count = 0
+        self.failed_count = 0
+        self.batch_count = 0
+
+    def _ensure_started(self):
+        """首次使用时在当前事件循环中创建队列和消费协程"""
+        if self._consumer_task is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._consumer_task = asyncio.create_task(self._consumer())
+
+    async def submit(self, user_id: str, message: dict) -> bool:
+        """
+        提交一条待保存的消息（由 ChatHistoryService.build_message 构建）
+        返回 False 表示消息被丢弃
+        """
+        if self._closing:
+            logger.warning(f"持久化队列已关闭，丢弃用户 {user_id} 的消息 {message.get('id')}")
+            self.dropped_count += 1
+            return False
+
+        self._ensure_started()
+        item = (str(user_id), message)
+        try:
+            if self.overflow == PERSIST_OVERFLOW_BLOCK:
+                await asyncio.wait_for(self._queue.put(item), timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.dropped_count += 1
+            logger.warning(f"持久化队列已满 ({self.maxsize})，丢弃用户 {user_id} 的消息 {message.get('id')}")
+            return False
+
+        self.enqueued_count += 1
+        return True
+
+    async def _consumer(self):
+        """消费协程：按刷新间隔或批量上限收集消息后统一写入"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        """按用户分组写入，每个用户一次写操作"""
+        grouped = OrderedDict()
+        for user_id, message in batch:
+            grouped.setdefault(user_id, []).append(message)
+
+        results = await asyncio.gather(
+            *(self.chat_service.save_messages(user_id, messages) for user_id, messages in grouped.items()),
+            return_exceptions=True
+        )
+        failed = 0
+        for (user_id, messages), result in zip(grouped.items(), results):
+            if isinstance(result, Exception):
+                # 写入失败的消息不重试，计入 failed
+                logger.error(f"批量保存用户 {user_id} 的 {len(messages)} 条聊天记录失败: {result}")
+                failed += len(messages)
+
+        self.flushed_count += len(batch) - failed
+        self.failed_count += failed
+        self.batch_count += 1
+
+    async def close(self):
+        """停止接收新消息，并把队列中剩余的消息全部写完"""
+        self._closing = True
+        if self._consumer_task is None:
+            return
+        await self._queue.put(_STOP)
+        try:
+            await self._consumer_task
+        finally:
+            self._consumer_task = None
+            logger.info(
+                f"持久化队列已关闭，共写入 {self.flushed_count} 条，"
+                f"写入失败 {self.failed_count} 条，丢弃 {self.dropped_count} 条"
+            )
+
+    def stats(self) -> dict:
+        """返回队列统计信息"""
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "maxsize": self.maxsize,
+            "overflow": self.overflow,
+            "enqueued": self.enqueued_count,
+            "dropped": self.dropped_count,
+            "flushed": self.flushed_count,
+            "failed": self.failed_count,
+            "batches": self.batch_count,
+        }
+
+
+# 单例实例
+_chat_persistence_queue = None
+
+def get_chat_persistence_queue() -> ChatPersistenceQueue:
+    global _chat_persistence_queue
+    if _chat_persistence_queue is None:
+        _chat_persistence_queue = ChatPersistenceQueue()
+    return _chat_persistence_queue
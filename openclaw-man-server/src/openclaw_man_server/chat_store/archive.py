@@ -0,0 +1,139 @@
+import gzip
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Iterator, List, Optional, Tuple
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".idx.json"
+TMP_SUFFIX = ".tmp"
+
+
+class ArchiveSegment:
+    """
+    不可变的压缩归档段
+
+    - {first_seq}.jsonl.gz: gzip 压缩的 JSONL 消息
+    - {first_seq}.idx.json: 每条消息的 id 与 conversation_id，打开日志时用于建立索引，
+      无需解压归档内容
+    """
+
+    __slots__ = ("first_seq", "count", "bytes", "min_ts", "max_ts")
+
+    def __init__(self, first_seq: int, count: int, bytes: int, min_ts: int, max_ts: int):
+        self.first_seq = first_seq
+        self.count = count
+        self.bytes = bytes
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+
+    @property
+    def end_seq(self) -> int:
+        return self.first_seq + self.count
+
+    @property
+    def stem(self) -> str:
+        return f"{self.first_seq:012d}"
+
+    def data_path(self, directory: Path) -> Path:
+        return directory / f"{self.stem}{ARCHIVE_SUFFIX}"
+
+    def index_path(self, directory: Path) -> Path:
+        return directory / f"{self.stem}{INDEX_SUFFIX}"
+
+    def to_dict(self) -> dict:
+        return {
+            "first_seq": self.first_seq,
+            "count": self.count,
+            "bytes": self.bytes,
+            "min_ts": self.min_ts,
+            "max_ts": self.max_ts,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ArchiveSegment":
+        return cls(data["first_seq"], data["count"], data["bytes"], data["min_ts"], data["max_ts"])
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + TMP_SUFFIX)
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_archive(directory: Path, first_seq: int, messages: List[dict], compresslevel: int = 6) -> ArchiveSegment:
+    """把一批消息写成新的归档段（先写索引，再写数据）"""
+    directory.mkdir(parents=True, exist_ok=True)
+    timestamps = [int(m.get("timestamp") or 0) for m in messages]
+    payload = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages).encode("utf-8")
+    compressed = gzip.compress(payload, compresslevel=compresslevel)
+
+    seg = ArchiveSegment(first_seq, len(messages), len(compressed), min(timestamps), max(timestamps))
+    index = {
+        "ids": [m.get("id") for m in messages],
+        "conversations": [m.get("conversation_id") for m in messages],
+    }
+    _write_atomic(seg.index_path(directory), json.dumps(index, ensure_ascii=False).encode("utf-8"))
+    _write_atomic(seg.data_path(directory), compressed)
+    return seg
+
+
+def read_archive_index(directory: Path, seg: ArchiveSegment) -> Tuple[List[Optional[str]], List[Optional[str]]]:
+    """读取归档段的 id 与 conversation_id 列表"""
+    with open(seg.index_path(directory), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    return index["ids"], index["conversations"]
+
+
+def delete_archive(directory: Path, seg: ArchiveSegment):
+    seg.data_path(directory).unlink(missing_ok=True)
+    seg.index_path(directory).unlink(missing_ok=True)
+
+
+def iter_archive(directory: Path, seg: ArchiveSegment) -> Iterator[dict]:
+    """逐行解压读取归档段，不缓存整段内容"""
+    with gzip.open(seg.data_path(directory), "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class ArchiveReader:
+    """解压后的归档段 LRU 缓存，翻页读取同一归档段时只解压一次"""
+
+    def __init__(self, capacity: int = 8):
+        self.capacity = capacity
+        self._segments: "OrderedDict[Path, List[dict]]" = OrderedDict()
+        # 不同用户的读取可能在多个 I/O 线程中并发执行
+        self._mutex = Lock()
+
+    def read(self, directory: Path, seg: ArchiveSegment) -> List[dict]:
+        path = seg.data_path(directory)
+        with self._mutex:
+            messages = self._segments.get(path)
+            if messages is not None:
+                self._segments.move_to_end(path)
+                return messages
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            messages = [json.loads(line) for line in f if line.strip()]
+
+        with self._mutex:
+            self._segments[path] = messages
+            while len(self._segments) > self.capacity:
+                self._segments.popitem(last=False)
+        return messages
+
+    def discard(self, directory: Path, seg: Optional[ArchiveSegment] = None):
+        """丢弃指定归档段（未指定时丢弃该目录下全部归档段）的缓存"""
+        with self._mutex:
+            if seg is not None:
+                self._segments.pop(seg.data_path(directory), None)
+                return
+            for path in [p for p in self._segments if p.parent == directory]:
+                del self._segments[path]
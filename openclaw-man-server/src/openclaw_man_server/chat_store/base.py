@@ -0,0 +1,87 @@
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional, Tuple
+
+
+class ChatStore(ABC):
+    """
+    聊天记录存储接口
+
+    所有方法都是同步的，由 ChatHistoryService 在 I/O 线程池中调用，
+    并保证同一用户的调用不会并发执行
+    """
+
+    max_records: int
+
+    @abstractmethod
+    def append(self, user_id: str, messages: List[dict]):
+        """追加多条消息"""
+
+    @abstractmethod
+    def read_all(self, user_id: str) -> List[dict]:
+        """按时间顺序读取最近 max_records 条消息"""
+
+    @abstractmethod
+    def scan(
+        self,
+        user_id: str,
+        start_seq: int = 0,
+        conversation_id: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None
+    ) -> Iterator[Tuple[int, dict]]:
+        """
+        按时间顺序逐段读取保留范围内（包括归档）seq >= start_seq 的消息，返回 (seq, 消息)
+
+        seq 是用户内单调递增且不会复用的序号，可作为断点续读的位置；
+        可按对话与时间范围 [since, until] 过滤。内存占用与总量无关
+        """
+
+    def scan_reverse(self, user_id: str, conversation_id: str) -> Iterator[dict]:
+        """
+        从最新一条开始按时间倒序读取该对话保留范围内的消息
+
+        调用方读到需要的位置即可停止，读取量与已读条数成正比。
+        默认实现读取整个对话，存储后端应按索引逐批向前读取
+        """
+        messages = [message for _, message in self.scan(user_id, conversation_id=conversation_id)]
+        yield from reversed(messages)
+
+    def iter_messages(self, user_id: str) -> Iterator[dict]:
+        """按时间顺序逐段读取保留范围内的全部消息（包括归档）"""
+        for _, message in self.scan(user_id):
+            yield message
+
+    @abstractmethod
+    def list_users(self) -> List[str]:
+        """有聊天记录的全部用户 id（升序）"""
+
+    @abstractmethod
+    def get_messages(self, user_id: str, message_ids: List[str]) -> List[dict]:
+        """按 id 读取消息（按时间顺序，不存在或已超出保留范围的 id 被忽略）"""
+
+    @abstractmethod
+    def query(
+        self,
+        user_id: str,
+        conversation_id: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+        before_id: Optional[str] = None,
+        after_id: Optional[str] = None
+    ) -> dict:
+        """
+        分页查询，返回 {"messages", "total", "has_more_before", "has_more_after"}
+
+        before_id / after_id 游标对应多条记录（重复的旧版 id）时抛出 ValueError
+        """
+
+    @abstractmethod
+    def count(self, user_id: str, conversation_id: Optional[str] = None) -> int:
+        """保留范围内（可按对话过滤）的消息总数"""
+
+    @abstractmethod
+    def clear(self, user_id: str):
+        """删除用户的全部记录"""
+
+    def close(self):
+        """释放存储占用的资源"""
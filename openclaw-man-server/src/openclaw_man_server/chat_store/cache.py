@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Set, Tuple
+
+# 每条消息除文本外的固定开销估算（字典、字段名、id 等）
+_MESSAGE_OVERHEAD = 256
+
+CacheKey = Tuple[str, Optional[str]]
+
+
+def _estimate_size(messages: List[dict]) -> int:
+    """粗略估算一组消息占用的内存字节数"""
+    return sum(_MESSAGE_OVERHEAD + len(m.get("text") or "") * 4 for m in messages)
+
+
+class HistoryCache:
+    """
+    最近聊天记录的 LRU 缓存
+
+    - (user_id, None) 为用户的基础条目，保存保留窗口内的全部消息，保存时写穿更新
+    - (user_id, conversation_id) 为按对话过滤后的视图，命中基础条目时在内存中生成；
+      用户有新消息时直接丢弃这些视图，下次读取再从基础条目重建
+    - 按条目数和估算字节数双重限制，超出时淘汰最久未使用的条目
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, Tuple[List[dict], int]]" = OrderedDict()
+        self._user_keys: Dict[str, Set[CacheKey]] = {}
+        self._bytes = 0
+        # 缓存可能在 I/O 线程与事件循环之间共享，用线程锁保护内部结构
+        self._mutex = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---- 内部操作（调用方需持有 _mutex） ----
+
+    def _put(self, key: CacheKey, messages: List[dict]):
+        self._remove(key)
+        size = _estimate_size(messages)
+        self._entries[key] = (messages, size)
+        self._user_keys.setdefault(key[0], set()).add(key)
+        self._bytes += size
+        self._evict()
+
+    def _remove(self, key: CacheKey):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[1]
+        keys = self._user_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[key[0]]
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def _get(self, key: CacheKey) -> Optional[List[dict]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    # ---- 对外接口 ----
+
+    def lookup(self, user_id: str, conversation_id: Optional[str] = None) -> Optional[List[dict]]:
+        """查找缓存的消息列表，未命中返回 None（返回值只读，调用方不要修改）"""
+        with self._mutex:
+            messages = self._get((user_id, conversation_id))
+            if messages is None and conversation_id is not None:
+                base = self._get((user_id, None))
+                if base is not None:
+                    messages = [m for m in base if m.get("conversation_id") == conversation_id]
+                    self._put((user_id, conversation_id), messages)
+            if messages is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return messages
+
+    def fill(self, user_id: str, messages: List[dict]):
+        """从存储读取后填充用户的基础条目"""
+        with self._mutex:
+            self._put((user_id, None), list(messages))
+
+    def write_through(self, user_id: str, new_messages: List[dict], max_records: int):
+        """保存成功后同步更新缓存：追加到基础条目并丢弃对话视图"""
+        with self._mutex:
+            for key in list(self._user_keys.get(user_id, ())):
+                if key[1] is not None:
+                    self._remove(key)
+            base = self._entries.get((user_id, None))
+            if base is None:
+                return
+            messages = base[0] + list(new_messages)
+            if len(messages) > max_records:
+                messages = messages[-max_records:]
+            self._put((user_id, None), messages)
+
+    def invalidate(self, user_id: str):
+        """丢弃用户的全部缓存条目"""
+        with self._mutex:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._mutex:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+            }
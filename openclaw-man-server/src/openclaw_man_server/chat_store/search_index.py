@@ -0,0 +1,208 @@
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+# 中日韩文字按字切分（没有空格分词），其余按字母数字单词切分
+_CJK = (
+    "぀-ヿ"  # 平假名 / 片假名
+    "㐀-䶿"  # 扩展 A
+    "一-鿿"  # 基本汉字
+    "豈-﫿"  # 兼容汉字
+    "가-힯"  # 韩文
+)
+_RUN_RE = re.compile(f"[{_CJK}]+|[^\\W{_CJK}]+")
+_CJK_RE = re.compile(f"[{_CJK}]")
+
+# 过滤条件也作为词项写入倒排表，与查询词一起求交集
+_CONVERSATION_PREFIX = "\x00c:"
+_ROBOT_PREFIX = "\x00r:"
+
+
+def _runs(text: str) -> List[str]:
+    return _RUN_RE.findall((text or "").lower())
+
+
+def index_terms(text: str) -> Set[str]:
+    """建索引用的词项：CJK 连续文字取单字与相邻二元组，其余取整个单词"""
+    terms = set()
+    for run in _runs(text):
+        if _CJK_RE.match(run):
+            terms.update(run)
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.add(run)
+    return terms
+
+
+def query_terms(query: str) -> Set[str]:
+    """查询用的词项：CJK 连续文字取二元组（单字时取单字），其余取整个单词"""
+    terms = set()
+    for run in _runs(query):
+        if _CJK_RE.match(run) and len(run) > 1:
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.add(run)
+    return terms
+
+
+def matches(message: dict, query: str, conversation_id: Optional[str] = None, robot_id: Optional[str] = None) -> bool:
+    """
+    校验候选消息：二元组求交只保证每个二元组都出现，
+    这里确认查询中的每段文字都完整出现在消息中
+    """
+    if conversation_id and message.get("conversation_id") != conversation_id:
+        return False
+    if robot_id and message.get("robot_id") != robot_id:
+        return False
+    text = (message.get("text") or "").lower()
+    words = set(_runs(text))
+    for run in _runs(query):
+        if _CJK_RE.match(run):
+            if run not in text:
+                return False
+        elif run not in words:
+            return False
+    return True
+
+
+class _UserIndex:
+    """
+    单个用户的倒排索引
+
+    文档编号按保存顺序递增，倒排表只需追加即保持有序
+    """
+
+    __slots__ = ("ids", "docs", "postings")
+
+    def __init__(self):
+        self.ids: List[str] = []
+        # 消息 id -> 最新的文档编号，用于游标翻页
+        self.docs: Dict[str, int] = {}
+        self.postings: Dict[str, List[int]] = {}
+
+    def add(self, message: dict):
+        doc = len(self.ids)
+        self.ids.append(message.get("id"))
+        self.docs[message.get("id")] = doc
+        terms = index_terms(message.get("text"))
+        terms.add(_CONVERSATION_PREFIX + str(message.get("conversation_id")))
+        if message.get("robot_id"):
+            terms.add(_ROBOT_PREFIX + str(message["robot_id"]))
+        for term in terms:
+            self.postings.setdefault(term, []).append(doc)
+
+    def candidates(self, terms: Set[str], before: Optional[int] = None) -> Iterator[int]:
+        """
+        按文档编号从新到旧返回包含全部词项的文档
+
+        从最短的倒排表倒序遍历，在其他倒排表中二分查找，
+        代价为 O(最短倒排表长度 × log n)，与历史总量无关
+        """
+        lists = []
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                return
+            lists.append(postings)
+        lists.sort(key=len)
+        shortest, others = lists[0], lists[1:]
+
+        end = len(shortest) if before is None else bisect_left(shortest, before)
+        for i in range(end - 1, -1, -1):
+            doc = shortest[i]
+            for postings in others:
+                j = bisect_left(postings, doc)
+                if j == len(postings) or postings[j] != doc:
+                    break
+            else:
+                yield doc
+
+
+class SearchIndex:
+    """
+    聊天记录全文搜索的倒排索引（按用户 LRU）
+
+    - 用户第一次搜索时从存储逐段读取全部保留记录建立索引，之后每次保存增量追加
+    - 最多常驻 max_users 个用户的索引，被淘汰的用户下次搜索时重建
+    - 索引只记录消息 id，命中后从存储读取消息原文并校验；
+      已超出保留范围的消息在存储中读不到，自然被过滤
+    - 调用方需保证同一用户的调用不会并发执行（ChatHistoryService 的用户锁）
+    """
+
+    def __init__(self, max_users: int = 1000):
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        # 不同用户的调用可能在多个 I/O 线程中并发执行
+        self._mutex = Lock()
+        self.builds = 0
+
+    def _get(self, user_id: str) -> Optional[_UserIndex]:
+        with self._mutex:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+            return index
+
+    def is_loaded(self, user_id: str) -> bool:
+        return self._get(user_id) is not None
+
+    def load(self, user_id: str, messages: Iterable[dict]):
+        """从存储中的全部消息建立用户索引"""
+        index = _UserIndex()
+        for message in messages:
+            index.add(message)
+        with self._mutex:
+            self._users[user_id] = index
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            self.builds += 1
+
+    def add(self, user_id: str, messages: List[dict]):
+        """增量追加新保存的消息（用户索引尚未建立时跳过，建立时会从存储读到）"""
+        index = self._get(user_id)
+        if index is None:
+            return
+        for message in messages:
+            index.add(message)
+
+    def candidates(
+        self,
+        user_id: str,
+        query: str,
+        conversation_id: Optional[str] = None,
+        robot_id: Optional[str] = None,
+        before_id: Optional[str] = None
+    ) -> Iterator[str]:
+        """按从新到旧返回候选消息 id（可能有误报，需要用 matches 校验）"""
+        index = self._get(user_id)
+        terms = query_terms(query)
+        if index is None or not terms:
+            return
+        if conversation_id:
+            terms.add(_CONVERSATION_PREFIX + conversation_id)
+        if robot_id:
+            terms.add(_ROBOT_PREFIX + robot_id)
+
+        before = None
+        if before_id is not None:
+            before = index.docs.get(before_id)
+            if before is None:
+                return
+        for doc in index.candidates(terms, before):
+            yield index.ids[doc]
+
+    def discard(self, user_id: str):
+        with self._mutex:
+            self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._mutex:
+            return {
+                "users": len(self._users),
+                "max_users": self.max_users,
+                "builds": self.builds,
+                "terms": sum(len(index.postings) for index in self._users.values()),
+            }
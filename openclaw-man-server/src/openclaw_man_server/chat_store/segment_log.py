@@ -0,0 +1,678 @@
+import json
+import os
+import shutil
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from ..logger import get_logger
+from .base import ChatStore
+from .archive import (
+    ARCHIVE_SUFFIX,
+    INDEX_SUFFIX,
+    ArchiveReader,
+    ArchiveSegment,
+    delete_archive,
+    iter_archive,
+    read_archive_index,
+    write_archive,
+)
+
+logger = get_logger("chat_store")
+
+SEGMENT_SUFFIX = ".jsonl"
+COMPACT_SUFFIX = ".compact.jsonl"
+TMP_SUFFIX = ".tmp"
+MANIFEST_NAME = "manifest.json"
+ARCHIVE_DIR = "archive"
+
+
+def _in_range(message: dict, since: Optional[int], until: Optional[int]) -> bool:
+    timestamp = int(message.get("timestamp") or 0)
+    return (since is None or timestamp >= since) and (until is None or timestamp <= until)
+
+
+class _Segment:
+    """单个热数据段文件的元数据"""
+
+    __slots__ = ("number", "path", "count", "size", "compact")
+
+    def __init__(self, number: int, path: Path, count: int = 0, size: int = 0, compact: bool = False):
+        self.number = number
+        self.path = path
+        self.count = count
+        self.size = size
+        self.compact = compact
+
+
+class _UserLog:
+    """
+    单个用户的归档段、热数据段与内存索引
+
+    所有消息按写入顺序分配全局序号 seq，热数据段中第 i 行的 seq 为 hot_seq0 + i。
+    热数据段开头的 hot_skip 行已经归档（或已超出保留范围），不再计入热数据。
+    - locations: 热数据行 -> (段, 字节偏移, 长度)
+    - conversations: conversation_id -> 升序的 seq 列表（归档 + 热数据）
+    - ids: 消息 id -> seq（id 重复时指向最新一条）
+    - duplicate_ids: 出现过不止一次的 id（旧版按秒生成的 id 可能重复），不能作为分页游标
+    """
+
+    __slots__ = (
+        "directory", "segments", "archives", "locations",
+        "hot_seq0", "hot_skip", "conversations", "ids", "duplicate_ids",
+    )
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.segments: List[_Segment] = []
+        self.archives: List[ArchiveSegment] = []
+        self.locations: List[Tuple[_Segment, int, int]] = []
+        self.hot_seq0 = 0
+        self.hot_skip = 0
+        self.conversations: Dict[Optional[str], List[int]] = {}
+        self.ids: Dict[str, int] = {}
+        self.duplicate_ids: Set[str] = set()
+
+    @property
+    def archive_dir(self) -> Path:
+        return self.directory / ARCHIVE_DIR
+
+    @property
+    def end_seq(self) -> int:
+        return self.hot_seq0 + len(self.locations)
+
+    @property
+    def hot_start(self) -> int:
+        return self.hot_seq0 + self.hot_skip
+
+    @property
+    def start_seq(self) -> int:
+        return self.archives[0].first_seq if self.archives else self.hot_start
+
+    def index(self, seq: int, message_id: Optional[str], conversation_id: Optional[str]):
+        self.conversations.setdefault(conversation_id, []).append(seq)
+        if message_id is not None:
+            if self.ids.get(message_id, seq) != seq:
+                self.duplicate_ids.add(message_id)
+            self.ids[message_id] = seq
+
+    def add(self, seg: _Segment, offset: int, length: int, message: dict, indexed: bool = True):
+        seq = self.end_seq
+        self.locations.append((seg, offset, length))
+        seg.count += 1
+        if indexed:
+            self.index(seq, message.get("id"), message.get("conversation_id"))
+
+    def unindex_before(self, seq: int, ids: Sequence[Optional[str]], first_seq: int):
+        """从索引中移除 seq 之前的消息（ids 为被移除消息的 id，从 first_seq 开始）"""
+        for conversation_id in list(self.conversations):
+            seqs = self.conversations[conversation_id]
+            del seqs[:bisect_left(seqs, seq)]
+            if not seqs:
+                del self.conversations[conversation_id]
+        for i, message_id in enumerate(ids):
+            if message_id is not None and self.ids.get(message_id) == first_seq + i:
+                # 最新的一条也被移除时，同 id 的更早记录必然已被移除
+                del self.ids[message_id]
+                self.duplicate_ids.discard(message_id)
+
+
+class SegmentLogStore(ChatStore):
+    """
+    基于追加写 JSONL 段文件的分层聊天记录存储引擎
+
+    - 每个用户一个目录 user_{id}/，消息逐行追加到当前活动段，写入代价与历史长度无关
+    - 热数据只保留最近 max_records 条（再加一个归档批次的余量），读取最近记录很快
+    - 超出部分按批写成不可变的 gzip 归档段 archive/{first_seq}.jsonl.gz，
+      游标分页可以按需读取归档内容
+    - 按条数、时间、归档字节数做保留，超出时整段删除最早的归档段
+    - manifest.json 记录归档段列表与热数据的起点，是每次归档的提交点：
+      先写归档文件、再写 manifest、最后删除完全归档的热数据段，
+      任意时刻崩溃都不会丢失或重复消息；未被 manifest 引用的归档文件在打开时删除
+    - 首次打开用户日志时截断未写完的尾行（崩溃恢复），并建立对话索引
+    - 最多在内存中保留 max_users 个用户的索引，超出时淘汰最久未使用的，下次访问时从磁盘重建
+    """
+
+    def __init__(
+        self,
+        base_dir: Path,
+        max_records: int = 100,
+        segment_max_bytes: int = 1024 * 1024,
+        fsync: bool = False,
+        archive_enabled: bool = True,
+        archive_batch: int = 500,
+        archive_compresslevel: int = 6,
+        retention_max_count: Optional[int] = None,
+        retention_max_age: Optional[int] = None,
+        retention_max_bytes: Optional[int] = None,
+        max_users: int = 10000
+    ):
+        self.base_dir = Path(base_dir)
+        self.max_records = max_records
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self.archive_enabled = archive_enabled
+        # 热数据超出 max_records 达到一个批次后才归档，摊还后每条消息的归档代价为常数
+        self.archive_batch = max(1, archive_batch)
+        self.archive_compresslevel = archive_compresslevel
+        self.retention_max_count = retention_max_count
+        self.retention_max_age = retention_max_age
+        self.retention_max_bytes = retention_max_bytes
+        self.archive_reader = ArchiveReader()
+        self.max_users = max(1, max_users)
+        self._logs: "OrderedDict[str, _UserLog]" = OrderedDict()
+        # 不同用户的调用可能在多个 I/O 线程中并发执行
+        self._mutex = Lock()
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    # ---- 路径 ----
+
+    def _user_dir(self, user_id: str) -> Path:
+        return self.base_dir / f"user_{user_id}"
+
+    def _legacy_file(self, user_id: str) -> Path:
+        """旧版整文件 JSON 存储路径"""
+        return self.base_dir / f"user_{user_id}.json"
+
+    @staticmethod
+    def _segment_name(number: int, compact: bool = False) -> str:
+        return f"{number:08d}{COMPACT_SUFFIX if compact else SEGMENT_SUFFIX}"
+
+    @staticmethod
+    def _encode(message: dict) -> bytes:
+        return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+    # ---- manifest ----
+
+    @staticmethod
+    def _load_manifest(directory: Path) -> dict:
+        path = directory / MANIFEST_NAME
+        if not path.exists():
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"读取 {path} 失败: {e}")
+            return {}
+
+    def _save_manifest(self, log: _UserLog):
+        manifest = {
+            "hot_first_segment": log.segments[0].number if log.segments else 0,
+            "hot_seq0": log.hot_seq0,
+            "hot_skip": log.hot_skip,
+            "archives": [seg.to_dict() for seg in log.archives],
+        }
+        path = log.directory / MANIFEST_NAME
+        tmp_path = path.with_name(path.name + TMP_SUFFIX)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # ---- 打开与恢复 ----
+
+    def _open(self, user_id: str, create: bool = False) -> Optional[_UserLog]:
+        """加载用户日志并建立索引，必要时迁移旧文件并执行尾部恢复"""
+        with self._mutex:
+            log = self._logs.get(user_id)
+            if log is not None:
+                self._logs.move_to_end(user_id)
+                return log
+
+        directory = self._user_dir(user_id)
+        legacy = self._legacy_file(user_id)
+        if not directory.exists():
+            if not create and not legacy.exists():
+                return None
+            directory.mkdir(parents=True, exist_ok=True)
+
+        log = _UserLog(directory)
+        manifest = self._load_manifest(directory)
+        self._load_archives(log, manifest)
+
+        segments = self._scan_segments(directory, manifest.get("hot_first_segment", 0))
+        if segments and segments[0].number == manifest.get("hot_first_segment"):
+            log.hot_seq0 = manifest.get("hot_seq0", 0)
+            log.hot_skip = manifest.get("hot_skip", 0)
+        else:
+            # 没有 manifest 或热数据起点已变化（旧版压缩段），从归档末尾开始计数
+            log.hot_seq0 = log.archives[-1].end_seq if log.archives else 0
+            log.hot_skip = 0
+
+        for seg in segments:
+            self._recover_tail(seg)
+            self._index_segment(log, seg)
+            log.segments.append(seg)
+        with self._mutex:
+            self._logs[user_id] = log
+            # 被淘汰的日志若仍在其他线程中使用，用完即释放；该用户下次访问时重新打开
+            while len(self._logs) > self.max_users:
+                self._logs.popitem(last=False)
+
+        if legacy.exists():
+            self._migrate_legacy(log, legacy)
+        return log
+
+    def _load_archives(self, log: _UserLog, manifest: dict):
+        """加载 manifest 中的归档段索引，删除未被引用的归档文件"""
+        archive_dir = log.archive_dir
+        for data in manifest.get("archives", []):
+            seg = ArchiveSegment.from_dict(data)
+            try:
+                ids, conversations = read_archive_index(archive_dir, seg)
+            except (OSError, json.JSONDecodeError, KeyError) as e:
+                logger.error(f"读取归档索引 {seg.index_path(archive_dir)} 失败: {e}")
+                continue
+            for i, (message_id, conversation_id) in enumerate(zip(ids, conversations)):
+                log.index(seg.first_seq + i, message_id, conversation_id)
+            log.archives.append(seg)
+
+        if archive_dir.exists():
+            referenced = {seg.stem for seg in log.archives}
+            for path in archive_dir.iterdir():
+                stem = path.name.split(".", 1)[0]
+                if stem not in referenced and (
+                    path.name.endswith(ARCHIVE_SUFFIX) or path.name.endswith(INDEX_SUFFIX)
+                    or path.name.endswith(TMP_SUFFIX)
+                ):
+                    path.unlink(missing_ok=True)
+
+    def _scan_segments(self, directory: Path, first_segment: int = 0) -> List[_Segment]:
+        """扫描热数据段文件，丢弃已失效的旧段和未完成的临时文件"""
+        segments = []
+        for path in directory.iterdir():
+            name = path.name
+            if name.endswith(TMP_SUFFIX):
+                path.unlink(missing_ok=True)
+                continue
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            compact = name.endswith(COMPACT_SUFFIX)
+            try:
+                number = int(name.split(".", 1)[0])
+            except ValueError:
+                continue
+            segments.append(_Segment(number, path, compact=compact))
+        segments.sort(key=lambda seg: seg.number)
+
+        # 最新的压缩段之前的段已失效（旧版压缩后删除旧段前崩溃的情况）；
+        # manifest 记录的热数据起点之前的段已完全归档
+        base = max((i for i, seg in enumerate(segments) if seg.compact), default=0)
+        while base < len(segments) and segments[base].number < first_segment:
+            base += 1
+        for seg in segments[:base]:
+            seg.path.unlink(missing_ok=True)
+        return segments[base:]
+
+    @staticmethod
+    def _recover_tail(seg: _Segment):
+        """截断段文件末尾未写完的半行"""
+        with open(seg.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # 向前查找最后一个换行符
+            pos = size - 1
+            chunk = 4096
+            while pos > 0:
+                start = max(0, pos - chunk)
+                f.seek(start)
+                data = f.read(pos - start)
+                idx = data.rfind(b"\n")
+                if idx != -1:
+                    pos = start + idx + 1
+                    break
+                pos = start
+            f.truncate(pos)
+            logger.warning(f"段文件 {seg.path} 尾部不完整，已截断到 {pos} 字节")
+
+    @staticmethod
+    def _index_segment(log: _UserLog, seg: _Segment):
+        """逐行读取段文件，记录每条消息的偏移并加入索引（已归档的行只记录位置）"""
+        offset = 0
+        with open(seg.path, "rb") as f:
+            for line in f:
+                length = len(line)
+                if line.strip():
+                    try:
+                        message = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"跳过损坏的记录: {seg.path} @ {offset}")
+                    else:
+                        log.add(seg, offset, length, message, indexed=len(log.locations) >= log.hot_skip)
+                offset += length
+        seg.size = offset
+
+    def _migrate_legacy(self, log: _UserLog, legacy: Path):
+        """把旧版 user_{id}.json 转换为热数据段"""
+        try:
+            content = legacy.read_text(encoding="utf-8").strip()
+            messages = json.loads(content) if content else []
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"迁移旧聊天记录 {legacy} 失败: {e}")
+            messages = []
+        if messages:
+            # 旧记录排在已有热数据之前
+            existing = self._read_seqs(log, range(log.hot_start, log.end_seq))
+            self._rewrite(log, messages + existing)
+        legacy.unlink(missing_ok=True)
+
+    def _rewrite(self, log: _UserLog, messages: List[dict]):
+        """把 messages 写成新的热数据压缩段并重建热数据索引"""
+        number = log.segments[-1].number + 1 if log.segments else 1
+        path = log.directory / self._segment_name(number, compact=True)
+        tmp_path = path.with_name(path.name + TMP_SUFFIX)
+
+        lines = [self._encode(m) for m in messages]
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        old_segments = log.segments
+        seg = _Segment(number, path, compact=True)
+        log.conversations.clear()
+        log.ids.clear()
+        log.duplicate_ids.clear()
+        for archive in log.archives:
+            ids, conversations = read_archive_index(log.archive_dir, archive)
+            for i, (message_id, conversation_id) in enumerate(zip(ids, conversations)):
+                log.index(archive.first_seq + i, message_id, conversation_id)
+
+        log.segments = [seg]
+        log.locations = []
+        log.hot_seq0 = log.archives[-1].end_seq if log.archives else 0
+        log.hot_skip = 0
+        offset = 0
+        for message, line in zip(messages, lines):
+            log.add(seg, offset, len(line), message)
+            offset += len(line)
+        seg.size = offset
+
+        self._save_manifest(log)
+        for old in old_segments:
+            old.path.unlink(missing_ok=True)
+
+    # ---- 写入与归档 ----
+
+    def append(self, user_id: str, messages: List[dict]):
+        """追加多条消息到用户的活动段，并增量更新索引"""
+        if not messages:
+            return
+        log = self._open(user_id, create=True)
+
+        active = log.segments[-1] if log.segments else None
+        if active is None or active.size >= self.segment_max_bytes or active.count >= self.archive_batch:
+            number = active.number + 1 if active else 1
+            active = _Segment(number, log.directory / self._segment_name(number))
+            log.segments.append(active)
+            if len(log.segments) == 1:
+                self._save_manifest(log)
+
+        lines = [self._encode(m) for m in messages]
+        with open(active.path, "ab") as f:
+            f.write(b"".join(lines))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        offset = active.size
+        for message, line in zip(messages, lines):
+            log.add(active, offset, len(line), message)
+            offset += len(line)
+        active.size = offset
+
+        if log.end_seq - log.hot_start >= self.max_records + self.archive_batch:
+            self._archive(log)
+
+    def _archive(self, log: _UserLog):
+        """把超出热数据窗口的消息写入归档段（或直接丢弃），然后执行保留策略"""
+        count = log.end_seq - log.hot_start - self.max_records
+        if count <= 0:
+            return
+        first_seq = log.hot_start
+        messages = self._read_seqs(log, range(first_seq, first_seq + count))
+
+        if self.archive_enabled:
+            log.archives.append(write_archive(
+                log.archive_dir, first_seq, messages, compresslevel=self.archive_compresslevel
+            ))
+        else:
+            log.unindex_before(first_seq + count, [m.get("id") for m in messages], first_seq)
+        log.hot_skip += count
+
+        dropped = self._apply_retention(log)
+
+        # 完全归档的热数据段不再需要
+        released = []
+        while len(log.segments) > 1 and log.segments[0].count <= log.hot_skip:
+            seg = log.segments.pop(0)
+            del log.locations[:seg.count]
+            log.hot_seq0 += seg.count
+            log.hot_skip -= seg.count
+            released.append(seg)
+
+        self._save_manifest(log)
+        for seg in released:
+            seg.path.unlink(missing_ok=True)
+        for archive in dropped:
+            self.archive_reader.discard(log.archive_dir, archive)
+            delete_archive(log.archive_dir, archive)
+
+    def _apply_retention(self, log: _UserLog) -> List[ArchiveSegment]:
+        """按条数、时间、字节数删除最早的归档段，返回被删除的归档段"""
+        dropped = []
+        cutoff = time.time() - self.retention_max_age if self.retention_max_age else None
+        archived_bytes = sum(seg.bytes for seg in log.archives)
+        while log.archives:
+            oldest = log.archives[0]
+            total = log.end_seq - oldest.first_seq
+            if not (
+                (self.retention_max_count and total > self.retention_max_count)
+                or (self.retention_max_bytes and archived_bytes > self.retention_max_bytes)
+                or (cutoff and oldest.max_ts < cutoff)
+            ):
+                break
+            log.archives.pop(0)
+            archived_bytes -= oldest.bytes
+            try:
+                ids, _ = read_archive_index(log.archive_dir, oldest)
+            except (OSError, json.JSONDecodeError, KeyError):
+                ids = []
+            log.unindex_before(oldest.end_seq, ids, oldest.first_seq)
+            dropped.append(oldest)
+        return dropped
+
+    # ---- 读取 ----
+
+    def _window_start(self, log: _UserLog) -> int:
+        """最近 max_records 条（热数据窗口）的起始 seq"""
+        return max(log.hot_start, log.end_seq - self.max_records)
+
+    def _read_seqs(self, log: _UserLog, seqs: Sequence[int]) -> List[dict]:
+        """按 seq 读取消息：热数据定位读取，归档数据解压后读取"""
+        messages = []
+        handles = {}
+        archive_starts = [seg.first_seq for seg in log.archives]
+        try:
+            for seq in seqs:
+                if seq >= log.hot_seq0:
+                    seg, offset, length = log.locations[seq - log.hot_seq0]
+                    f = handles.get(seg.number)
+                    if f is None:
+                        f = handles[seg.number] = open(seg.path, "rb")
+                    f.seek(offset)
+                    messages.append(json.loads(f.read(length)))
+                else:
+                    archive = log.archives[bisect_right(archive_starts, seq) - 1]
+                    archived = self.archive_reader.read(log.archive_dir, archive)
+                    messages.append(archived[seq - archive.first_seq])
+        finally:
+            for f in handles.values():
+                f.close()
+        return messages
+
+    def read_all(self, user_id: str) -> List[dict]:
+        """按时间顺序读取最近 max_records 条消息（热数据窗口）"""
+        log = self._open(user_id)
+        if log is None:
+            return []
+        return self._read_seqs(log, range(self._window_start(log), log.end_seq))
+
+    def scan(
+        self,
+        user_id: str,
+        start_seq: int = 0,
+        conversation_id: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None
+    ) -> Iterator[Tuple[int, dict]]:
+        """
+        按对话过滤时通过对话索引定位读取；否则先逐个解压归档段，再按批读取热数据。
+        时间范围之外的归档段直接跳过，无需解压
+        """
+        log = self._open(user_id)
+        if log is None:
+            return
+        start_seq = max(start_seq, log.start_seq)
+
+        if conversation_id:
+            seqs = log.conversations.get(conversation_id, [])
+            seqs = seqs[bisect_left(seqs, start_seq):]
+            for i in range(0, len(seqs), self.archive_batch):
+                batch = seqs[i:i + self.archive_batch]
+                for seq, message in zip(batch, self._read_seqs(log, batch)):
+                    if _in_range(message, since, until):
+                        yield seq, message
+            return
+
+        end = log.end_seq
+        for archive in list(log.archives):
+            if archive.end_seq <= start_seq:
+                continue
+            if (since is not None and archive.max_ts < since) or (until is not None and archive.min_ts > until):
+                continue
+            for seq, message in enumerate(iter_archive(log.archive_dir, archive), archive.first_seq):
+                if seq >= start_seq and _in_range(message, since, until):
+                    yield seq, message
+        for begin in range(max(log.hot_start, start_seq), end, self.archive_batch):
+            batch = range(begin, min(end, begin + self.archive_batch))
+            for seq, message in zip(batch, self._read_seqs(log, batch)):
+                if _in_range(message, since, until):
+                    yield seq, message
+
+    def scan_reverse(self, user_id: str, conversation_id: str) -> Iterator[dict]:
+        """通过对话索引从最新一条向前定位读取，批大小从 16 条开始倍增"""
+        log = self._open(user_id)
+        if log is None:
+            return
+        seqs = log.conversations.get(conversation_id, [])
+        lo = bisect_left(seqs, log.start_seq)
+        end = len(seqs)
+        batch = 16
+        while end > lo:
+            begin = max(lo, end - batch)
+            chunk = seqs[begin:end]
+            yield from reversed(self._read_seqs(log, chunk))
+            end = begin
+            batch = min(batch * 2, self.archive_batch)
+
+    def list_users(self) -> List[str]:
+        users = set()
+        for path in self.base_dir.glob("user_*"):
+            name = path.name[len("user_"):]
+            if path.is_dir():
+                users.add(name)
+            elif path.suffix == ".json":
+                users.add(name[:-len(".json")])
+        return sorted(users)
+
+    def get_messages(self, user_id: str, message_ids: List[str]) -> List[dict]:
+        log = self._open(user_id)
+        if log is None:
+            return []
+        seqs = sorted({log.ids[i] for i in message_ids if i in log.ids})
+        return self._read_seqs(log, seqs)
+
+    def _range(self, log: _UserLog, conversation_id: Optional[str]) -> Tuple[Sequence[int], int, int]:
+        """返回 (seq 序列, 保留范围起点下标, 终点下标)"""
+        if conversation_id:
+            seqs = log.conversations.get(conversation_id, [])
+            return seqs, bisect_left(seqs, log.start_seq), len(seqs)
+        seqs = range(log.end_seq)
+        return seqs, log.start_seq, log.end_seq
+
+    def count(self, user_id: str, conversation_id: Optional[str] = None) -> int:
+        log = self._open(user_id)
+        if log is None:
+            return 0
+        _, lo, hi = self._range(log, conversation_id)
+        return hi - lo
+
+    def query(
+        self,
+        user_id: str,
+        conversation_id: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+        before_id: Optional[str] = None,
+        after_id: Optional[str] = None
+    ) -> dict:
+        """
+        分页查询（按时间升序返回）
+
+        - before_id: 返回该消息之前的 limit 条，可一直翻到归档数据
+        - after_id: 返回该消息之后的 limit 条
+        - 游标 id 对应多条记录时无法确定位置，抛出 ValueError
+        - 都未指定时在热数据窗口内按 offset 分页
+        total 为保留范围内（该对话）的真实总数，包括归档，由索引直接得出
+        """
+        result = {"messages": [], "total": 0, "has_more_before": False, "has_more_after": False}
+        log = self._open(user_id)
+        if log is None:
+            return result
+
+        seqs, lo, hi = self._range(log, conversation_id)
+        result["total"] = hi - lo
+
+        if before_id is not None or after_id is not None:
+            cursor_id = before_id if before_id is not None else after_id
+            if cursor_id in log.duplicate_ids:
+                raise ValueError(f"消息 id 不唯一，不能作为游标: {cursor_id}")
+            anchor = log.ids.get(cursor_id)
+            if anchor is None:
+                return result
+            if before_id is not None:
+                end = bisect_left(seqs, anchor, lo, hi)
+                begin = max(lo, end - limit)
+            else:
+                begin = bisect_right(seqs, anchor, lo, hi)
+                end = min(hi, begin + limit)
+        else:
+            window_lo = bisect_left(seqs, self._window_start(log), lo, hi)
+            begin = min(hi, window_lo + offset)
+            end = min(hi, begin + limit)
+
+        result["messages"] = self._read_seqs(log, seqs[begin:end])
+        result["has_more_before"] = begin > lo
+        result["has_more_after"] = end < hi
+        return result
+
+    def clear(self, user_id: str):
+        """删除用户的全部记录（包括归档）"""
+        with self._mutex:
+            log = self._logs.pop(user_id, None)
+        directory = self._user_dir(user_id)
+        self.archive_reader.discard(log.archive_dir if log else directory / ARCHIVE_DIR)
+        shutil.rmtree(directory, ignore_errors=True)
+        self._legacy_file(user_id).unlink(missing_ok=True)
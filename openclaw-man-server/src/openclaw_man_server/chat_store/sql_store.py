@@ -0,0 +1,288 @@
+import json
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import create_engine, delete, exists, func, insert, select
+from sqlalchemy.engine import Engine
+
+from ..logger import get_logger
+from ..api_server.models import ChatMessage
+from .base import ChatStore
+
+logger = get_logger("chat_store")
+
+# 单独成列的消息字段，其余字段序列化到 extra
+_COLUMN_FIELDS = ("id", "timestamp", "sender", "text", "robot_id", "conversation_id")
+
+
+class SqlChatStore(ChatStore):
+    """
+    基于 SQLAlchemy 的聊天记录存储
+
+    - 消息写入 chat_messages 表，(user_id, conversation_id, timestamp) 建有索引
+    - 一批消息使用一条多行 INSERT 写入
+    - 读取最近记录与 offset 分页的范围与文件存储一致：每个用户最近 max_records 条；
+      游标分页可以翻到全部保留的记录
+    - 保留策略按条数 / 时间生效，超出部分在累积 compact_slack 条后批量删除
+    - 本地可使用 SQLite 测试，例如 url: "sqlite:///./chat_history/chat.db"
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        engine: Optional[Engine] = None,
+        max_records: int = 100,
+        compact_slack: Optional[int] = None,
+        retention_max_count: Optional[int] = None,
+        retention_max_age: Optional[int] = None
+    ):
+        # 只有自己创建的引擎才在 close 时释放，传入的或业务数据库共用的引擎由其所有者管理
+        self._owns_engine = engine is None and bool(url)
+        if engine is None:
+            if url:
+                engine = create_engine(url, pool_pre_ping=True)
+            else:
+                # 默认复用业务数据库
+                from ..api_server.database import engine
+        self.engine = engine
+        self.table = ChatMessage.__table__
+        self.max_records = max_records
+        self.retention_max_count = retention_max_count
+        self.retention_max_age = retention_max_age
+        self.compact_slack = compact_slack if compact_slack is not None else max(max_records, 100)
+        # 用户自上次清理以来新增的记录数
+        self._pending_trim: Dict[str, int] = {}
+        self.table.create(self.engine, checkfirst=True)
+
+    # ---- 行与消息转换 ----
+
+    def _to_row(self, user_id: str, message: dict) -> dict:
+        extra = {k: v for k, v in message.items() if k not in _COLUMN_FIELDS}
+        return {
+            "message_id": message.get("id"),
+            "user_id": user_id,
+            "conversation_id": message.get("conversation_id"),
+            "robot_id": message.get("robot_id"),
+            "sender": message.get("sender") or "",
+            "text": message.get("text"),
+            "timestamp": int(message.get("timestamp") or 0),
+            "extra": json.dumps(extra, ensure_ascii=False) if extra else None,
+        }
+
+    @staticmethod
+    def _to_message(row) -> dict:
+        message = {
+            "id": row.message_id,
+            "timestamp": row.timestamp,
+            "sender": row.sender,
+            "text": row.text,
+            "robot_id": row.robot_id,
+            "conversation_id": row.conversation_id,
+        }
+        if row.extra:
+            message.update(json.loads(row.extra))
+        return message
+
+    # ---- 读写 ----
+
+    def append(self, user_id: str, messages: List[dict]):
+        """使用一条多行 INSERT 写入一批消息"""
+        if not messages:
+            return
+        rows = [self._to_row(user_id, m) for m in messages]
+        with self.engine.begin() as conn:
+            conn.execute(insert(self.table).values(rows))
+
+            pending = self._pending_trim.get(user_id, 0) + len(rows)
+            if pending > self.compact_slack:
+                self._apply_retention(conn, user_id)
+                pending = 0
+            self._pending_trim[user_id] = pending
+
+    def _apply_retention(self, conn, user_id: str):
+        """按条数与时间删除超出保留范围的记录"""
+        t = self.table
+        if self.retention_max_count:
+            start = self._nth_newest_seq(conn, user_id, self.retention_max_count)
+            if start is not None:
+                conn.execute(delete(t).where(t.c.user_id == user_id, t.c.seq < start))
+        if self.retention_max_age:
+            cutoff = int(time.time()) - self.retention_max_age
+            conn.execute(delete(t).where(t.c.user_id == user_id, t.c.timestamp < cutoff))
+
+    def _nth_newest_seq(self, conn, user_id: str, n: int) -> Optional[int]:
+        """倒数第 n 条消息的序号，不足 n 条时返回 None"""
+        t = self.table
+        return conn.execute(
+            select(t.c.seq)
+            .where(t.c.user_id == user_id)
+            .order_by(t.c.seq.desc())
+            .offset(n - 1)
+            .limit(1)
+        ).scalar()
+
+    def _window_start(self, conn, user_id: str) -> Optional[int]:
+        """最近 max_records 条中第一条消息的序号，不足 max_records 条时返回 None"""
+        return self._nth_newest_seq(conn, user_id, self.max_records)
+
+    def _base_conditions(
+        self, conn, user_id: str, conversation_id: Optional[str], window: bool = True
+    ) -> list:
+        t = self.table
+        conditions = [t.c.user_id == user_id]
+        if window:
+            start = self._window_start(conn, user_id)
+            if start is not None:
+                conditions.append(t.c.seq >= start)
+        if conversation_id:
+            conditions.append(t.c.conversation_id == conversation_id)
+        return conditions
+
+    def read_all(self, user_id: str) -> List[dict]:
+        t = self.table
+        with self.engine.connect() as conn:
+            conditions = self._base_conditions(conn, user_id, None)
+            rows = conn.execute(select(t).where(*conditions).order_by(t.c.seq)).all()
+        return [self._to_message(row) for row in rows]
+
+    def scan(
+        self,
+        user_id: str,
+        start_seq: int = 0,
+        conversation_id: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        batch_size: int = 500
+    ) -> Iterator[Tuple[int, dict]]:
+        """按 seq 键集分页读取，每批一次查询"""
+        t = self.table
+        conditions = [t.c.user_id == user_id]
+        if conversation_id:
+            conditions.append(t.c.conversation_id == conversation_id)
+        if since is not None:
+            conditions.append(t.c.timestamp >= since)
+        if until is not None:
+            conditions.append(t.c.timestamp <= until)
+        while True:
+            with self.engine.connect() as conn:
+                rows = conn.execute(
+                    select(t).where(*conditions, t.c.seq >= start_seq).order_by(t.c.seq).limit(batch_size)
+                ).all()
+            if not rows:
+                return
+            for row in rows:
+                yield row.seq, self._to_message(row)
+            start_seq = rows[-1].seq + 1
+
+    def scan_reverse(self, user_id: str, conversation_id: str, batch_size: int = 50) -> Iterator[dict]:
+        """按 seq 倒序键集分页读取，每批一次查询"""
+        t = self.table
+        conditions = [t.c.user_id == user_id, t.c.conversation_id == conversation_id]
+        end_seq = None
+        while True:
+            where = conditions if end_seq is None else [*conditions, t.c.seq < end_seq]
+            with self.engine.connect() as conn:
+                rows = conn.execute(
+                    select(t).where(*where).order_by(t.c.seq.desc()).limit(batch_size)
+                ).all()
+            if not rows:
+                return
+            for row in rows:
+                yield self._to_message(row)
+            end_seq = rows[-1].seq
+
+    def list_users(self) -> List[str]:
+        t = self.table
+        with self.engine.connect() as conn:
+            return list(conn.execute(select(t.c.user_id).distinct().order_by(t.c.user_id)).scalars())
+
+    def get_messages(self, user_id: str, message_ids: List[str]) -> List[dict]:
+        if not message_ids:
+            return []
+        t = self.table
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(t).where(t.c.user_id == user_id, t.c.message_id.in_(message_ids)).order_by(t.c.seq)
+            ).all()
+        return [self._to_message(row) for row in rows]
+
+    def count(self, user_id: str, conversation_id: Optional[str] = None) -> int:
+        t = self.table
+        with self.engine.connect() as conn:
+            conditions = self._base_conditions(conn, user_id, conversation_id, window=False)
+            return conn.execute(select(func.count()).select_from(t).where(*conditions)).scalar() or 0
+
+    def query(
+        self,
+        user_id: str,
+        conversation_id: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+        before_id: Optional[str] = None,
+        after_id: Optional[str] = None
+    ) -> dict:
+        t = self.table
+        result = {"messages": [], "total": 0, "has_more_before": False, "has_more_after": False}
+        with self.engine.connect() as conn:
+            cursor = before_id is not None or after_id is not None
+            # total 与 has_more_* 以全部保留记录为准；offset 分页只在最近 max_records 条内进行
+            conditions = self._base_conditions(conn, user_id, conversation_id, window=False)
+            result["total"] = conn.execute(select(func.count()).select_from(t).where(*conditions)).scalar() or 0
+
+            if cursor:
+                cursor_id = before_id if before_id is not None else after_id
+                anchor, matched = conn.execute(
+                    select(func.max(t.c.seq), func.count()).where(
+                        t.c.user_id == user_id,
+                        t.c.message_id == cursor_id
+                    )
+                ).one()
+                if anchor is None:
+                    return result
+                if matched > 1:
+                    # 旧版按秒生成的 id 可能重复，无法确定游标位置
+                    raise ValueError(f"消息 id 不唯一，不能作为游标: {cursor_id}")
+                if before_id is not None:
+                    rows = conn.execute(
+                        select(t).where(*conditions, t.c.seq < anchor).order_by(t.c.seq.desc()).limit(limit)
+                    ).all()
+                    rows.reverse()
+                else:
+                    rows = conn.execute(
+                        select(t).where(*conditions, t.c.seq > anchor).order_by(t.c.seq).limit(limit)
+                    ).all()
+            else:
+                window = self._base_conditions(conn, user_id, conversation_id)
+                rows = conn.execute(
+                    select(t).where(*window).order_by(t.c.seq).offset(offset).limit(limit)
+                ).all()
+
+            if rows:
+                first, last = rows[0].seq, rows[-1].seq
+            elif before_id is not None:
+                # 空页: 游标之前没有记录，游标本身及之后的记录算作“之后”
+                first, last = anchor, anchor - 1
+            elif after_id is not None:
+                first, last = anchor + 1, anchor
+            else:
+                first = last = None
+
+            if first is not None:
+                result["has_more_before"] = conn.execute(
+                    select(exists().where(*conditions, t.c.seq < first))
+                ).scalar()
+                result["has_more_after"] = conn.execute(
+                    select(exists().where(*conditions, t.c.seq > last))
+                ).scalar()
+
+        result["messages"] = [self._to_message(row) for row in rows]
+        return result
+
+    def clear(self, user_id: str):
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.user_id == user_id))
+        self._pending_trim.pop(user_id, None)
+
+    def close(self):
+        if self._owns_engine:
+            self.engine.dispose()
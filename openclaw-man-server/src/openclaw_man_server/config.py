@@ -32,10 +32,18 @@ def get_config() -> dict:
         _config = load_config()
     return _config
 
+_upload_config = None
+# 已确认存在的上传目录，避免每次请求都 mkdir
+_upload_dirs = set()
+
 def get_upload_config() -> dict:
     """
-    获取上传配置，如果没有配置则返回默认配置
+    获取上传配置，如果没有配置则返回默认配置（只在第一次调用时合并）
     """
+    global _upload_config
+    if _upload_config is not None:
+        return _upload_config
+
     config = get_config()
     upload_config = config.get("upload", {})
     
@@ -51,12 +59,15 @@ def get_upload_config() -> dict:
         if key not in upload_config:
             upload_config[key] = default_config[key]
     
+    _upload_config = upload_config
     return upload_config
 
 def ensure_upload_directory(user_id: str = None) -> Path:
     """
     确保上传目录存在，返回目录路径
     如果提供了 user_id，则返回该用户的子目录
+
+    创建过的目录会被记住，之后的调用不再访问文件系统
     """
     upload_config = get_upload_config()
     upload_dir = Path(upload_config["directory"])
@@ -70,5 +81,7 @@ def ensure_upload_directory(user_id: str = None) -> Path:
     if user_id:
         upload_dir = upload_dir / str(user_id)
     
-    upload_dir.mkdir(parents=True, exist_ok=True)
+    if upload_dir not in _upload_dirs:
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        _upload_dirs.add(upload_dir)
     return upload_dir
@@ -0,0 +1,68 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+try:
+    from .config import get_config
+except ImportError:
+    from openclaw_man_server.config import get_config
+
+
+class IOExecutor:
+    """
+    阻塞文件 I/O 专用线程池
+
+    open/json/unlink 等同步调用在这里执行，避免阻塞 uvicorn 事件循环。
+    max_workers 为 0 时退化为在事件循环中直接调用（便于对比和调试）
+    """
+
+    def __init__(self, max_workers: int = 4, thread_name_prefix: str = "chat-io"):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if max_workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """在线程池中执行同步函数并等待结果"""
+        if self._executor is None:
+            return func(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+# 单例实例
+_io_executor = None
+_upload_executor = None
+
+def get_io_executor() -> IOExecutor:
+    global _io_executor
+    if _io_executor is None:
+        chat_config = get_config().get("chat_history", {})
+        _io_executor = IOExecutor(max_workers=int(chat_config.get("io_workers", 4)))
+    return _io_executor
+
+def get_upload_executor() -> IOExecutor:
+    """上传文件写盘专用线程池，大文件写入不占用聊天记录的 I/O 线程"""
+    global _upload_executor
+    if _upload_executor is None:
+        upload_config = get_config().get("upload", {})
+        _upload_executor = IOExecutor(
+            max_workers=int(upload_config.get("io_workers", 4)),
+            thread_name_prefix="upload-io"
+        )
+    return _upload_executor
+
+def shutdown_io_executor():
+    global _io_executor, _upload_executor
+    if _io_executor is not None:
+        _io_executor.shutdown()
+        _io_executor = None
+    if _upload_executor is not None:
+        _upload_executor.shutdown()
+        _upload_executor = None
@@ -0,0 +1,40 @@
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+
+class KeyedLock:
+    """
+    按键区分的异步锁管理器
+
+    每个键对应一把独立的 asyncio.Lock，不同键之间互不阻塞。
+    锁对象只被弱引用持有：没有协程持有或等待时会被自动回收，
+    因此内存占用与当前活跃的键数量成正比，空闲用户不会留下锁
+    """
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[Hashable, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _get(self, key: Hashable) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    @asynccontextmanager
+    async def __call__(self, key: Hashable):
+        """用法: async with keyed_lock(user_id): ..."""
+        # 局部变量持有强引用，保证锁在使用期间不会被回收
+        lock = self._get(key)
+        async with lock:
+            yield
+
+    def locked(self, key: Hashable) -> bool:
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    def __len__(self) -> int:
+        """当前存活（被持有或等待中）的锁数量"""
+        return len(self._locks)
@@ -0,0 +1,55 @@
+import asyncio
+from typing import Optional
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监测
+
+    以固定间隔休眠，实际唤醒时间与预期时间之差即为事件循环被阻塞的时长
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self):
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def stats(self) -> dict:
+        """返回平均与最大延迟（毫秒）"""
+        avg = self.total_lag / self.samples if self.samples else 0.0
+        return {
+            "samples": self.samples,
+            "avg_lag_ms": round(avg * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+        }
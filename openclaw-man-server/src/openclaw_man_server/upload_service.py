@@ -0,0 +1,396 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+try:
+    from .config import get_upload_config, ensure_upload_directory
+    from .logger import get_logger
+    from .keyed_lock import KeyedLock
+    from .io_executor import get_upload_executor
+    from .upload_store.batch import BatchFormatError, BatchPart, BatchTooLarge, MultipartBatchReader
+    from .upload_store.blob_store import BlobStore
+    from .upload_store.file_index import FileEntry
+    from .upload_store.media import IMAGE_EXTENSIONS, MediaPipeline, media_available
+    from .upload_store.sessions import (
+        ChecksumMismatch, OffsetMismatch, SessionIncomplete, SessionStore, UploadSession
+    )
+    from .upload_store.streaming import TMP_DIR, StoredUpload, UploadTooLarge, hash_file, stream_to_temp
+except ImportError:
+    from openclaw_man_server.config import get_upload_config, ensure_upload_directory
+    from openclaw_man_server.logger import get_logger
+    from openclaw_man_server.keyed_lock import KeyedLock
+    from openclaw_man_server.io_executor import get_upload_executor
+    from openclaw_man_server.upload_store.batch import (
+        BatchFormatError, BatchPart, BatchTooLarge, MultipartBatchReader
+    )
+    from openclaw_man_server.upload_store.blob_store import BlobStore
+    from openclaw_man_server.upload_store.file_index import FileEntry
+    from openclaw_man_server.upload_store.media import IMAGE_EXTENSIONS, MediaPipeline, media_available
+    from openclaw_man_server.upload_store.sessions import (
+        ChecksumMismatch, OffsetMismatch, SessionIncomplete, SessionStore, UploadSession
+    )
+    from openclaw_man_server.upload_store.streaming import (
+        TMP_DIR, StoredUpload, UploadTooLarge, hash_file, stream_to_temp
+    )
+
+logger = get_logger("upload_service")
+
+
+def unique_filename(original_filename: str) -> str:
+    """保存到用户目录的文件名：原文件名 + 时间戳"""
+    file_ext = Path(original_filename).suffix.lower()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{Path(original_filename).stem}_{timestamp}{file_ext}"
+
+
+class UploadService:
+    """
+    上传文件服务：流式写盘 + 按内容去重
+
+    相同内容只保存一份 blob，用户目录中的文件是指向它的硬链接。
+    锁顺序：blob 锁 -> 用户锁（删除时先释放用户锁再获取 blob 锁），不会死锁
+    """
+
+    def __init__(self):
+        self.config = get_upload_config()
+        self.root = ensure_upload_directory()
+        self.blobs = BlobStore(self.root)
+        self.io = get_upload_executor()
+        self.max_size = int(self.config.get("max_file_size", 10 * 1024 * 1024))
+        self.chunk_size = int(self.config.get("chunk_size", 1024 * 1024))
+        # 用户锁保护用户目录与文件索引，blob 锁保证回收与新链接不会交错
+        self.user_locks = KeyedLock()
+        self.blob_locks = KeyedLock()
+        # 可续传上传会话
+        resumable_config = self.config.get("resumable", {})
+        self.resumable_max_size = int(resumable_config.get("max_file_size", 200 * 1024 * 1024))
+        self.sessions = SessionStore(self.root, ttl=int(resumable_config.get("session_ttl", 24 * 3600)))
+        self.session_locks = KeyedLock()
+        self._last_expire = 0.0
+        # 批量上传
+        batch_config = self.config.get("batch", {})
+        self.batch_max_files = int(batch_config.get("max_files", 50))
+        self.batch_max_total_size = int(batch_config.get("max_total_size", 100 * 1024 * 1024))
+        # 图片缩略图 / 预览图（需要安装 pillow）
+        media_config = self.config.get("media", {})
+        self.media_wait_timeout = float(media_config.get("wait_timeout", 5))
+        self.media = self._create_media_pipeline(media_config)
+        # 统计信息
+        self.blobs_written = 0
+        self.dedup_hits = 0
+        self.bytes_deduplicated = 0
+
+    def _create_media_pipeline(self, media_config: dict) -> Optional[MediaPipeline]:
+        if not media_config.get("enabled", True):
+            return None
+        if not media_available():
+            logger.warning("未安装 pillow，不生成图片缩略图 / 预览图")
+            return None
+        variants = media_config.get("variants") or None
+        return MediaPipeline(
+            self.root,
+            variants={name: int(edge) for name, edge in variants.items()} if variants else None,
+            workers=int(media_config.get("workers", 2)),
+            queue_size=int(media_config.get("queue_size", 1000)),
+            quality=int(media_config.get("quality", 80))
+        )
+
+    async def save(
+        self,
+        user_id: str,
+        file_name: str,
+        read: Callable[[int], Awaitable[bytes]]
+    ) -> StoredUpload:
+        """流式保存上传内容；内容已存在时丢弃临时文件，只新建链接"""
+        stored = await stream_to_temp(
+            read, self.root / TMP_DIR, self.max_size, chunk_size=self.chunk_size, io=self.io
+        )
+        return await self._commit(user_id, file_name, stored)
+
+    async def save_form_file(
+        self,
+        user_id: str,
+        content_type: str,
+        stream: AsyncIterator[bytes]
+    ) -> Optional[BatchPart]:
+        """
+        流式保存 multipart 请求中的第一个文件（/upload/file），请求中没有文件时返回 None
+
+        边解析请求体边写盘，内容超过 max_file_size 时立即停止读取并抛出 UploadTooLarge；
+        保存失败时返回的 part.error 为失败原因
+        """
+        parts, truncated = await self.save_batch(
+            user_id, content_type, stream, max_files=1, max_total_size=self.max_size
+        )
+        if truncated:
+            raise UploadTooLarge(self.max_size)
+        return parts[0] if parts else None
+
+    async def save_batch(
+        self,
+        user_id: str,
+        content_type: str,
+        stream: AsyncIterator[bytes],
+        max_files: Optional[int] = None,
+        max_total_size: Optional[int] = None
+    ) -> Tuple[List[BatchPart], bool]:
+        """
+        流式保存一个 multipart 请求中的多个文件，返回 (每个文件的结果, 是否因超过总大小而截断)
+
+        每个文件的头部一到就开始写盘，写盘与哈希在上传线程池中并行；
+        单个文件失败（超过大小限制、写盘失败）不影响其他文件。
+        max_files / max_total_size 默认使用 upload.batch 配置
+        """
+        reader = MultipartBatchReader(
+            content_type,
+            max_files if max_files is not None else self.batch_max_files,
+            max_total_size if max_total_size is not None else self.batch_max_total_size
+        )
+        tasks = []
+        used_names = set()
+
+        def start(part: BatchPart):
+            file_name = unique_filename(part.original_name)
+            if file_name in used_names:
+                # 同一批中的同名文件（例如相册里的多个 image.jpg）
+                path = Path(file_name)
+                file_name = f"{path.stem}_{part.index}{path.suffix}"
+            used_names.add(file_name)
+            part.file_name = file_name
+            tasks.append(asyncio.create_task(self._save_part(user_id, part)))
+
+        try:
+            await reader.run(stream, start)
+        finally:
+            # 已开始的文件都等写盘结束（成功、失败或因请求中断而中止）
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return reader.parts, reader.truncated
+
+    async def _save_part(self, user_id: str, part: BatchPart):
+        try:
+            part.stored = await self.save(user_id, part.file_name, part.read)
+        except (UploadTooLarge, BatchTooLarge, BatchFormatError) as e:
+            part.error = str(e)
+        except Exception as e:
+            logger.error(f"批量上传保存 {part.original_name} 失败: {e}")
+            part.error = f"文件保存失败: {e}"
+        finally:
+            part.close()
+
+    async def _commit(self, user_id: str, file_name: str, stored: StoredUpload) -> StoredUpload:
+        """把写完的临时文件收为 blob 并链接到用户目录（临时文件总会被移走或删除）"""
+        try:
+            async with self.blob_locks(stored.sha256):
+                written = await self.io.run(self.blobs.ingest, stored.path, stored.sha256)
+                path, previous = await self._link(user_id, file_name, stored.sha256, stored.size)
+        finally:
+            stored.path.unlink(missing_ok=True)
+
+        if written:
+            self.blobs_written += 1
+        else:
+            self.dedup_hits += 1
+            self.bytes_deduplicated += stored.size
+        if self.media and Path(file_name).suffix.lower() in IMAGE_EXTENSIONS:
+            # 只排队，不等待生成
+            self.media.submit(stored.sha256, self.blobs.blob_path(stored.sha256))
+        await self._collect(previous)
+        return StoredUpload(path, stored.size, stored.sha256)
+
+    async def link_existing(self, user_id: str, file_name: str, sha256: str) -> Optional[StoredUpload]:
+        """内容已存在时直接为用户建立文件（秒传），不存在时返回 None"""
+        async with self.blob_locks(sha256):
+            if not await self.io.run(self.blobs.has, sha256):
+                return None
+            size = await self.io.run(self.blobs.size, sha256)
+            path, previous = await self._link(user_id, file_name, sha256, size)
+
+        self.dedup_hits += 1
+        self.bytes_deduplicated += size
+        await self._collect(previous)
+        return StoredUpload(path, size, sha256)
+
+    async def stat_download(self, user_id: str, file_name: str) -> Optional[Tuple[Path, os.stat_result, str]]:
+        """返回下载文件的 (路径, stat, ETag)，文件不存在时返回 None"""
+        user_id = str(user_id)
+        await self._ready(user_id)
+        return await self.io.run(self._stat_entry, user_id, file_name)
+
+    def _stat_entry(self, user_id: str, file_name: str) -> Optional[Tuple[Path, os.stat_result, str]]:
+        resolved = self.blobs.resolve(user_id, file_name)
+        if resolved is None:
+            return None
+        path, entry = resolved
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return path, stat, self.blobs.etag(entry, stat)
+
+    async def stat_variant(
+        self, user_id: str, file_name: str, variant: str
+    ) -> Optional[Tuple[Path, os.stat_result, str]]:
+        """
+        返回图片变体的 (路径, stat, ETag)；尚未生成时排队并等待最多 wait_timeout 秒
+
+        不是图片、没有内容哈希（去重之前上传的文件）、生成失败或超时时返回 None
+        """
+        if not self.media or Path(file_name).suffix.lower() not in IMAGE_EXTENSIONS:
+            return None
+        user_id = str(user_id)
+        await self._ready(user_id)
+        entry = await self.io.run(self.blobs.index.get, user_id, file_name)
+        if entry is None or entry.sha256 is None:
+            return None
+        sha256 = entry.sha256
+        path = await self.media.get(sha256, self.blobs.blob_path(sha256), variant, self.media_wait_timeout)
+        if path is None:
+            return None
+        try:
+            stat = await self.io.run(os.stat, path)
+        except FileNotFoundError:
+            return None
+        return path, stat, f'"{sha256}-{variant}"'
+
+    async def delete(self, user_id: str, file_name: str) -> bool:
+        """删除用户文件，blob 不再被引用时回收；文件不存在时返回 False"""
+        user_id = str(user_id)
+        await self._ready(user_id)
+        async with self.user_locks(user_id):
+            try:
+                sha256 = await self.io.run(self.blobs.unlink, user_id, file_name)
+            except FileNotFoundError:
+                return False
+        await self._collect(sha256)
+        return True
+
+    async def list_files(
+        self, user_id: str, limit: int = 100, before: Optional[Tuple[int, str]] = None
+    ) -> Tuple[List[FileEntry], int]:
+        """从文件索引分页列出用户文件（按修改时间从新到旧），返回 (当前页, 总数)"""
+        user_id = str(user_id)
+        await self._ready(user_id)
+        entries = await self.io.run(self.blobs.index.list, user_id, limit, before)
+        total = await self.io.run(self.blobs.index.count, user_id)
+        return entries, total
+
+    # ---- 可续传上传 ----
+
+    async def create_session(self, user_id: str, file_name: str, size: int) -> UploadSession:
+        """创建上传会话；顺带清理过期会话（最多每分钟一次）"""
+        if size > self.resumable_max_size:
+            raise UploadTooLarge(self.resumable_max_size)
+        if time.monotonic() - self._last_expire > 60:
+            self._last_expire = time.monotonic()
+            await self.io.run(self.sessions.expire)
+        return await self.io.run(self.sessions.create, user_id, file_name, size)
+
+    async def get_session(self, session_id: str) -> UploadSession:
+        """读取会话进度，不存在或已过期时抛出 SessionNotFound"""
+        return await self.io.run(self.sessions.get, session_id)
+
+    async def write_chunk(self, session_id: str, offset: int, stream: AsyncIterator[bytes]) -> UploadSession:
+        """
+        从 offset 开始追加一段内容
+
+        offset 必须等于服务器已收到的字节数（否则抛出 OffsetMismatch，客户端按返回的
+        offset 续传）。请求体按 chunk_size 攒批写盘，中途断开时已写入的部分保留
+        """
+        async with self.session_locks(session_id):
+            session = await self.io.run(self.sessions.get, session_id)
+            if offset != session.offset:
+                raise OffsetMismatch(session.offset)
+
+            f = await self.io.run(open, self.sessions.part_path(session_id), "ab")
+            buffer = bytearray()
+            try:
+                async for data in stream:
+                    if session.offset + len(buffer) + len(data) > session.size:
+                        raise UploadTooLarge(session.size)
+                    buffer += data
+                    if len(buffer) >= self.chunk_size:
+                        await self.io.run(f.write, bytes(buffer))
+                        session.offset += len(buffer)
+                        buffer.clear()
+            finally:
+                if buffer:
+                    await self.io.run(f.write, bytes(buffer))
+                    session.offset += len(buffer)
+                await self.io.run(f.close)
+        return session
+
+    async def complete_session(self, session_id: str, sha256: Optional[str] = None) -> StoredUpload:
+        """
+        校验内容完整后把会话内容保存为用户文件（与 /upload/file 的结果相同）
+
+        sha256 与实际内容不一致时删除会话并抛出 ChecksumMismatch
+        """
+        async with self.session_locks(session_id):
+            session = await self.io.run(self.sessions.get, session_id)
+            if session.offset != session.size:
+                raise SessionIncomplete(session.offset, session.size)
+
+            part_path = self.sessions.part_path(session_id)
+            digest = await self.io.run(hash_file, part_path, self.chunk_size)
+            if sha256 and sha256.lower() != digest:
+                await self.io.run(self.sessions.remove, session_id)
+                raise ChecksumMismatch(f"SHA-256 不匹配: {digest}")
+
+            stored = await self._commit(
+                session.user_id,
+                unique_filename(session.file_name),
+                StoredUpload(part_path, session.size, digest)
+            )
+            await self.io.run(self.sessions.remove, session_id)
+        return stored
+
+    async def abort_session(self, session_id: str):
+        """放弃上传会话，不存在时抛出 SessionNotFound"""
+        async with self.session_locks(session_id):
+            await self.io.run(self.sessions.get, session_id)
+            await self.io.run(self.sessions.remove, session_id)
+
+    async def _ready(self, user_id: str):
+        """用户第一次被访问时把旧版平铺目录导入文件索引"""
+        if not self.blobs.index.is_indexed(user_id):
+            await self.io.run(self.blobs.index.ensure_user, user_id)
+
+    async def _link(self, user_id: str, file_name: str, sha256: str, size: int) -> Tuple[Path, Optional[str]]:
+        user_id = str(user_id)
+        await self._ready(user_id)
+        async with self.user_locks(user_id):
+            return await self.io.run(self.blobs.link, user_id, file_name, sha256, size)
+
+    async def _collect(self, sha256: Optional[str]):
+        if sha256 is None:
+            return
+        async with self.blob_locks(sha256):
+            collected = await self.io.run(self.blobs.collect, sha256)
+            if collected and self.media:
+                await self.io.run(self.media.discard, sha256)
+
+    async def close(self):
+        """停止后台媒体处理并关闭文件索引"""
+        if self.media:
+            await self.media.close()
+        self.blobs.index.close()
+
+    def stats(self) -> dict:
+        return {
+            "blobs_written": self.blobs_written,
+            "dedup_hits": self.dedup_hits,
+            "bytes_deduplicated": self.bytes_deduplicated,
+            "media": self.media.stats() if self.media else {"enabled": False},
+        }
+
+# 单例实例
+_upload_service = None
+
+def get_upload_service() -> UploadService:
+    global _upload_service
+    if _upload_service is None:
+        _upload_service = UploadService()
+    return _upload_service
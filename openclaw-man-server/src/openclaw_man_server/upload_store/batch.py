@@ -0,0 +1,223 @@
+import asyncio
+from typing import AsyncIterator, Callable, List, Optional, Union
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+from .streaming import StoredUpload
+
+# 每个文件在解析器与写盘任务之间最多缓冲的数据块数，写盘跟不上时暂停读取请求体
+PART_QUEUE_SIZE = 8
+
+# 事件标记：文件部分的头部已解析完，可以开始写盘
+_START = object()
+
+
+class BatchFormatError(Exception):
+    """请求体不是合法的 multipart/form-data"""
+
+
+class BatchTooLarge(Exception):
+    """批量上传的内容总大小超过限制"""
+
+    def __init__(self, max_total_size: int):
+        super().__init__(f"批量上传总大小超过限制，最大允许 {max_total_size // (1024 * 1024)} MB")
+        self.max_total_size = max_total_size
+
+
+class BatchPart:
+    """
+    批量上传中的一个文件
+
+    解析器通过 feed 写入内容，写盘任务通过 read 按块读取；
+    中间是有界队列，写盘慢时解析器（也就是请求体的读取）随之暂停
+    """
+
+    def __init__(self, index: int, original_name: str):
+        self.index = index
+        self.original_name = original_name
+        # 保存到用户目录的文件名与结果，由 UploadService 填写
+        self.file_name: Optional[str] = None
+        self.stored: Optional[StoredUpload] = None
+        self.error: Optional[str] = None
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=PART_QUEUE_SIZE)
+        self._buffer = bytearray()
+        self._eof = False
+        self._fed_eof = False
+        self._closed = False
+
+    @property
+    def success(self) -> bool:
+        return self.stored is not None
+
+    async def feed(self, data: Optional[bytes]):
+        """写入一段内容，None 表示内容结束；读取方已停止时直接丢弃"""
+        if data is None:
+            self._fed_eof = True
+        if not self._closed:
+            await self._queue.put(data)
+
+    def abort(self, error: BaseException):
+        """内容不会再完整到达（请求中断、超过总大小），让读取方收到 error"""
+        if self._fed_eof or self._closed:
+            return
+        self._fed_eof = True
+        self._drain()
+        self._queue.put_nowait(error)
+
+    def close(self):
+        """读取方已结束（成功或失败），丢弃缓冲内容，之后的 feed 不再阻塞"""
+        self._closed = True
+        self._drain()
+
+    def _drain(self):
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    async def read(self, size: int) -> bytes:
+        """读取最多 size 字节，凑满 size 或内容结束才返回；返回 b"" 表示结束"""
+        while not self._eof and len(self._buffer) < size:
+            data: Union[bytes, BaseException, None] = await self._queue.get()
+            if data is None:
+                self._eof = True
+            elif isinstance(data, BaseException):
+                raise data
+            else:
+                self._buffer += data
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return chunk
+
+
+def _decode(value: bytes, charset: str) -> str:
+    try:
+        return value.decode(charset)
+    except (UnicodeDecodeError, LookupError):
+        return value.decode("latin-1")
+
+
+class MultipartBatchReader:
+    """
+    流式解析 multipart/form-data 请求体
+
+    - 文件部分的头部一解析完就回调 on_file，调用方立即开始写盘，
+      前一个文件的剩余写盘/哈希与后一个文件的接收同时进行
+    - 非文件字段与空文件框被忽略
+    - 超过 max_files 的文件不写盘，记为失败；内容总大小超过 max_total_size 时
+      当前文件失败并停止读取，已完成的文件保留（truncated 为 True）
+    """
+
+    def __init__(self, content_type: str, max_files: int, max_total_size: int):
+        _, params = parse_options_header(content_type or "")
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise BatchFormatError("请求体必须是 multipart/form-data 并带有 boundary")
+        self.boundary = boundary
+        self.charset = _decode(params.get(b"charset", b"utf-8"), "latin-1")
+        self.max_files = max_files
+        self.max_total_size = max_total_size
+
+        self.parts: List[BatchPart] = []
+        self.total_size = 0
+        self.truncated = False
+
+        # 解析器回调是同步的，只记录 (part, 数据) 事件，由 run 在每次 write 之后处理
+        self._events: list = []
+        self._current: Optional[BatchPart] = None
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    # ---- 解析器回调 ----
+
+    def _on_part_begin(self):
+        self._current = None
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        file_name = options.get(b"filename")
+        if not file_name:
+            return
+        part = BatchPart(len(self.parts), _decode(file_name, self.charset))
+        self.parts.append(part)
+        self._current = part
+        if len(self.parts) > self.max_files:
+            part.error = f"单次最多上传 {self.max_files} 个文件"
+            part.close()
+        else:
+            self._events.append((part, _START))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._current is not None:
+            self._events.append((self._current, data[start:end]))
+
+    def _on_part_end(self):
+        if self._current is not None:
+            self._events.append((self._current, None))
+            self._current = None
+
+    # ---- 读取 ----
+
+    async def run(self, stream: AsyncIterator[bytes], on_file: Callable[[BatchPart], None]):
+        """读取整个请求体；请求中断或格式错误时让未完成的文件失败并抛出异常"""
+        parser = multipart.MultipartParser(self.boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+        try:
+            async for chunk in stream:
+                try:
+                    parser.write(chunk)
+                except ValueError as e:
+                    raise BatchFormatError(f"multipart 解析失败: {e}")
+                if not await self._dispatch(on_file):
+                    return
+            parser.finalize()
+            if any(not part._fed_eof for part in self.parts):
+                raise BatchFormatError("请求体不完整")
+        except BaseException as e:
+            self._abort_all(e if isinstance(e, Exception) else BatchFormatError("上传已中断"))
+            raise
+
+    async def _dispatch(self, on_file: Callable[[BatchPart], None]) -> bool:
+        """处理一次 write 产生的事件，超过总大小时返回 False"""
+        events, self._events = self._events, []
+        for part, data in events:
+            if data is _START:
+                on_file(part)
+                continue
+            if data:
+                self.total_size += len(data)
+                if self.total_size > self.max_total_size:
+                    self.truncated = True
+                    self._abort_all(BatchTooLarge(self.max_total_size))
+                    return False
+            await part.feed(data)
+        return True
+
+    def _abort_all(self, error: Exception):
+        for part in self.parts:
+            part.abort(error)
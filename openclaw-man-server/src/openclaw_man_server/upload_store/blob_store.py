@@ -0,0 +1,154 @@
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Optional, Set, Tuple
+
+from ..logger import get_logger
+from .file_index import FileEntry, FileIndex, guess_mime, shard_of
+
+logger = get_logger("upload_store")
+
+BLOB_DIR = ".blobs"
+TMP_SUFFIX = ".tmp"
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_sha256(value: str) -> bool:
+    return bool(value) and _SHA256_RE.match(value) is not None
+
+
+class BlobStore:
+    """
+    按内容寻址的上传文件存储
+
+    - 文件内容只保存一份: .blobs/{sha[:2]}/{sha[2:4]}/{sha}
+    - 用户文件 {user_id}/{shard}/{file_name} 是指向 blob 的硬链接；
+      blob 的链接数减一即为引用计数，由文件系统维护，崩溃后也不会失准
+    - 文件元数据索引（FileIndex）记录用户文件名 -> 路径、sha256 等，
+      删除文件时据此找到 blob，引用计数归零时回收 blob
+    - 文件系统不支持硬链接时退化为复制（不去重，但结果正确）
+
+    所有方法都是同步的，由 UploadService 在上传线程池中调用，
+    并保证同一用户、同一 blob 的调用不会并发执行
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blob_dir = self.root / BLOB_DIR
+        self.index = FileIndex(self.root)
+        # 已确认存在的分片目录
+        self._dirs: Set[Path] = set()
+
+    # ---- blob ----
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blob_dir / sha256[:2] / sha256[2:4] / sha256
+
+    def has(self, sha256: str) -> bool:
+        return is_sha256(sha256) and self.blob_path(sha256).is_file()
+
+    def size(self, sha256: str) -> int:
+        return self.blob_path(sha256).stat().st_size
+
+    def refcount(self, sha256: str) -> int:
+        try:
+            return self.blob_path(sha256).stat().st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def ingest(self, tmp_path: Path, sha256: str) -> bool:
+        """
+        把已写完的临时文件收为 blob，返回是否新写入
+
+        内容已存在时直接删除临时文件（去重命中）
+        """
+        blob = self.blob_path(sha256)
+        if blob.exists():
+            tmp_path.unlink(missing_ok=True)
+            return False
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, blob)
+        return True
+
+    def collect(self, sha256: str) -> bool:
+        """没有用户文件引用时删除 blob，返回是否已删除"""
+        blob = self.blob_path(sha256)
+        try:
+            if blob.stat().st_nlink > 1:
+                return False
+        except FileNotFoundError:
+            return False
+        blob.unlink(missing_ok=True)
+        return True
+
+    # ---- 用户文件 ----
+
+    def entry_path(self, user_id: str, entry: FileEntry) -> Path:
+        return self.root / user_id / entry.path
+
+    def resolve(self, user_id: str, file_name: str) -> Optional[Tuple[Path, FileEntry]]:
+        """按索引解析用户文件路径，不访问目录"""
+        entry = self.index.get(user_id, file_name)
+        if entry is None:
+            return None
+        return self.entry_path(user_id, entry), entry
+
+    def _ensure_dir(self, directory: Path):
+        if directory not in self._dirs:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._dirs.add(directory)
+
+    def link(self, user_id: str, file_name: str, sha256: str, size: int) -> Tuple[Path, Optional[str]]:
+        """
+        让用户文件指向 blob 并写入索引，返回 (文件路径, 被覆盖的旧文件的 sha256)；
+        旧 sha256 需要调用方回收
+
+        新文件放在分片子目录 {user_id}/{shard}/ 中；先链接到临时名再 os.replace，
+        同名文件被原子替换
+        """
+        blob = self.blob_path(sha256)
+        entry = FileEntry(
+            file_name, f"{shard_of(file_name)}/{file_name}", size, sha256, guess_mime(file_name), int(time.time())
+        )
+        target = self.entry_path(user_id, entry)
+        self._ensure_dir(target.parent)
+        # 指向同一 inode 的两个链接之间 rename 不会生效，已经指向该 blob 时无需重新链接
+        if not (target.exists() and os.path.samefile(target, blob)):
+            tmp_path = target.with_name(f".{target.name}{TMP_SUFFIX}")
+            tmp_path.unlink(missing_ok=True)
+            try:
+                os.link(blob, tmp_path)
+            except OSError as e:
+                logger.warning(f"创建硬链接失败，改为复制 {blob}: {e}")
+                shutil.copyfile(blob, tmp_path)
+            os.replace(tmp_path, target)
+
+        previous = self.index.put(user_id, entry)
+        if previous is None:
+            return target, None
+        if previous.path != entry.path:
+            # 覆盖的是旧版平铺目录中的同名文件
+            self.entry_path(user_id, previous).unlink(missing_ok=True)
+        return target, previous.sha256 if previous.sha256 != sha256 else None
+
+    @staticmethod
+    def etag(entry: FileEntry, stat: os.stat_result) -> str:
+        """
+        强 ETag：按内容寻址的文件直接使用 sha256；
+        去重之前上传的文件（没有 sha256）使用 inode + 修改时间 + 大小
+        """
+        sha256 = entry.sha256
+        if sha256 is None:
+            sha256 = f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        return f'"{sha256}"'
+
+    def unlink(self, user_id: str, file_name: str) -> Optional[str]:
+        """删除用户文件，返回它引用的 sha256（需要调用方回收）；文件不存在时抛出 FileNotFoundError"""
+        entry = self.index.remove(user_id, file_name)
+        if entry is None:
+            raise FileNotFoundError(file_name)
+        self.entry_path(user_id, entry).unlink(missing_ok=True)
+        return entry.sha256
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import mimetypes
+import os
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional, Set, Tuple
+
+from ..logger import get_logger
+
+logger = get_logger("upload_store")
+
+INDEX_DIR = ".index"
+DB_NAME = "files.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT,
+    mime TEXT,
+    mtime INTEGER NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_files_user_mtime ON files (user_id, mtime, name);
+CREATE TABLE IF NOT EXISTS indexed_users (
+    user_id TEXT PRIMARY KEY
+);
+"""
+
+_COLUMNS = "name, path, size, sha256, mime, mtime"
+
+
+def shard_of(file_name: str) -> str:
+    """文件名的分片目录：md5 前两位，每个用户最多 256 个子目录"""
+    return hashlib.md5(file_name.encode("utf-8")).hexdigest()[:2]
+
+
+def guess_mime(file_name: str) -> str:
+    return mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+
+
+class FileEntry:
+    """用户文件的元数据，path 为相对用户目录的路径"""
+
+    __slots__ = ("name", "path", "size", "sha256", "mime", "mtime")
+
+    def __init__(self, name: str, path: str, size: int, sha256: Optional[str], mime: str, mtime: int):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.mime = mime
+        self.mtime = mtime
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "sha256": self.sha256,
+            "mime": self.mime,
+            "mtime": self.mtime,
+        }
+
+
+class FileIndex:
+    """
+    上传文件元数据索引（SQLite: .index/files.db）
+
+    - 每个用户文件一行: 名称、相对路径、大小、sha256、mime、修改时间，
+      下载路径解析与文件列表都只查索引，不需要遍历目录或逐个 stat
+    - (user_id, mtime, name) 建有索引，按时间倒序分页
+    - 用户第一次被访问时扫描一次旧版平铺目录并导入旧的 .index/{user_id}.json，
+      之后索引是唯一的权威来源
+
+    连接在多个上传 I/O 线程间共享，由内部锁串行化
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.directory = self.root / INDEX_DIR
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.directory / DB_NAME), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = Lock()
+        self._indexed: Set[str] = set(
+            row[0] for row in self._conn.execute("SELECT user_id FROM indexed_users")
+        )
+
+    # ---- 旧数据导入 ----
+
+    def is_indexed(self, user_id: str) -> bool:
+        return user_id in self._indexed
+
+    def ensure_user(self, user_id: str):
+        """把旧版平铺目录中的文件导入索引（每个用户只执行一次）"""
+        if user_id in self._indexed:
+            return
+        with self._lock:
+            if user_id in self._indexed:
+                return
+            legacy_index = self.directory / f"{user_id}.json"
+            hashes = {}
+            if legacy_index.exists():
+                try:
+                    with open(legacy_index, "r", encoding="utf-8") as f:
+                        hashes = json.load(f)
+                except (json.JSONDecodeError, OSError) as e:
+                    logger.error(f"读取 {legacy_index} 失败: {e}")
+
+            rows = []
+            user_dir = self.root / user_id
+            if user_dir.is_dir():
+                with os.scandir(user_dir) as it:
+                    for item in it:
+                        if item.name.startswith(".") or not item.is_file():
+                            continue
+                        stat = item.stat()
+                        rows.append((
+                            user_id, item.name, item.name, stat.st_size,
+                            hashes.get(item.name), guess_mime(item.name), int(stat.st_mtime)
+                        ))
+
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    f"INSERT OR IGNORE INTO files (user_id, {_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                self._conn.execute("INSERT OR IGNORE INTO indexed_users (user_id) VALUES (?)", (user_id,))
+            legacy_index.unlink(missing_ok=True)
+            self._indexed.add(user_id)
+            if rows:
+                logger.info(f"用户 {user_id} 导入 {len(rows)} 个旧上传文件到索引")
+
+    # ---- 查询与修改 ----
+
+    def get(self, user_id: str, name: str) -> Optional[FileEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM files WHERE user_id = ? AND name = ?", (user_id, name)
+            ).fetchone()
+        return FileEntry(*row) if row else None
+
+    def put(self, user_id: str, entry: FileEntry) -> Optional[FileEntry]:
+        """写入（或覆盖同名）文件记录，返回被覆盖的旧记录"""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM files WHERE user_id = ? AND name = ?", (user_id, entry.name)
+            ).fetchone()
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO files (user_id, {_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, entry.name, entry.path, entry.size, entry.sha256, entry.mime, entry.mtime)
+            )
+        return FileEntry(*row) if row else None
+
+    def remove(self, user_id: str, name: str) -> Optional[FileEntry]:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM files WHERE user_id = ? AND name = ?", (user_id, name)
+            ).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM files WHERE user_id = ? AND name = ?", (user_id, name))
+        return FileEntry(*row) if row else None
+
+    def list(
+        self, user_id: str, limit: int = 100, before: Optional[Tuple[int, str]] = None
+    ) -> List[FileEntry]:
+        """按修改时间从新到旧分页，before 为上一页最后一条的 (mtime, name)"""
+        query = f"SELECT {_COLUMNS} FROM files WHERE user_id = ?"
+        params: list = [user_id]
+        if before is not None:
+            query += " AND (mtime < ? OR (mtime = ? AND name < ?))"
+            params += [before[0], before[0], before[1]]
+        query += " ORDER BY mtime DESC, name DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [FileEntry(*row) for row in rows]
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
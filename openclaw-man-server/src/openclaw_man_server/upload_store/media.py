@@ -0,0 +1,177 @@
+import asyncio
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from ..logger import get_logger
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pillow 是可选依赖: pip install "openclaw-man-server[media]"
+    Image = ImageOps = None
+
+logger = get_logger("upload_store")
+
+VARIANT_DIR = ".variants"
+VARIANT_SUFFIX = ".jpg"
+TMP_SUFFIX = ".tmp"
+
+# 生成缩略图 / 预览图的原图类型
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
+
+# 默认规格：变体名 -> 最长边像素
+DEFAULT_VARIANTS = {"thumb": 256, "preview": 1280}
+
+
+def media_available() -> bool:
+    return Image is not None
+
+
+def render_variant(source: str, target: str, max_edge: int, quality: int) -> int:
+    """
+    在子进程中执行：把原图按 EXIF 方向摆正、等比缩小到最长边 max_edge 并保存为 JPEG，
+    先写临时文件再原子替换，返回生成文件的大小
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + TMP_SUFFIX
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(tmp_path, "JPEG", quality=quality, optimize=True)
+    os.replace(tmp_path, target)
+    return os.path.getsize(target)
+
+
+class MediaPipeline:
+    """
+    图片缩略图 / 预览图的后台生成流水线
+
+    - 变体按内容寻址保存在 .variants/{sha[:2]}/{sha}/{variant}.jpg，
+      相同内容的图片（包括不同用户上传的）只生成一次
+    - 上传完成后 submit 只把任务放入有界队列（满了直接丢弃，下载时再补生成），
+      不阻塞上传请求；workers 个消费协程把任务交给进程池，解码缩放不占用事件循环和 GIL
+    - 同一 (sha, variant) 的任务在完成前只排队一次，下载方可以等待同一个 Future
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        variants: Optional[Dict[str, int]] = None,
+        workers: int = 2,
+        queue_size: int = 1000,
+        quality: int = 80
+    ):
+        self.directory = Path(root) / VARIANT_DIR
+        self.variants = dict(variants or DEFAULT_VARIANTS)
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.quality = quality
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+        self._pending: Dict[Tuple[str, str], asyncio.Future] = {}
+        # 统计信息
+        self.generated_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+
+    def variant_path(self, sha256: str, variant: str) -> Path:
+        return self.directory / sha256[:2] / sha256 / f"{variant}{VARIANT_SUFFIX}"
+
+    def _ensure_started(self):
+        """首次使用时在当前事件循环中创建队列、进程池和消费协程"""
+        if self._queue is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _enqueue(self, sha256: str, source: Path, variant: str) -> Optional[asyncio.Future]:
+        key = (sha256, variant)
+        future = self._pending.get(key)
+        if future is not None:
+            return future
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((key, source))
+        except asyncio.QueueFull:
+            self.dropped_count += 1
+            return None
+        self._pending[key] = future
+        return future
+
+    def submit(self, sha256: str, source: Path):
+        """为新上传的图片排队生成全部变体（不等待结果；已存在的变体由消费协程跳过）"""
+        for variant in self.variants:
+            self._enqueue(sha256, source, variant)
+
+    async def get(self, sha256: str, source: Path, variant: str, timeout: float) -> Optional[Path]:
+        """返回变体文件路径；尚未生成时排队并最多等待 timeout 秒，失败或超时返回 None"""
+        path = self.variant_path(sha256, variant)
+        if path.exists():
+            return path
+        future = self._enqueue(sha256, source, variant)
+        if future is None:
+            return None
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except Exception:
+            return None
+        return path
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key, source = await self._queue.get()
+            sha256, variant = key
+            target = self.variant_path(sha256, variant)
+            future = self._pending[key]
+            try:
+                if not target.exists():
+                    await loop.run_in_executor(
+                        self._pool, render_variant, str(source), str(target), self.variants[variant], self.quality
+                    )
+                    self.generated_count += 1
+                future.set_result(target)
+            except Exception as e:
+                self.failed_count += 1
+                logger.warning(f"生成 {variant} 失败 ({source}): {e}")
+                future.set_exception(e)
+                # 没有等待方时避免 "exception was never retrieved" 警告
+                future.exception()
+            finally:
+                self._pending.pop(key, None)
+
+    def discard(self, sha256: str):
+        """内容被回收时删除它的全部变体"""
+        shutil.rmtree(self.directory / sha256[:2] / sha256, ignore_errors=True)
+
+    async def close(self):
+        """停止消费协程并关闭进程池（队列中尚未处理的任务放弃，下载时会重新生成）"""
+        if self._queue is None:
+            return
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._queue = None
+        self._pool = None
+        self._worker_tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "variants": self.variants,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_flight": len(self._pending),
+            "generated": self.generated_count,
+            "failed": self.failed_count,
+            "dropped": self.dropped_count,
+        }
@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from ..logger import get_logger
+
+logger = get_logger("upload_store")
+
+SESSION_DIR = ".sessions"
+META_SUFFIX = ".json"
+PART_SUFFIX = ".part"
+TMP_SUFFIX = ".tmp"
+
+_SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SessionNotFound(Exception):
+    """上传会话不存在或已过期"""
+
+
+class OffsetMismatch(Exception):
+    """写入位置与服务器已收到的字节数不一致"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"写入位置不匹配，服务器已收到 {offset} 字节")
+        self.offset = offset
+
+
+class SessionIncomplete(Exception):
+    """内容尚未上传完整"""
+
+    def __init__(self, offset: int, size: int):
+        super().__init__(f"文件尚未上传完整: {offset}/{size} 字节")
+        self.offset = offset
+        self.size = size
+
+
+class ChecksumMismatch(Exception):
+    """上传内容与客户端声明的 SHA-256 不一致"""
+
+
+class UploadSession:
+    """
+    可续传的上传会话
+
+    offset 不单独保存，而是取 .part 文件的实际大小：
+    每次写入都只追加，服务重启或写到一半断开后，已落盘的字节数就是续传位置
+    """
+
+    __slots__ = ("session_id", "user_id", "file_name", "size", "created_at", "offset", "updated_at")
+
+    def __init__(
+        self,
+        session_id: str,
+        user_id: str,
+        file_name: str,
+        size: int,
+        created_at: int,
+        offset: int = 0,
+        updated_at: Optional[int] = None
+    ):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.file_name = file_name
+        self.size = size
+        self.created_at = created_at
+        self.offset = offset
+        self.updated_at = updated_at if updated_at is not None else created_at
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "file_name": self.file_name,
+            "size": self.size,
+            "created_at": self.created_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UploadSession":
+        return cls(data["session_id"], data["user_id"], data["file_name"], int(data["size"]), int(data["created_at"]))
+
+
+class SessionStore:
+    """
+    上传会话的持久化存储
+
+    - .sessions/{id}.json: 会话元数据（创建后不再修改）
+    - .sessions/{id}.part: 已收到的内容，只追加
+    - 超过 ttl 秒没有写入的会话视为放弃，由 expire 删除
+
+    所有方法都是同步的，由 UploadService 在上传线程池中调用，
+    并保证同一会话的调用不会并发执行
+    """
+
+    def __init__(self, root: Path, ttl: int = 24 * 3600):
+        self.directory = Path(root) / SESSION_DIR
+        self.ttl = ttl
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _meta_path(self, session_id: str) -> Path:
+        return self.directory / f"{session_id}{META_SUFFIX}"
+
+    def part_path(self, session_id: str) -> Path:
+        return self.directory / f"{session_id}{PART_SUFFIX}"
+
+    def create(self, user_id: str, file_name: str, size: int) -> UploadSession:
+        session = UploadSession(uuid.uuid4().hex, str(user_id), file_name, size, int(time.time()))
+        self.part_path(session.session_id).touch()
+        path = self._meta_path(session.session_id)
+        tmp_path = path.with_name(path.name + TMP_SUFFIX)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(session.to_dict(), f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return session
+
+    def get(self, session_id: str) -> UploadSession:
+        """读取会话与当前进度，不存在或已过期时抛出 SessionNotFound"""
+        if not _SESSION_ID_RE.match(session_id or ""):
+            raise SessionNotFound(session_id)
+        try:
+            with open(self._meta_path(session_id), "r", encoding="utf-8") as f:
+                session = UploadSession.from_dict(json.load(f))
+            stat = self.part_path(session_id).stat()
+        except FileNotFoundError:
+            raise SessionNotFound(session_id)
+        except (json.JSONDecodeError, KeyError, ValueError) as e:
+            logger.error(f"读取上传会话 {session_id} 失败: {e}")
+            raise SessionNotFound(session_id)
+
+        session.offset = stat.st_size
+        session.updated_at = int(stat.st_mtime)
+        if self._expired(session.updated_at):
+            self.remove(session_id)
+            raise SessionNotFound(session_id)
+        return session
+
+    def expires_at(self, session: UploadSession) -> int:
+        return session.updated_at + self.ttl
+
+    def _expired(self, updated_at: float) -> bool:
+        return time.time() - updated_at > self.ttl
+
+    def remove(self, session_id: str):
+        self._meta_path(session_id).unlink(missing_ok=True)
+        self.part_path(session_id).unlink(missing_ok=True)
+
+    def expire(self) -> int:
+        """删除超过 ttl 没有写入的会话，返回删除数量"""
+        removed = 0
+        for path in self.directory.glob(f"*{META_SUFFIX}"):
+            session_id = path.name[:-len(META_SUFFIX)]
+            try:
+                updated_at = self.part_path(session_id).stat().st_mtime
+            except FileNotFoundError:
+                try:
+                    updated_at = path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+            if self._expired(updated_at):
+                self.remove(session_id)
+                removed += 1
+        return removed
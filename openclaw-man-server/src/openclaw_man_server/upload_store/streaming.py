@@ -0,0 +1,95 @@
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from ..io_executor import IOExecutor, get_upload_executor
+
+# 每次从请求中读取并写盘的块大小，决定单个上传的内存峰值
+CHUNK_SIZE = 1024 * 1024
+# 上传根目录下存放未写完文件的目录
+TMP_DIR = ".tmp"
+
+
+class UploadTooLarge(Exception):
+    """上传内容超过大小限制"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"文件大小超过限制，最大允许 {max_size // (1024 * 1024)} MB")
+        self.max_size = max_size
+
+
+class StoredUpload:
+    """已落盘的上传文件"""
+
+    __slots__ = ("path", "size", "sha256")
+
+    def __init__(self, path: Path, size: int, sha256: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+
+def _write_chunk(f, hasher, chunk: bytes):
+    # 哈希与写盘一起在线程池中执行，大块数据的 sha256 计算不占用事件循环
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+def hash_file(path: Path, chunk_size: int = CHUNK_SIZE) -> str:
+    """分块计算文件的 SHA-256"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _commit(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+async def stream_to_temp(
+    read: Callable[[int], Awaitable[bytes]],
+    tmp_dir: Path,
+    max_size: int,
+    chunk_size: int = CHUNK_SIZE,
+    io: Optional[IOExecutor] = None
+) -> StoredUpload:
+    """
+    按块读取上传内容写入临时文件，同时计算 SHA-256
+
+    - 累计大小一旦超过 max_size 立即中止并删除临时文件（抛出 UploadTooLarge）
+    - 返回的 path 是已 fsync 的临时文件，调用方根据 sha256 决定把它 os.replace
+      到最终位置还是直接删除（tmp_dir 需与最终位置在同一文件系统），
+      下载方不会读到写了一半的文件
+    - 内存峰值与块大小有关，与文件大小无关
+    """
+    io = io or get_upload_executor()
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = tmp_dir / f"{uuid.uuid4().hex}.part"
+
+    hasher = hashlib.sha256()
+    size = 0
+    f = await io.run(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge(max_size)
+            await io.run(_write_chunk, f, hasher, chunk)
+        await io.run(_commit, f)
+    except BaseException:
+        f.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return StoredUpload(tmp_path, size, hasher.hexdigest())
@@ -1,73 +1,127 @@
 import asyncio
 import json
 import urllib.parse
+import time
 import websockets
-import hashlib
-from datetime import datetime
+from contextlib import nullcontext
 from jose import jwt, JWTError
 from websockets.server import serve
 import os
 from ..config import get_config
 from ..logger import get_logger
-from ..api_server.database import SessionLocal
-from ..api_server import models, auth
+from ..api_server.database import get_async_sessionmaker
+from ..api_server import crud, auth
+from ..api_server.credential_cache import get_credential_cache, robot_key, token_key
 from ..chat_history import get_chat_history_service
+from ..chat_persistence import get_chat_persistence_queue
+from .offline_outbox import get_offline_outbox
+from .outbound import OutboundQueue, OVERFLOW_DROP_OLDEST
+from .registry import ConnectionRegistry
+from .robot_pool import DISPATCH_HASH, RobotPools
+from .sequencer import ConversationSequencer
+from .stream_relay import StreamRelay
 
 logger = get_logger("server")
 
+
+def robot_recipient(robot_id) -> str:
+    return f"robot:{robot_id}"
+
+
+def user_recipient(user_id) -> str:
+    return f"user:{user_id}"
+
+
 class ManServerServer:
     def __init__(self):
         self.config = get_config()
         self.port = int(os.getenv("WS_PORT", "8812"))
         self.host = "0.0.0.0"
         
+        # 发送队列配置
+        ws_config = self.config.get("websocket", {})
+        self.send_queue_size = int(ws_config.get("send_queue_size", 256))
+        self.overflow_policy = ws_config.get("overflow_policy", OVERFLOW_DROP_OLDEST)
+        self.block_timeout = float(ws_config.get("block_timeout", 5))
+        # false 时不验证凭证：apiKey 直接作为 robot_id，token 直接作为 user_id（仅限本地调试）
+        self.verify_credentials = ws_config.get("verify_credentials", True)
+        # 已验证凭证的 TTL 缓存，重连时不再查数据库 / 解码 JWT
+        self.credentials = get_credential_cache()
+        # 离线暂存箱：收件人不在线时暂存消息，上线时一次性补发
+        self.outbox = get_offline_outbox() if ws_config.get("offline", {}).get("enabled", True) else None
+
         # 连接存储
-        # robot_connections: robot_id -> WebSocket 的映射
-        self.robot_connections = {}
-        # user_connections: 用户ID -> WebSocket 的映射
-        self.user_connections = {}
-        # user_active_robot: 用户ID -> 当前正在对话的 Robot ID
+        # robot_connections: robot_id -> 该机器人的实例池（多个 OpenClaw 连接，用户消息在其间调度）
+        self.robot_connections = RobotPools(ws_config.get("robot_dispatch", DISPATCH_HASH))
+        # user_connections: 用户ID -> 该用户全部设备的连接
+        self.user_connections = ConnectionRegistry()
+        # user_active_robot: 用户ID -> 最近连接的设备正在对话的 Robot ID
         self.user_active_robot = {}
         
         # 聊天记录服务
         self.chat_service = get_chat_history_service()
+        # 聊天记录写回队列（批量异步落盘）
+        self.persistence = get_chat_persistence_queue()
+        # 对话内消息序号与断线补发（resumeFrom）
+        resume_config = ws_config.get("resume", {})
+        self.max_replay = int(resume_config.get("max_replay", 500))
+        self.sequencer = ConversationSequencer(
+            self.chat_service,
+            recent_size=int(resume_config.get("recent_size", 64)),
+            max_conversations=int(resume_config.get("max_conversations", 100000))
+        )
+        # 流式回复：增量按时间 / 大小窗口合并后推送
+        stream_config = ws_config.get("stream", {})
+        self.stream_window = float(stream_config.get("window_ms", 50)) / 1000
+        self.stream_flush_bytes = int(stream_config.get("flush_bytes", 4096))
+        self.stream_max_bytes = int(stream_config.get("max_bytes", 1024 * 1024))
+        self.stream_idle_timeout = float(stream_config.get("idle_timeout", 60))
+        self.stream_max_streams = int(stream_config.get("max_streams", 16))
+        # 每个 OpenClaw 连接一个 StreamRelay
+        self.stream_relays = set()
 
-    def validate_api_key(self, api_key: str) -> str | None:
+    async def validate_api_key(self, api_key: str) -> str | None:
         """
-        验证 API Key
+        验证 API Key（结果按 TTL 缓存，无效 Key 也会缓存一小段时间）
         返回 robot_id (如果成功) 或 None
         """
         if not api_key:
             return None
             
-        hashed_key = hashlib.md5(api_key.encode()).hexdigest()
-        
-        db = SessionLocal()
         try:
-            # 查询是否存在该哈希值的机器人
-            robot = db.query(models.Robot).filter(models.Robot.api_key == hashed_key).first()
-            if robot:
-                logger.info(f"API Key 验证成功: 机器人 {robot.name} ({robot.robot_id}) Hash: {hashed_key}")
-                return robot.robot_id
-            else:
-                logger.warning(f"API Key 验证失败: {api_key[:10]}... (Hash: {hashed_key})")
-                return None
+            return await self.credentials.resolve(
+                robot_key(crud.hash_api_key(api_key)), lambda: self._lookup_api_key(api_key)
+            )
         except Exception as e:
             logger.error(f"数据库验证出错: {e}")
             return None
-        finally:
-            db.close()
 
-    def verify_token(self, token: str) -> int | None:
-        """验证 JWT Token 并返回 user_id"""
+    async def _lookup_api_key(self, api_key: str):
+        async with get_async_sessionmaker()() as db:
+            # 查询是否存在该哈希值的机器人
+            robot = await crud.get_robot_by_api_key(db, api_key)
+        if robot:
+            logger.info(f"API Key 验证成功: 机器人 {robot.name} ({robot.robot_id})")
+            return robot.robot_id, None
+        logger.warning(f"API Key 验证失败: {api_key[:10]}...")
+        return None, None
+
+    async def verify_token(self, token: str) -> int | None:
+        """验证 JWT Token 并返回 user_id（结果缓存到 Token 过期为止，最长 auth_cache.ttl 秒）"""
+        if not token:
+            return None
+        return await self.credentials.resolve(token_key(token), lambda: self._decode_token(token))
+
+    async def _decode_token(self, token: str):
         try:
             payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
             user_id: str = payload.get("sub")
             if user_id:
-                return int(user_id)
-        except JWTError:
+                exp = payload.get("exp")
+                return int(user_id), (exp - time.time()) if exp else None
+        except (JWTError, ValueError):
             pass
-        return None
+        return None, None
 
     async def start(self):
         """启动 WebSocket 服务器。"""
@@ -119,6 +173,38 @@ class ManServerServer:
         else:
             await websocket.send(data)
 
+    def create_outbound(self, websocket, name: str) -> OutboundQueue:
+        """为连接创建有界发送队列并启动写协程"""
+        return OutboundQueue(
+            websocket,
+            self.ws_send,
+            name,
+            maxsize=self.send_queue_size,
+            policy=self.overflow_policy,
+            block_timeout=self.block_timeout
+        ).start()
+
+    def get_connection_stats(self) -> dict:
+        """返回每个连接的发送队列统计信息与凭证缓存统计"""
+        return {
+            "robots": self.robot_connections.stats(),
+            "users": self.user_connections.stats(),
+            "auth_cache": self.credentials.stats(),
+            "offline": self.outbox.stats() if self.outbox is not None else None,
+            "sequencer": self.sequencer.stats(),
+            "streams": [relay.stats() for relay in self.stream_relays]
+        }
+
+    def offline_lock(self, recipient: str):
+        """收件人的暂存锁：串行化“判断是否在线 -> 实时发送 / 暂存”与“上线 -> 补发 -> 注册连接”"""
+        if self.outbox is None:
+            return nullcontext()
+        return self.outbox.locks(recipient)
+
+    def offline_busy(self, recipient: str) -> bool:
+        """收件人正在上线补发或暂存中，新消息需要排在其后"""
+        return self.outbox is not None and self.outbox.locks.locked(recipient)
+
     async def handle_stream_connection(self, websocket, params):
         # FastAPI WebSocket 使用 client_side 属性
         # 需要从 scope 获取 headers
@@ -143,22 +229,26 @@ class ManServerServer:
         target_robot_id = params.get("robotId", [None])[0]
         # 对话 ID (可选)
         conversation_id = params.get("conversationId", [None])[0]
+        # 机器人实例 ID (可选)：同一机器人多个 OpenClaw 进程时，固定的实例 ID 让重连后仍分到同样的对话
+        instance_id = params.get("instanceId", [None])[0]
+        # 断线重连时客户端已收到的最大 seq (可选)：补发该对话之后的消息
+        resume_from = params.get("resumeFrom", [None])[0]
 
         if api_key:#机器人连接
-            robot_id = api_key #self.validate_api_key(api_key)
+            robot_id = await self.validate_api_key(api_key) if self.verify_credentials else api_key
             if robot_id:
-                await self.handle_openclaw_connection(websocket, robot_id)
+                await self.handle_openclaw_connection(websocket, robot_id, instance_id)
             else:
                 logger.warning("连接被拒绝: API Key 无效")
                 await websocket.close(1008, "无效的 API Key")
         elif token:#用户连接
-            user_id = token #self.verify_token(token)
+            user_id = await self.verify_token(token) if self.verify_credentials else token
             if user_id:
                 if not target_robot_id:
                     logger.warning("连接被拒绝: 用户未指定 robotId")
                     await websocket.close(1008, "缺少 robotId 参数")
                     return
-                await self.handle_user_connection(websocket, user_id, target_robot_id, conversation_id)
+                await self.handle_user_connection(websocket, user_id, target_robot_id, conversation_id, resume_from)
             else:
                 logger.warning("连接被拒绝: Token 无效")
                 await websocket.close(1008, "无效的 Token")
@@ -166,9 +256,30 @@ class ManServerServer:
             logger.warning("连接被拒绝: 缺少身份凭证")
             await websocket.close(1008, "缺少身份信息")
 
-    async def handle_openclaw_connection(self, websocket, robot_id):
-        logger.info(f"OpenClaw 机器人已连接! ID: {robot_id}")
-        self.robot_connections[robot_id] = websocket
+    async def handle_openclaw_connection(self, websocket, robot_id, instance_id=None):
+        outbound = self.create_outbound(websocket, f"robot:{robot_id}")
+        async with self.offline_lock(robot_recipient(robot_id)):
+            instance = self.robot_connections.add(robot_id, outbound, instance_id)
+            logger.info(
+                f"OpenClaw 机器人已连接! ID: {robot_id} 实例: {instance.instance_id} "
+                f"(共 {len(self.robot_connections.instances(robot_id))} 个实例)"
+            )
+            # 机器人离线期间暂存的用户消息，按调度策略补发
+            if self.outbox is not None:
+                queued = await self.outbox.take(robot_recipient(robot_id))
+                if queued:
+                    sent = await self._dispatch_to_robot(robot_id, queued)
+                    logger.info(f"机器人 {robot_id} 上线: 补发 {sent}/{len(queued)} 条离线消息")
+        streams = StreamRelay(
+            robot_id,
+            self.user_connections.send,
+            window=self.stream_window,
+            flush_bytes=self.stream_flush_bytes,
+            max_bytes=self.stream_max_bytes,
+            idle_timeout=self.stream_idle_timeout,
+            max_streams=self.stream_max_streams
+        )
+        self.stream_relays.add(streams)
         try:
             while True:
                 try:
@@ -178,60 +289,282 @@ class ManServerServer:
                     
                 try:
                     data = json.loads(message)
-                    logger.info(f"[Robot {robot_id} -> Server] {data}")
+                    if data.get("type") == "stream":
+                        # 流式增量数量大，只在调试级别记录
+                        logger.debug(f"[Robot {robot_id} -> Server] {data}")
+                    else:
+                        logger.info(f"[Robot {robot_id} -> Server] {data}")
                     
                     # OpenClaw 发送回复给用户
                     if data.get("type") == "message":
                         msg_data = data.get("data", {})
-                        target_user_id = msg_data.get("recipientId") or msg_data.get("to")
-                        # 尝试转换 user_id 为 int (因为数据库 ID 是 int，但 json 可能是 str)
-                        try:
-                            target_user_id = int(target_user_id)
-                        except (ValueError, TypeError):
-                            pass
-                            
-                        text = msg_data.get("text")
-                        media_url = msg_data.get("mediaUrl")
-                        conversation_id = msg_data.get("conversationId")
-                        
-                        if target_user_id and (text or media_url):
-                            if target_user_id in self.user_connections:
-                                user_ws = self.user_connections[target_user_id]
-                                await self.ws_send(user_ws, json.dumps({
-                                    "sender": "Robot",
-                                    "robotId": robot_id,
-                                    "text": text,
-                                    "mediaUrl": media_url,
-                                    "conversationId": conversation_id
-                                }))
-                                logger.info(f"[Server -> User {target_user_id}] 已转发回复")
-                                
-                                # 保存机器人的回复到聊天记录
-                                asyncio.create_task(
-                                    self.chat_service.save_message(
-                                        user_id=str(target_user_id),
-                                        sender="robot",
-                                        text=text,
-                                        media_url=media_url,
-                                        robot_id=robot_id,
-                                        conversation_id=conversation_id,
-                                        message_id=f"msg_{ int(datetime.now().timestamp())}"
-                                    )
-                                )
-                            else:
-                                logger.warning(f"目标用户 {target_user_id} 未连接")
+                        target_user_id = self.to_user_id(msg_data.get("recipientId") or msg_data.get("to"))
+                        conversation_id = msg_data.get("conversationId") or "default"
+                        if target_user_id:
+                            instance.complete((str(target_user_id), conversation_id))
+                            await self._relay_reply(
+                                robot_id, target_user_id, conversation_id, msg_data.get("text"), msg_data.get("mediaUrl")
+                            )
+
+                    # OpenClaw 流式回复: start / delta / end
+                    elif data.get("type") == "stream":
+                        await self._relay_stream(robot_id, instance, streams, data.get("data", {}))
+
+                    # OpenClaw 确认收到用户消息：回执转发给该用户在线的设备（不暂存）
+                    elif data.get("type") == "ack":
+                        ack = data.get("data", {})
+                        ack_user_id = self.to_user_id(ack.get("userId"))
+                        if ack_user_id in self.user_connections:
+                            await self.user_connections.send(ack_user_id, json.dumps({
+                                "type": "delivered",
+                                "robotId": robot_id,
+                                "conversationId": ack.get("conversationId") or "default",
+                                "seq": ack.get("seq")
+                            }))
                                 
                 except json.JSONDecodeError:
                     logger.error("来自 OpenClaw 的 JSON 无效")
         except websockets.exceptions.ConnectionClosed:
             logger.info(f"OpenClaw 机器人 {robot_id} 已断开连接")
         finally:
-            if self.robot_connections.get(robot_id) == websocket:
-                del self.robot_connections[robot_id]
+            self.stream_relays.discard(streams)
+            await streams.abort_all()
+            self.robot_connections.remove(robot_id, instance)
+            await outbound.close()
+            # 尚未发出的用户消息转交给同一机器人的其他实例，没有其他实例时暂存
+            pending = outbound.take_pending()
+            if pending:
+                async with self.offline_lock(robot_recipient(robot_id)):
+                    moved = await self._dispatch_to_robot(robot_id, pending)
+                logger.info(f"机器人 {robot_id} 实例断开: {moved}/{len(pending)} 条未发送消息已转交其他实例")
+
+    async def _relay_reply(self, robot_id, user_id, conversation_id: str, text, media_url, stream_id=None):
+        """转发一条完整的机器人回复并保存到聊天记录"""
+        if not (text or media_url):
+            return
+        # 先分配 seq 并保存到聊天记录（用户不在线时也保存，重连后可按 seq 补发），再发送
+        message = await self.sequencer.commit(
+            user_id,
+            conversation_id,
+            lambda seq: self.chat_service.build_message(
+                sender="robot",
+                text=text,
+                media_url=media_url,
+                robot_id=robot_id,
+                conversation_id=conversation_id,
+                seq=seq
+            ),
+            lambda message: self.persistence.submit(str(user_id), message)
+        )
+        reply = {
+            "sender": "Robot",
+            "robotId": robot_id,
+            "text": text,
+            "mediaUrl": media_url,
+            "conversationId": conversation_id,
+            "seq": message["seq"],
+            "id": message["id"]
+        }
+        if stream_id:
+            # 流式回复的最终消息：客户端用它替换按增量拼出的内容，不支持流式的客户端照常显示
+            reply["streamId"] = stream_id
+        # 只序列化一次，同一字符串发往该用户的所有设备（不在线时暂存）
+        await self._deliver_to_user(user_id, json.dumps(reply))
+
+    async def _relay_stream(self, robot_id, instance, streams: StreamRelay, msg_data: dict):
+        """
+        处理一帧流式回复
+
+        增量合并后只推送给在线设备；end 时把完整回复（end 帧携带 text 时以它为准）
+        当作普通回复转发、暂存和保存，增量本身不保存
+        """
+        stream_id = msg_data.get("streamId")
+        if not stream_id:
+            return
+        event = msg_data.get("event")
+        if event == "abort":
+            await streams.abort(stream_id)
+            return
+
+        target_user_id = self.to_user_id(msg_data.get("recipientId") or msg_data.get("to"))
+        conversation_id = msg_data.get("conversationId") or "default"
+        if event in ("start", "delta"):
+            # 没有 start 直接发送 delta 时隐式开始
+            if stream_id not in streams and target_user_id:
+                instance.complete((str(target_user_id), conversation_id))
+                started = await streams.start(stream_id, target_user_id, conversation_id)
+                if not started and event == "start":
+                    logger.warning(
+                        f"机器人 {robot_id} 同时进行的流式回复超过 {streams.max_streams} 个，"
+                        f"流 {stream_id} 不推送增量，结束时转发完整回复"
+                    )
+            if event == "delta":
+                await streams.delta(stream_id, msg_data.get("delta") or msg_data.get("text") or "")
+        elif event == "end":
+            stream = await streams.end(stream_id)
+            if stream is not None:
+                target_user_id, conversation_id = stream.user_id, stream.conversation_id
+            if target_user_id:
+                instance.complete((str(target_user_id), conversation_id))
+                text = msg_data.get("text") or (stream.text if stream is not None else None)
+                await self._relay_reply(
+                    robot_id, target_user_id, conversation_id, text, msg_data.get("mediaUrl"), stream_id
+                )
+
+    @staticmethod
+    def to_user_id(value):
+        """尝试转换 user_id 为 int (因为数据库 ID 是 int，但 json 可能是 str)"""
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            return value
+
+    async def _replay(self, outbound: OutboundQueue, user_id, conversation_id: str, resume_from: int) -> int:
+        """
+        补发对话中 seq > resume_from 的消息，最后发送 resumed 通知，返回客户端此后已有的最大 seq
+
+        只读取遗漏的部分：内存中的最近消息或聊天记录中从最新一条向前读到 resume_from 为止
+        """
+        messages, truncated = await self.sequencer.missed(user_id, conversation_id, resume_from, self.max_replay)
+        for message in messages:
+            await outbound.send(json.dumps({
+                "sender": "Robot" if message.get("sender") == "robot" else "User",
+                "robotId": message.get("robot_id"),
+                "text": message.get("text"),
+                "mediaUrl": message.get("media_url"),
+                "conversationId": conversation_id,
+                "seq": message["seq"],
+                "id": message.get("id"),
+                "replay": True
+            }))
+        last_seq = max((m["seq"] for m in messages), default=resume_from)
+        await outbound.send(json.dumps({
+            "type": "resumed",
+            "conversationId": conversation_id,
+            "resumeFrom": resume_from,
+            "lastSeq": last_seq,
+            "count": len(messages),
+            # 遗漏超过 max_replay 条时只补发最新的部分，更早的需通过聊天记录接口获取
+            "truncated": truncated
+        }))
+        logger.info(f"用户 {user_id} 对话 {conversation_id} 从 seq {resume_from} 续传: 补发 {len(messages)} 条")
+        return last_seq
 
-    async def handle_user_connection(self, websocket, user_id, robot_id, url_conversation_id=None):
+    async def _dispatch_to_robot(self, robot_id, messages) -> int:
+        """
+        把已序列化的用户消息按调度键发往机器人池，返回实时发出的条数
+
+        没有在线实例时转入离线暂存箱（调用方需持有该机器人的暂存锁）
+        """
+        sent = 0
+        for data in messages:
+            try:
+                message = json.loads(data)["data"]
+                key = (message["userId"], message.get("conversationId") or "default")
+            except (ValueError, KeyError, TypeError):
+                continue
+            if await self._send_to_pool(robot_id, key, data) is not None:
+                sent += 1
+            elif self.outbox is not None:
+                await self.outbox.put(robot_recipient(robot_id), data)
+        return sent
+
+    async def _send_to_pool(self, robot_id, key, data: str):
+        """
+        按调度键发往机器人池中的一个实例，返回接收的实例；没有可用实例时返回 None
+
+        发送失败的实例（写协程已退出或被 disconnect 策略断开，但尚未注销）移出池后重新选择
+        """
+        while True:
+            instance = self.robot_connections.pick(robot_id, key)
+            if instance is None:
+                return None
+            if await instance.send(data, key):
+                return instance
+            logger.warning(f"机器人 {robot_id} 实例 {instance.instance_id} 发送失败，移出实例池")
+            self.robot_connections.remove(robot_id, instance)
+
+    def _robot_offline_error(self, robot_id) -> str:
+        """未启用离线暂存时，机器人不在线的错误提示"""
+        online_robots = list(self.robot_connections.keys())
+        logger.warning(f"目标机器人 {robot_id} 不在线。当前在线机器人: {online_robots}")
+        return json.dumps({
+            "sender": "系统",
+            "text": f"错误: 目标机器人 {robot_id} 不在线。当前在线: {online_robots}",
+            "error": "robot_offline"
+        })
+
+    async def _send_to_robot(self, robot_id, key, data: str):
+        """
+        发送一条用户消息，返回接收的实例；机器人不在线时暂存并返回 None
+
+        未启用离线暂存时不暂存，同样返回 None
+        """
+        recipient = robot_recipient(robot_id)
+        if robot_id in self.robot_connections and not self.offline_busy(recipient):
+            instance = await self._send_to_pool(robot_id, key, data)
+            if instance is not None:
+                return instance
+        async with self.offline_lock(recipient):
+            instance = await self._send_to_pool(robot_id, key, data)
+            if instance is not None or self.outbox is None:
+                return instance
+            await self.outbox.put(recipient, data)
+            return None
+
+    async def _deliver_to_user(self, user_id, data: str) -> bool:
+        """
+        发往用户的全部设备；用户不在线或没有任何连接成功入队（全部已关闭或因溢出被断开）时暂存。
+        返回消息是否已发出或暂存
+        """
+        recipient = user_recipient(user_id)
+        if user_id in self.user_connections and not self.offline_busy(recipient):
+            delivered = await self.user_connections.send(user_id, data)
+            if delivered:
+                logger.info(f"[Server -> User {user_id}] 已加入 {delivered} 个连接的发送队列")
+                return True
+        async with self.offline_lock(recipient):
+            if user_id in self.user_connections:
+                delivered = await self.user_connections.send(user_id, data)
+                if delivered:
+                    logger.info(f"[Server -> User {user_id}] 已加入 {delivered} 个连接的发送队列")
+                    return True
+            if self.outbox is None:
+                logger.warning(f"目标用户 {user_id} 没有可用的连接")
+                return False
+            await self.outbox.put(recipient, data)
+            logger.info(f"目标用户 {user_id} 没有可用的连接，消息已暂存")
+            return True
+
+    async def handle_user_connection(self, websocket, user_id, robot_id, url_conversation_id=None, resume_from=None):
         logger.info(f"用户 {user_id} 已连接 (目标机器人: {robot_id}, 会话: {url_conversation_id})")
-        self.user_connections[user_id] = websocket
+        outbound = self.create_outbound(websocket, f"user:{user_id}")
+        resume_conversation = url_conversation_id or "default"
+        try:
+            resume_from = int(resume_from) if resume_from is not None else None
+        except ValueError:
+            logger.warning(f"用户 {user_id} 的 resumeFrom 无效: {resume_from}")
+            resume_from = None
+        if resume_from is None:
+            # 未指定时从客户端上次 ack 的位置续传（本进程内记录的提交位置）
+            resume_from = self.sequencer.acked(user_id, resume_conversation)
+        async with self.offline_lock(user_recipient(user_id)):
+            # 断线期间遗漏的消息与离线暂存的回复先于实时消息进入发送队列
+            replayed_seq = None
+            if resume_from is not None:
+                replayed_seq = await self._replay(outbound, user_id, resume_conversation, resume_from)
+            if self.outbox is not None:
+                queued = await self.outbox.take(user_recipient(user_id))
+                for data in queued:
+                    if replayed_seq is not None:
+                        # 已随续传补发的同一对话消息不再重复发送
+                        frame = json.loads(data)
+                        if frame.get("conversationId") == resume_conversation and (frame.get("seq") or 0) <= replayed_seq:
+                            continue
+                    await outbound.send(data)
+                if queued:
+                    logger.info(f"用户 {user_id} 上线: 补发 {len(queued)} 条离线消息")
+            self.user_connections.add(user_id, outbound)
         self.user_active_robot[user_id] = robot_id
         
         try:
@@ -253,12 +586,23 @@ class ManServerServer:
                 # 处理 Ping 消息 (心跳)
                 # 即使机器人不在线，也应该回复 Pong
                 if msg_obj and msg_obj.get("type") == "ping":
-                    await self.ws_send(websocket, json.dumps({"type": "pong"}))
+                    await outbound.send(json.dumps({"type": "pong"}))
+                    continue
+
+                # 客户端确认收到 seq 及之前的消息，记录为该对话的续传位置
+                if msg_obj and msg_obj.get("type") == "ack":
+                    try:
+                        self.sequencer.ack(
+                            user_id,
+                            msg_obj.get("conversationId") or url_conversation_id or "default",
+                            int(msg_obj.get("seq"))
+                        )
+                    except (TypeError, ValueError):
+                        pass
                     continue
                 
-                # 检查目标机器人是否在线
-                robot_ws = self.robot_connections.get(robot_id)
-                if robot_ws:
+                # 检查目标机器人是否在线（启用离线暂存时不在线也接收，上线后送达）
+                if robot_id in self.robot_connections or self.outbox is not None:
                     # 解析用户消息
                     # 期望格式: JSON {"text": "...", "conversationId": "...", "filePath": "...", "mediaType": "..."}
                     # 如果不是 JSON，则作为纯文本
@@ -277,13 +621,28 @@ class ManServerServer:
                     if not text and not file_path:
                         continue
 
+                    # 先分配 seq 并保存用户消息到聊天记录，再发送
+                    message = await self.sequencer.commit(
+                        user_id,
+                        conversation_id,
+                        lambda seq: self.chat_service.build_message(
+                            sender="user",
+                            text=text,
+                            robot_id=robot_id,
+                            conversation_id=conversation_id,
+                            seq=seq
+                        ),
+                        lambda message: self.persistence.submit(str(user_id), message)
+                    )
+                    seq = message["seq"]
                     payload = {
                         "type": "message",
                         "data": {
                             "userId": str(user_id), # 转换为字符串以兼容
                             "text": text,
                             "conversationId": conversation_id,
-                            "id": f"msg_{int(datetime.now().timestamp())}"
+                            "id": message["id"],
+                            "seq": seq
                         }
                     }
                     
@@ -293,33 +652,38 @@ class ManServerServer:
                     if media_type:
                         payload["data"]["mediaType"] = media_type
                     
-                    await self.ws_send(robot_ws, json.dumps(payload))
-                    logger.info(f"[Server -> Robot {robot_id}] 已转发来自 {user_id} 的消息")
-                    
-                    # 保存用户消息到聊天记录
-                    asyncio.create_task(
-                        self.chat_service.save_message(
-                            user_id=str(user_id),
-                            sender="user",
-                            text=text,
-                            robot_id=robot_id,
-                            conversation_id=conversation_id,
-                            message_id=payload["data"]["id"]
+                    # 同一对话按调度策略发往机器人池中的一个实例
+                    key = (str(user_id), conversation_id)
+                    instance = await self._send_to_robot(robot_id, key, json.dumps(payload))
+                    if instance is None and self.outbox is None:
+                        # 未启用离线暂存，机器人在保存消息期间断开
+                        await outbound.send(self._robot_offline_error(robot_id))
+                        continue
+                    # 回执：告知客户端服务端已接收该消息及分配的 seq
+                    await outbound.send(json.dumps({
+                        "type": "ack",
+                        "conversationId": conversation_id,
+                        "seq": seq,
+                        "id": payload["data"]["id"]
+                    }))
+                    if instance is not None:
+                        logger.info(
+                            f"[Server -> Robot {robot_id}/{instance.instance_id}] 已将来自 {user_id} 的消息加入发送队列"
                         )
-                    )
-                else:
-                        online_robots = list(self.robot_connections.keys())
-                        logger.warning(f"目标机器人 {robot_id} 不在线。当前在线机器人: {online_robots}")
-                        await self.ws_send(websocket, json.dumps({
+                    else:
+                        logger.info(f"目标机器人 {robot_id} 不在线，来自 {user_id} 的消息已暂存")
+                        await outbound.send(json.dumps({
                             "sender": "系统",
-                            "text": f"错误: 目标机器人 {robot_id} 不在线。当前在线: {online_robots}",
-                            "error": "robot_offline"
+                            "text": f"目标机器人 {robot_id} 暂不在线，消息已暂存，上线后送达",
+                            "error": "robot_offline",
+                            "queued": True
                         }))
+                else:
+                    await outbound.send(self._robot_offline_error(robot_id))
                     
         except Exception as e:
             logger.info(f"用户 {user_id} 已断开连接: {e}")
         finally:
-            if self.user_connections.get(user_id) == websocket:
-                del self.user_connections[user_id]
-            if self.user_active_robot.get(user_id) == robot_id:
-                del self.user_active_robot[user_id]
+            if not self.user_connections.remove(user_id, outbound):
+                self.user_active_robot.pop(user_id, None)
+            await outbound.close()
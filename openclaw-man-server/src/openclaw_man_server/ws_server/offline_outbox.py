@@ -0,0 +1,236 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..config import get_config
+from ..io_executor import IOExecutor, get_io_executor
+from ..keyed_lock import KeyedLock
+from ..logger import get_logger
+
+logger = get_logger("server")
+
+OUTBOX_SUFFIX = ".jsonl"
+TMP_SUFFIX = ".tmp"
+
+
+def _outbox_name(recipient: str) -> str:
+    # 收件人 ID 可能包含任意字符，文件名使用摘要
+    return hashlib.md5(recipient.encode("utf-8")).hexdigest() + OUTBOX_SUFFIX
+
+
+class OfflineOutbox:
+    """
+    离线消息暂存箱（store-and-forward）
+
+    - 收件人（"user:{id}" / "robot:{id}"）不在线时，已序列化的消息追加写入
+      {directory}/{md5(收件人)}.jsonl，每行 "{入队时间}\\t{消息}"，服务重启后仍在
+    - 收件人上线时 take 一次读出全部未过期消息并删除文件，由调用方批量发送
+    - 每个收件人最多保留 max_messages 条、max_bytes 字节，超出时丢弃最旧的；
+      超过 ttl 秒的消息在读取时丢弃，整箱过期的文件由 expire 删除
+    - locks 按收件人串行化“判断是否在线 -> 暂存”与“上线 -> 取出 -> 注册连接”，
+      保证暂存的消息先于上线后的实时消息送达，也不会在两者之间丢失
+
+    文件读写都在 I/O 线程池中执行；追加、取出与过期删除在同一个文件锁内进行，
+    过期清理不会删掉刚追加的消息
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_messages: int = 200,
+        max_bytes: int = 1024 * 1024,
+        ttl: float = 7 * 24 * 3600,
+        fsync: bool = False,
+        io: Optional[IOExecutor] = None
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.fsync = fsync
+        self.io = io or get_io_executor()
+        self.locks = KeyedLock()
+        # 有暂存消息的文件 -> [条数, 字节数]（启动时的旧文件在第一次写入前按 None 记录，写入时再统计）
+        self._boxes: Dict[str, Optional[List[int]]] = {
+            name: None for name in os.listdir(self.directory) if name.endswith(OUTBOX_SUFFIX)
+        }
+        self._last_expire = 0.0
+        # I/O 线程间的文件锁：追加 / 取出 / 过期删除及 _boxes 的更新互斥
+        self._file_lock = threading.Lock()
+        # 统计信息
+        self.stored_count = 0
+        self.delivered_count = 0
+        self.dropped_count = 0
+
+    def _path(self, name: str) -> Path:
+        return self.directory / name
+
+    def has(self, recipient: str) -> bool:
+        """是否可能有暂存消息（不访问文件系统）"""
+        return _outbox_name(recipient) in self._boxes
+
+    # ---- 同步文件操作（在 I/O 线程中执行） ----
+
+    def _read(self, name: str) -> List[tuple]:
+        """读取 (入队时间, 消息) 列表，丢弃过期与损坏的行"""
+        deadline = time.time() - self.ttl
+        entries = []
+        try:
+            with open(self._path(name), "r", encoding="utf-8") as f:
+                for line in f:
+                    ts, sep, data = line.rstrip("\n").partition("\t")
+                    if not sep:
+                        continue
+                    try:
+                        ts = float(ts)
+                    except ValueError:
+                        continue
+                    if ts >= deadline:
+                        entries.append((ts, data))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _trim(self, entries: List[tuple]) -> List[tuple]:
+        """只保留最新的 max_messages 条且总大小不超过 max_bytes"""
+        kept = []
+        size = 0
+        for entry in reversed(entries):
+            size += len(entry[1]) + 1
+            if len(kept) >= self.max_messages or size > self.max_bytes:
+                break
+            kept.append(entry)
+        kept.reverse()
+        return kept
+
+    def _rewrite(self, name: str, entries: List[tuple]):
+        path = self._path(name)
+        tmp_path = path.with_name(path.name + TMP_SUFFIX)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for ts, data in entries:
+                f.write(f"{ts:.3f}\t{data}\n")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _append(self, name: str, data: str) -> int:
+        with self._file_lock:
+            return self._append_locked(name, data)
+
+    def _append_locked(self, name: str, data: str) -> int:
+        """追加一条消息，超出上限较多时压缩文件，返回丢弃条数"""
+        counters = self._boxes.get(name)
+        if counters is None:
+            # 启动前留下的旧文件：读一次统计条数与大小
+            entries = self._read(name)
+            counters = [len(entries), sum(len(d) + 1 for _, d in entries)]
+        with open(self._path(name), "a", encoding="utf-8") as f:
+            f.write(f"{time.time():.3f}\t{data}\n")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        counters[0] += 1
+        counters[1] += len(data) + 1
+        self._boxes[name] = counters
+
+        dropped = 0
+        # 允许超出 1/4 再压缩，避免持续溢出时每条消息都重写整个文件
+        if counters[0] > self.max_messages * 1.25 or counters[1] > self.max_bytes * 1.25:
+            entries = self._read(name)
+            kept = self._trim(entries)
+            dropped = counters[0] - len(kept)
+            self._rewrite(name, kept)
+            self._boxes[name] = [len(kept), sum(len(d) + 1 for _, d in kept)]
+        return dropped
+
+    def _take(self, name: str) -> tuple:
+        """返回 (消息列表, 因过期或超出上限丢弃的条数)"""
+        with self._file_lock:
+            entries = self._read(name)
+            kept = self._trim(entries)
+            counters = self._boxes.pop(name, None)
+            expired = counters[0] - len(entries) if counters else 0
+            self._path(name).unlink(missing_ok=True)
+        return [data for _, data in kept], expired + len(entries) - len(kept)
+
+    def _expire(self) -> int:
+        """删除最后一次写入已超过 ttl 的暂存文件，返回删除的文件数"""
+        removed = 0
+        for name in list(self._boxes):
+            # 每个文件在锁内重新检查修改时间：期间被追加过的文件不会删除
+            with self._file_lock:
+                if name not in self._boxes:
+                    continue
+                path = self._path(name)
+                try:
+                    expired = path.stat().st_mtime < time.time() - self.ttl
+                except FileNotFoundError:
+                    expired = True
+                if expired:
+                    path.unlink(missing_ok=True)
+                    del self._boxes[name]
+                    removed += 1
+        return removed
+
+    # ---- 对外接口（调用方需持有 locks(recipient)） ----
+
+    async def put(self, recipient: str, data: str):
+        """暂存一条发给离线收件人的消息"""
+        name = _outbox_name(recipient)
+        dropped = await self.io.run(self._append, name, data)
+        self.stored_count += 1
+        self.dropped_count += dropped
+        if dropped:
+            logger.warning(f"{recipient} 的离线消息超出上限，丢弃最旧的 {dropped} 条")
+        await self._maybe_expire()
+
+    async def take(self, recipient: str) -> List[str]:
+        """取出并删除收件人的全部暂存消息（按入队顺序）"""
+        name = _outbox_name(recipient)
+        if name not in self._boxes:
+            return []
+        messages, dropped = await self.io.run(self._take, name)
+        self.delivered_count += len(messages)
+        self.dropped_count += dropped
+        return messages
+
+    async def _maybe_expire(self):
+        now = time.monotonic()
+        if now - self._last_expire < min(self.ttl, 600):
+            return
+        self._last_expire = now
+        await self.io.run(self._expire)
+
+    def stats(self) -> dict:
+        return {
+            "recipients": len(self._boxes),
+            "stored": self.stored_count,
+            "delivered": self.delivered_count,
+            "dropped": self.dropped_count,
+        }
+
+
+# 单例实例
+_offline_outbox = None
+
+def get_offline_outbox() -> OfflineOutbox:
+    global _offline_outbox
+    if _offline_outbox is None:
+        offline_config = get_config().get("websocket", {}).get("offline", {})
+        directory = Path(offline_config.get("directory", "./offline"))
+        if not directory.is_absolute():
+            # 相对于项目根目录
+            directory = Path(__file__).parent.parent.parent.parent / directory
+        _offline_outbox = OfflineOutbox(
+            directory,
+            max_messages=int(offline_config.get("max_messages", 200)),
+            max_bytes=int(offline_config.get("max_bytes", 1024 * 1024)),
+            ttl=float(offline_config.get("ttl", 7 * 24 * 3600)),
+            fsync=offline_config.get("fsync", False)
+        )
+    return _offline_outbox
@@ -0,0 +1,135 @@
+import asyncio
+from ..logger import get_logger
+
+logger = get_logger("server")
+
+# 发送队列溢出策略
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # 丢弃队列中最旧的消息
+OVERFLOW_DISCONNECT = "disconnect"    # 断开慢消费者
+OVERFLOW_BLOCK = "block"              # 阻塞发送方直到队列有空位（超时后断开）
+
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DISCONNECT, OVERFLOW_BLOCK)
+
+
+class OutboundQueue:
+    """
+    单个 WebSocket 连接的有界发送队列
+    由独立的写协程消费，慢连接只会堆积自己的队列，不会阻塞其他连接的转发
+    """
+
+    def __init__(self, websocket, send_func, name: str, maxsize: int = 256,
+                 policy: str = OVERFLOW_DROP_OLDEST, block_timeout: float = 5.0):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {policy}")
+        self.websocket = websocket
+        self.name = name
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._send_func = send_func
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._writer_task = None
+        self.closed = False
+        # 统计信息
+        self.sent_count = 0
+        self.dropped_count = 0
+
+    def start(self):
+        """启动写协程"""
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer())
+        return self
+
+    async def send(self, data: str) -> bool:
+        """
+        将消息放入发送队列
+        返回 False 表示消息未入队（连接已关闭或因溢出被断开）
+        """
+        if self.closed:
+            return False
+
+        if self.policy == OVERFLOW_BLOCK:
+            try:
+                await asyncio.wait_for(self._queue.put(data), timeout=self.block_timeout)
+                return True
+            except asyncio.TimeoutError:
+                logger.warning(f"[{self.name}] 发送队列阻塞超时，断开慢连接")
+                self.dropped_count += 1
+                self._disconnect_slow_consumer()
+                return False
+
+        if self._queue.full():
+            if self.policy == OVERFLOW_DROP_OLDEST:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped_count += 1
+                except asyncio.QueueEmpty:
+                    pass
+            else:
+                logger.warning(f"[{self.name}] 发送队列已满 ({self._queue.maxsize})，断开慢连接")
+                self.dropped_count += 1
+                self._disconnect_slow_consumer()
+                return False
+
+        self._queue.put_nowait(data)
+        return True
+
+    async def _writer(self):
+        """写协程：逐条取出消息并发送"""
+        while True:
+            data = await self._queue.get()
+            try:
+                await self._send_func(self.websocket, data)
+                self.sent_count += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 半开连接：关闭 WebSocket，接收循环随之退出并注销连接
+                logger.info(f"[{self.name}] 发送失败，关闭连接: {e}")
+                self.closed = True
+                await self._close_websocket(1011, "发送失败")
+                return
+
+    def _disconnect_slow_consumer(self):
+        """关闭慢连接，接收循环会因此退出并完成清理"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer_task:
+            self._writer_task.cancel()
+        asyncio.create_task(self._close_websocket(1008, "发送队列溢出"))
+
+    async def _close_websocket(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code, reason)
+        except Exception:
+            pass
+
+    async def close(self):
+        """停止写协程并丢弃未发送的消息"""
+        self.closed = True
+        if self._writer_task:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._writer_task = None
+
+    def take_pending(self) -> list:
+        """取出尚未发送的消息（连接关闭后转交给其他连接）"""
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        return pending
+
+    def stats(self) -> dict:
+        """返回队列深度与丢弃计数等统计信息"""
+        return {
+            "name": self.name,
+            "policy": self.policy,
+            "depth": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "sent": self.sent_count,
+            "dropped": self.dropped_count,
+            "closed": self.closed,
+        }
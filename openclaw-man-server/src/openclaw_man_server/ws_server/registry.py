@@ -0,0 +1,82 @@
+import asyncio
+from typing import Dict, Hashable, Iterator, Optional, Tuple
+
+from .outbound import OutboundQueue
+
+
+class ConnectionRegistry:
+    """
+    连接注册表：每个键（用户ID）对应一组连接的发送队列
+
+    - 同一用户在多台设备上连接时各自保留，不会互相顶替
+    - 每组连接用 dict 充当有序集合：注册、注销都是 O(1)，并保留连接的先后顺序
+    - send 把同一个已序列化的字符串放入该键下所有连接的发送队列
+    - 已关闭的发送队列（发送失败或被断开，接收循环尚未注销）不算在线连接，查询时顺带移除
+    """
+
+    def __init__(self):
+        self._connections: Dict[Hashable, Dict[OutboundQueue, None]] = {}
+
+    def add(self, key: Hashable, outbound: OutboundQueue):
+        self._connections.setdefault(key, {})[outbound] = None
+
+    def remove(self, key: Hashable, outbound: OutboundQueue) -> bool:
+        """注销一个连接，返回该键下是否还有其他连接"""
+        group = self._connections.get(key)
+        if group is None:
+            return False
+        group.pop(outbound, None)
+        if not group:
+            del self._connections[key]
+            return False
+        return True
+
+    def _live(self, key: Hashable) -> Optional[Dict[OutboundQueue, None]]:
+        """该键下未关闭的连接，全部关闭时移除该键"""
+        group = self._connections.get(key)
+        if group is None:
+            return None
+        for outbound in [outbound for outbound in group if outbound.closed]:
+            del group[outbound]
+        if not group:
+            del self._connections[key]
+            return None
+        return group
+
+    def get(self, key: Hashable) -> Tuple[OutboundQueue, ...]:
+        """该键下的全部连接（按连接先后排列）"""
+        return tuple(self._live(key) or ())
+
+    def count(self, key: Hashable) -> int:
+        return len(self._live(key) or ())
+
+    async def send(self, key: Hashable, data: str) -> int:
+        """把消息放入该键下所有连接的发送队列，返回成功入队的连接数"""
+        group = self._live(key)
+        if not group:
+            return 0
+        if len(group) == 1:
+            return int(await next(iter(group)).send(data))
+        # block 策略下 send 可能等待，多个连接并发入队，慢设备不拖慢其他设备
+        results = await asyncio.gather(*(outbound.send(data) for outbound in tuple(group)))
+        return sum(1 for ok in results if ok)
+
+    def keys(self):
+        return self._connections.keys()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._live(key) is not None
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._connections)
+
+    def __len__(self) -> int:
+        """有连接的键数量"""
+        return len(self._connections)
+
+    def connection_count(self) -> int:
+        return sum(len(group) for group in self._connections.values())
+
+    def stats(self) -> dict:
+        """每个键下各连接的发送队列统计"""
+        return {str(key): [outbound.stats() for outbound in group] for key, group in self._connections.items()}
@@ -0,0 +1,125 @@
+import hashlib
+import uuid
+from typing import Dict, Hashable, Optional, Tuple
+
+from .outbound import OutboundQueue
+
+# 调度策略
+DISPATCH_HASH = "hash"                            # 按 (用户, 对话) 一致性哈希，同一对话固定在同一实例
+DISPATCH_LEAST_OUTSTANDING = "least_outstanding"  # 发往未完成请求最少的实例（进行中的对话仍留在原实例）
+
+DISPATCH_STRATEGIES = (DISPATCH_HASH, DISPATCH_LEAST_OUTSTANDING)
+
+# 调度键: (user_id, conversation_id)
+DispatchKey = Tuple[str, str]
+
+
+def _score(key: DispatchKey, instance_id: str) -> int:
+    """rendezvous 哈希得分：实例增减时只有落在该实例上的对话会迁移"""
+    digest = hashlib.blake2b(f"{key[0]}\x00{key[1]}\x00{instance_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class RobotInstance:
+    """同一 robot_id 下的一个 OpenClaw 连接"""
+
+    __slots__ = ("instance_id", "outbound", "pending", "outstanding", "dispatched")
+
+    def __init__(self, instance_id: str, outbound: OutboundQueue):
+        self.instance_id = instance_id
+        self.outbound = outbound
+        # 已发出、尚未收到回复的请求数，按调度键计
+        self.pending: Dict[DispatchKey, int] = {}
+        self.outstanding = 0
+        self.dispatched = 0
+
+    async def send(self, data: str, key: DispatchKey) -> bool:
+        if not await self.outbound.send(data):
+            return False
+        self.pending[key] = self.pending.get(key, 0) + 1
+        self.outstanding += 1
+        self.dispatched += 1
+        return True
+
+    def complete(self, key: DispatchKey):
+        """收到该对话的回复：视为该对话此前的请求都已完成（一个请求可能有多条回复）"""
+        count = self.pending.pop(key, 0)
+        self.outstanding -= count
+
+    def stats(self) -> dict:
+        stats = self.outbound.stats()
+        stats.update({
+            "instance_id": self.instance_id,
+            "outstanding": self.outstanding,
+            "dispatched": self.dispatched,
+        })
+        return stats
+
+
+class RobotPools:
+    """
+    机器人实例池：每个 robot_id 可以有多个 OpenClaw 连接，用户消息在它们之间调度
+
+    - hash: 按 (user_id, conversation_id) 做 rendezvous 哈希，同一对话始终发往同一实例，
+      实例断开时只有它负责的对话迁移到其他实例
+    - least_outstanding: 发往未完成请求最少的实例；对话有未完成请求时仍发往原实例，保证顺序
+    """
+
+    def __init__(self, strategy: str = DISPATCH_HASH):
+        if strategy not in DISPATCH_STRATEGIES:
+            raise ValueError(f"未知的机器人调度策略: {strategy}")
+        self.strategy = strategy
+        self._pools: Dict[str, Dict[OutboundQueue, RobotInstance]] = {}
+
+    def add(self, robot_id: str, outbound: OutboundQueue, instance_id: Optional[str] = None) -> RobotInstance:
+        """注册实例；instance_id 由 OpenClaw 提供时重连后仍分到同样的对话"""
+        pool = self._pools.setdefault(robot_id, {})
+        if not instance_id or any(i.instance_id == instance_id for i in pool.values()):
+            instance_id = uuid.uuid4().hex[:8]
+        instance = RobotInstance(instance_id, outbound)
+        pool[outbound] = instance
+        return instance
+
+    def remove(self, robot_id: str, instance: RobotInstance) -> bool:
+        """注销实例，返回该机器人是否还有其他实例"""
+        pool = self._pools.get(robot_id)
+        if pool is None:
+            return False
+        pool.pop(instance.outbound, None)
+        if not pool:
+            del self._pools[robot_id]
+            return False
+        return True
+
+    def pick(self, robot_id: str, key: DispatchKey) -> Optional[RobotInstance]:
+        """为一条用户消息选择实例，机器人不在线时返回 None"""
+        pool = self._pools.get(robot_id)
+        if not pool:
+            return None
+        instances = [i for i in pool.values() if not i.outbound.closed] or list(pool.values())
+        if len(instances) == 1:
+            return instances[0]
+        if self.strategy == DISPATCH_LEAST_OUTSTANDING:
+            for instance in instances:
+                if key in instance.pending:
+                    return instance
+            return min(instances, key=lambda i: (i.outstanding, -_score(key, i.instance_id)))
+        return max(instances, key=lambda i: _score(key, i.instance_id))
+
+    def instances(self, robot_id: str) -> Tuple[RobotInstance, ...]:
+        return tuple(self._pools.get(robot_id, {}).values())
+
+    def keys(self):
+        return self._pools.keys()
+
+    def __contains__(self, robot_id: Hashable) -> bool:
+        return robot_id in self._pools
+
+    def __len__(self) -> int:
+        return len(self._pools)
+
+    def stats(self) -> dict:
+        return {
+            robot_id: [instance.stats() for instance in pool.values()]
+            for robot_id, pool in self._pools.items()
+        }
@@ -0,0 +1,131 @@
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+
+from ..chat_history import ChatHistoryService
+from ..keyed_lock import KeyedLock
+
+# 序号键: (user_id, conversation_id)
+ConversationKey = Tuple[str, str]
+
+
+class _Conversation:
+    __slots__ = ("last_seq", "acked", "recent")
+
+    def __init__(self, last_seq: int, recent_size: int):
+        self.last_seq = last_seq
+        # 客户端确认收到的最大 seq（提交位置），未确认时为 None
+        self.acked: Optional[int] = None
+        # 最近分配过 seq 的消息（与持久化内容相同），短暂断线时直接从内存补发
+        self.recent: Deque[dict] = deque(maxlen=recent_size)
+
+
+class ConversationSequencer:
+    """
+    对话内消息序号分配与断线补发
+
+    - 每个 (用户, 对话) 的消息（用户消息与机器人回复）按到达 Bridge 的顺序分配单调递增的 seq，
+      从 1 开始，写入聊天记录；进程内第一次用到某个对话时从聊天记录中读取最新的 seq 继续分配
+    - commit 在对话锁内完成“分配 seq -> 构建消息 -> 记录 -> 提交写回队列”，
+      聊天记录与 recent 中的顺序始终与 seq 一致（向前读取遇到 seq <= resumeFrom 即可停止）
+    - 客户端 ack 的 seq 作为该对话的提交位置，重连未带 resumeFrom 时从这里补发
+    - recent 保存每个对话最近 recent_size 条消息：短暂断线时补发不访问存储，
+      也覆盖还在写回队列中、尚未落盘的消息
+    - 最多跟踪 max_conversations 个对话，超出时淘汰最久未使用的；被淘汰的对话下次从聊天记录恢复 seq
+      （若此时它仍有消息停留在写回队列中，恢复出的 seq 可能偏小，因此上限应远大于活跃对话数）
+    """
+
+    def __init__(self, chat_service: ChatHistoryService, recent_size: int = 64, max_conversations: int = 100000):
+        self.chat_service = chat_service
+        self.recent_size = recent_size
+        self.max_conversations = max_conversations
+        self._conversations: "OrderedDict[ConversationKey, _Conversation]" = OrderedDict()
+        # 同一对话第一次加载 seq 时只读取一次存储
+        self._locks = KeyedLock()
+        # 同一对话的消息按 seq 顺序提交
+        self._commit_locks = KeyedLock()
+        # 统计信息
+        self.assigned_count = 0
+        self.replayed_count = 0
+        self.memory_replays = 0
+        self.store_replays = 0
+
+    async def _get(self, key: ConversationKey) -> _Conversation:
+        state = self._conversations.get(key)
+        if state is not None:
+            self._conversations.move_to_end(key)
+            return state
+        async with self._locks(key):
+            state = self._conversations.get(key)
+            if state is None:
+                last_seq = await self.chat_service.last_seq(key[0], key[1])
+                state = _Conversation(last_seq, self.recent_size)
+                self._conversations[key] = state
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+            return state
+
+    async def commit(
+        self,
+        user_id,
+        conversation_id: str,
+        build: Callable[[int], dict],
+        submit: Callable[[dict], Awaitable]
+    ) -> dict:
+        """
+        为对话中的下一条消息分配 seq，用 build(seq) 构建聊天记录，记录到 recent 并交给 submit 保存
+
+        整个过程持有对话锁，后分配的 seq 不会先进入写回队列；网络发送应在返回后进行
+        """
+        key = (str(user_id), conversation_id)
+        async with self._commit_locks(key):
+            state = await self._get(key)
+            state.last_seq += 1
+            self.assigned_count += 1
+            message = build(state.last_seq)
+            state.recent.append(message)
+            await submit(message)
+        return message
+
+    def ack(self, user_id, conversation_id: str, seq: int):
+        """客户端确认收到 seq 及之前的消息"""
+        state = self._conversations.get((str(user_id), conversation_id))
+        if state is not None and seq <= state.last_seq and (state.acked is None or seq > state.acked):
+            state.acked = seq
+
+    def acked(self, user_id, conversation_id: str) -> Optional[int]:
+        state = self._conversations.get((str(user_id), conversation_id))
+        return state.acked if state is not None else None
+
+    async def missed(self, user_id, conversation_id: str, after_seq: int, limit: int) -> Tuple[List[dict], bool]:
+        """
+        seq > after_seq 的消息（按 seq 升序），返回 (消息列表, 是否超出 limit 被截断)
+
+        内存中的最近消息能覆盖时直接返回，否则从聊天记录读取遗漏部分，
+        再补上写回队列中尚未落盘的消息
+        """
+        state = await self._get((str(user_id), conversation_id))
+        if after_seq >= state.last_seq:
+            return [], False
+        recent = list(state.recent)
+        if recent and recent[0]["seq"] <= after_seq + 1:
+            messages = [m for m in recent if m["seq"] > after_seq]
+            truncated = False
+            self.memory_replays += 1
+        else:
+            messages, truncated = await self.chat_service.messages_after(user_id, conversation_id, after_seq, limit)
+            stored_seq = messages[-1]["seq"] if messages else after_seq
+            messages += [m for m in recent if m["seq"] > stored_seq]
+            self.store_replays += 1
+        truncated = truncated or len(messages) > limit
+        messages = messages[-limit:]
+        self.replayed_count += len(messages)
+        return messages, truncated
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._conversations),
+            "assigned": self.assigned_count,
+            "replayed": self.replayed_count,
+            "memory_replays": self.memory_replays,
+            "store_replays": self.store_replays,
+        }
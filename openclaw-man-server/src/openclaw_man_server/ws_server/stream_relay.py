@@ -0,0 +1,216 @@
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+# 发送给用户全部在线设备: (user_id, 已序列化的消息) -> 入队的连接数
+SendFunc = Callable[[Hashable, str], Awaitable[int]]
+
+
+class _Stream:
+    __slots__ = (
+        "stream_id", "user_id", "conversation_id", "parts", "size", "pending", "pending_size",
+        "timer", "lock", "last_active", "watchdog", "muted",
+    )
+
+    def __init__(self, stream_id: str, user_id, conversation_id: str):
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        # 全部增量（结束时拼成完整回复）
+        self.parts: List[str] = []
+        self.size = 0
+        # 尚未推送的增量
+        self.pending: List[str] = []
+        self.pending_size = 0
+        self.timer: Optional[asyncio.Task] = None
+        # 定时推送与按大小推送串行执行，保证增量顺序
+        self.lock = asyncio.Lock()
+        # 最后一次收到 start / delta 的时间，超过 idle_timeout 没有增量时停止推送
+        self.last_active = time.monotonic()
+        self.watchdog: Optional[asyncio.Task] = None
+        # 不再推送增量（超出 max_streams 或空闲超时），只收集完整回复
+        self.muted = False
+
+    def cancel_tasks(self):
+        for task in (self.timer, self.watchdog):
+            if task is not None:
+                task.cancel()
+        self.timer = self.watchdog = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+class StreamRelay:
+    """
+    一个 OpenClaw 连接上进行中的流式回复（start / delta / end）
+
+    - 增量先合并在缓冲区中：累计达到 flush_bytes 字节立即推送，否则在第一条未推送增量到达
+      window 秒后推送，token 级的增量不会变成每个用户成千上万的小帧
+    - 增量只推送给用户在线的设备，不暂存、不保存；结束时由调用方把完整回复当作普通消息转发并保存
+    - 单个流累计超过 max_bytes 时不再接收增量，结束时以已接收的部分为准
+    - 同时推送的流最多 max_streams 个，超出时新的流不推送任何帧（muted），
+      超过 idle_timeout 秒没有新增量的流推送 abort 后转为 muted；
+      muted 的流仍收集增量，end 时照常返回完整回复，回复不会丢失
+    """
+
+    def __init__(
+        self,
+        robot_id: str,
+        send: SendFunc,
+        window: float = 0.05,
+        flush_bytes: int = 4096,
+        max_bytes: int = 1024 * 1024,
+        idle_timeout: float = 60.0,
+        max_streams: int = 16
+    ):
+        self.robot_id = robot_id
+        self.send = send
+        self.window = window
+        self.flush_bytes = flush_bytes
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.max_streams = max_streams
+        self._streams: Dict[str, _Stream] = {}
+        # 正在推送（未 muted）的流数
+        self._pushing = 0
+        # 统计信息
+        self.delta_count = 0
+        self.frame_count = 0
+        self.rejected_count = 0
+        self.idle_count = 0
+
+    def __contains__(self, stream_id: str) -> bool:
+        return stream_id in self._streams
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def _frame(self, stream: _Stream, event: str, **fields) -> str:
+        return json.dumps({
+            "type": "stream",
+            "event": event,
+            "streamId": stream.stream_id,
+            "robotId": self.robot_id,
+            "conversationId": stream.conversation_id,
+            **fields
+        })
+
+    async def start(self, stream_id: str, user_id, conversation_id: str) -> bool:
+        """
+        开始一个流（同一 streamId 重复开始时沿用原来的流）
+
+        超出 max_streams 时仍然记录该流但不推送（每个流只拒绝一次），返回 False
+        """
+        if stream_id in self._streams:
+            return True
+        stream = _Stream(stream_id, user_id, conversation_id)
+        self._streams[stream_id] = stream
+        if self._pushing >= self.max_streams:
+            stream.muted = True
+            self.rejected_count += 1
+            return False
+        self._pushing += 1
+        stream.watchdog = asyncio.create_task(self._watch(stream))
+        await self.send(user_id, self._frame(stream, "start"))
+        return True
+
+    async def _watch(self, stream: _Stream):
+        """超过 idle_timeout 秒没有新增量时停止推送"""
+        while True:
+            await asyncio.sleep(stream.last_active + self.idle_timeout - time.monotonic())
+            if time.monotonic() - stream.last_active >= self.idle_timeout:
+                break
+        # 由自身发起，不能在 _mute 中取消当前任务
+        stream.watchdog = None
+        if self._streams.get(stream.stream_id) is stream:
+            self.idle_count += 1
+            await self._mute(stream)
+
+    async def _mute(self, stream: _Stream):
+        """停止推送并通知客户端丢弃已显示的增量，之后的增量只收集，end 时作为完整回复转发"""
+        if stream.timer is not None:
+            stream.timer.cancel()
+            stream.timer = None
+        async with stream.lock:
+            if stream.muted or self._streams.get(stream.stream_id) is not stream:
+                return
+            stream.muted = True
+            self._pushing -= 1
+            stream.pending.clear()
+            stream.pending_size = 0
+        await self.send(stream.user_id, self._frame(stream, "abort"))
+
+    async def delta(self, stream_id: str, text: str):
+        stream = self._streams.get(stream_id)
+        if stream is None or not text:
+            return
+        stream.last_active = time.monotonic()
+        size = len(text.encode("utf-8"))
+        if stream.size + size > self.max_bytes:
+            return
+        self.delta_count += 1
+        stream.parts.append(text)
+        stream.size += size
+        if stream.muted:
+            return
+        stream.pending.append(text)
+        stream.pending_size += size
+        if stream.pending_size >= self.flush_bytes:
+            await self._flush(stream)
+        elif stream.timer is None:
+            stream.timer = asyncio.create_task(self._flush_later(stream))
+
+    async def _flush_later(self, stream: _Stream):
+        await asyncio.sleep(self.window)
+        stream.timer = None
+        await self._flush(stream)
+
+    async def _flush(self, stream: _Stream):
+        """把缓冲区中的增量合并为一帧推送"""
+        async with stream.lock:
+            if not stream.pending:
+                return
+            delta = "".join(stream.pending)
+            stream.pending.clear()
+            stream.pending_size = 0
+            self.frame_count += 1
+            await self.send(stream.user_id, self._frame(stream, "delta", delta=delta))
+
+    def _remove(self, stream_id: str) -> Optional[_Stream]:
+        stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            stream.cancel_tasks()
+            if not stream.muted:
+                self._pushing -= 1
+        return stream
+
+    async def end(self, stream_id: str) -> Optional[_Stream]:
+        """推送剩余增量并结束流，返回流（包含完整回复，muted 的流同样返回），未知的 streamId 返回 None"""
+        stream = self._remove(stream_id)
+        if stream is not None and not stream.muted:
+            await self._flush(stream)
+        return stream
+
+    async def abort(self, stream_id: str):
+        """放弃一个流：已推送的增量由客户端丢弃，不保存"""
+        stream = self._remove(stream_id)
+        if stream is not None and not stream.muted:
+            await self.send(stream.user_id, self._frame(stream, "abort"))
+
+    async def abort_all(self):
+        """OpenClaw 连接断开时放弃所有未结束的流"""
+        for stream_id in list(self._streams):
+            await self.abort(stream_id)
+
+    def stats(self) -> dict:
+        return {
+            "active": self._pushing,
+            "muted": len(self._streams) - self._pushing,
+            "deltas": self.delta_count,
+            "frames": self.frame_count,
+            "rejected": self.rejected_count,
+            "idle_aborted": self.idle_count,
+        }